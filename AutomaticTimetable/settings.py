@@ -114,6 +114,17 @@ USE_I18N = True
 USE_TZ = True
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The timetable pages are cached here; use a shared backend (e.g. Redis) with several server processes
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
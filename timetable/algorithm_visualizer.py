@@ -1,4 +1,9 @@
-from .models import Course, Faculty, Room, TimeSlot, FacultyAvailability, Schedule
+from .instrumentation import RunStats
+from .problem import SchedulingProblem, bit_count
+from .scheduler import publish_schedule
+from .search import BacktrackingSearch
+from .trace import TraceWriter
+from collections import deque
 import time
 import json
 import random
@@ -8,182 +13,181 @@ class AnimatedTimetableScheduler:
     A version of the timetable scheduler that provides step-by-step updates
     for animation and visualization.
     """
-    def __init__(self):
-        self.courses = Course.objects.all()
-        self.rooms = Room.objects.all()
-        self.time_slots = TimeSlot.objects.all()
-        self.steps = []
+    def __init__(self, seed=None, profile=False):
+        self.stats = RunStats()
+        self.profile = profile
+        with self.stats.phase('load'):
+            self.problem = SchedulingProblem.from_db()
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.search = None
+        self.version = None
+        self.schedule = []
+        self.pending = deque()
+        self.total_steps = 0
         self.assignments_tried = 0
         self.backtracks = 0
-        self.current_step = 0
         
-    def get_step(self, step_number):
-        """Get a specific step from the algorithm execution"""
-        if step_number < len(self.steps):
-            return self.steps[step_number]
-        return None
-    
-    def get_next_step(self):
-        """Get the next step and update the current step counter"""
-        if self.current_step < len(self.steps):
-            step = self.steps[self.current_step]
-            self.current_step += 1
-            return step
-        return {'type': 'complete', 'message': 'Algorithm completed'}
-    
     def add_step(self, step_type, **kwargs):
-        """Add a step to the algorithm execution history"""
+        """Queue a step for iter_steps to hand out"""
         step = {'type': step_type, **kwargs}
-        self.steps.append(step)
+        self.pending.append(step)
         return step
     
-    def initialize(self):
-        """Initialize the algorithm and return the first few steps"""
-        # Clear any existing steps
-        self.steps = []
-        self.current_step = 0
+    def iter_steps(self, persist=True, activate=True):
+        """
+        Run the algorithm lazily, yielding its steps as they happen.
+        
+        The search advances one node at a time between yields, so only the
+        steps of the current node are held in memory however long the run
+        is. A timetable found is stored as a new version, published unless
+        activate is False (a candidate, as the visualizer pages keep it);
+        with persist=False the run leaves the stored timetables alone. The
+        steps are the same for the same seed either way.
+        """
+        self.pending = deque()
+        self.total_steps = 0
         self.assignments_tried = 0
         self.backtracks = 0
-        
-        # Clear any existing schedules
-        Schedule.objects.all().delete()
+        self.schedule = []
+        self.version = None
+        problem = self.problem
         
         self.add_step('init', message='Starting timetable generation algorithm...')
-        self.add_step('info', message='Clearing existing schedules...')
+        self.add_step('info', message='Keeping existing schedules until the new timetable is ready...')
         
         # Generate courses with sessions
-        courses_with_sessions = []
-        for course in self.courses:
-            for i in range(course.weekly_sessions):
-                courses_with_sessions.append((course, i+1))
-                self.add_step('info', 
-                             message=f"Added {course.code}: {course.name}, Session {i+1}/{course.weekly_sessions}")
+        for course, session in problem.sessions:
+            self.add_step('info', 
+                         message=f"Added {problem.course_codes[course]}: {problem.course_names[course]}, "
+                                 f"Session {session}/{problem.course_sessions[course]}")
         
         self.add_step('info', 
-                     message=f"Found {len(self.courses)} courses with {len(courses_with_sessions)} total sessions")
+                     message=f"Found {len(problem.course_ids)} courses with {len(problem.sessions)} total sessions")
+        yield from self._drain()
         
-        # Initialize the scheduling process
-        self.schedule_courses_step_by_step(courses_with_sessions)
-        
-        # Return the initial steps
-        return self.steps[:5]  # First 5 steps
+        # Run the search a node at a time; every search event becomes an animation step
+        self.search = BacktrackingSearch(problem, rng=random.Random(self.seed), listener=self.record_event)
+        if self.profile:
+            self.stats.profile(self.search)
+        with self.stats.phase('search'):
+            status = self.search.start()
+        while status == BacktrackingSearch.PAUSED:
+            yield from self._drain()
+            with self.stats.phase('search'):
+                status = self.search.run(max_nodes=1)
+        self.stats.record(self.search)
+        self.assignments_tried = self.search.nodes
+        self.backtracks = self.search.backtracks
+        if status == BacktrackingSearch.SOLVED:
+            self.schedule = self.search.assignments()
+            if persist:
+                with self.stats.phase('persist'):
+                    self.version = publish_schedule(problem.to_schedules(self.schedule), engine='backtracking',
+                                                    seed=self.seed, activate=activate)
+        yield from self._drain()
     
-    def schedule_courses_step_by_step(self, courses_to_schedule, index=0, depth=0):
-        """
-        Run the algorithm and generate all steps at once.
-        In a real implementation, this would be done incrementally.
-        """
-        # For this mock version, we'll generate some synthetic steps
-        if index >= len(courses_to_schedule):
-            self.add_step('complete', message="All courses successfully scheduled!")
-            return True
-            
-        course, session = courses_to_schedule[index]
-        self.add_step('course', 
-                     message=f"Scheduling {course.code} (Session {session}/{course.weekly_sessions})",
-                     course_code=course.code,
-                     course_name=course.name,
-                     session=session,
-                     total_sessions=course.weekly_sessions,
-                     depth=depth)
-        
-        # Get available time slots for this faculty
-        faculty = course.faculty
-        faculty_availabilities = FacultyAvailability.objects.filter(
-            faculty=faculty, is_available=True
-        ).values_list('time_slot_id', flat=True)
-        
-        available_time_slots = list(TimeSlot.objects.filter(id__in=faculty_availabilities))
-        
-        self.add_step('info', 
-                     message=f"Faculty {faculty.name} has {len(available_time_slots)} available time slots",
-                     faculty_name=faculty.name,
-                     available_slots=len(available_time_slots),
-                     depth=depth)
-        
-        # Try room and time slot combinations
-        success = False
+    def write_trace(self, stream, persist=True, activate=True):
+        """Run the algorithm, writing its steps to stream as a step trace; returns the step count"""
+        writer = TraceWriter(stream)
+        for step in self.iter_steps(persist, activate):
+            writer.append(step)
+        writer.close()
+        return writer.count
+    
+    def _drain(self):
+        """Hand out the queued steps"""
+        pending = self.pending
+        while pending:
+            self.total_steps += 1
+            yield pending.popleft()
+    
+    def record_event(self, event, index=None, slot=None, room=None, depth=1, **data):
+        """Turn a BacktrackingSearch event into animation steps"""
+        problem = self.problem
+        depth -= 1
         
-        # Shuffle time slots and rooms to get different results each time
-        random.shuffle(available_time_slots)
-        rooms = list(self.rooms)
-        random.shuffle(rooms)
+        if event == 'solved':
+            # Report the assignments from the deepest session up, as the recursive version did
+            for frame in reversed(self.search.stack):
+                fields = self._describe(frame.index, *frame.value)
+                self.add_step('success', 
+                             message=f"Assigned {fields['course_code']} to {fields['room_name']} at {fields['time_slot']}",
+                             depth=depth,
+                             **fields)
+                depth -= 1
+            self.add_step('complete', message="All courses successfully scheduled!")
+            return
+        if event == 'failed':
+            return
         
-        for time_slot in available_time_slots:
-            # Check if faculty is already scheduled
-            if Schedule.objects.filter(course__faculty=faculty, time_slot=time_slot).exists():
-                self.add_step('conflict', 
-                             message=f"Skip time slot {time_slot}: Faculty {faculty.name} already scheduled",
-                             faculty_name=faculty.name,
-                             time_slot=str(time_slot),
-                             reason="faculty_conflict",
-                             depth=depth)
-                continue
-                
-            for room in rooms:
-                self.assignments_tried += 1
-                
-                # Check if room is already booked
-                if Schedule.objects.filter(room=room, time_slot=time_slot).exists():
-                    self.add_step('conflict', 
-                                 message=f"Skip room {room.name} at {time_slot}: Room already booked",
-                                 room_name=room.name,
-                                 time_slot=str(time_slot),
-                                 reason="room_conflict",
-                                 depth=depth)
-                    continue
-                
-                # Try this assignment
-                self.add_step('attempt', 
-                             message=f"Try: {course.code} in {room.name} at {time_slot}",
-                             course_code=course.code,
-                             course_name=course.name,
-                             room_name=room.name,
-                             room_id=room.id,
-                             time_slot=str(time_slot),
-                             time_slot_id=time_slot.id,
-                             result="trying",
-                             depth=depth)
-                
-                # Add a schedule entry
-                schedule = Schedule.objects.create(
-                    course=course, 
-                    room=room, 
-                    time_slot=time_slot
-                )
-                
-                # Recursively try to schedule next course
-                if self.schedule_courses_step_by_step(courses_to_schedule, index + 1, depth + 1):
-                    self.add_step('success', 
-                                 message=f"Assigned {course.code} to {room.name} at {time_slot}",
-                                 course_code=course.code,
-                                 course_name=course.name,
-                                 room_name=room.name,
-                                 time_slot=str(time_slot),
-                                 depth=depth)
-                    success = True
-                    break
-                
-                # If we get here, this assignment didn't work
-                self.add_step('backtrack', 
-                             message=f"Backtrack: Remove {course.code} from {room.name} at {time_slot}",
-                             course_code=course.code,
-                             course_name=course.name,
-                             room_name=room.name,
-                             time_slot=str(time_slot),
-                             depth=depth)
-                
-                schedule.delete()
-                self.backtracks += 1
-            
-            if success:
-                break
+        course, session = problem.sessions[index]
+        code = problem.course_codes[course]
+        name = problem.course_names[course]
         
-        if not success:
+        if event == 'select':
+            self.add_step('course', 
+                         message=f"Scheduling {code} (Session {session}/{problem.course_sessions[course]})",
+                         course_code=code,
+                         course_name=name,
+                         session=session,
+                         total_sessions=problem.course_sessions[course],
+                         depth=depth)
+            faculty_name = problem.faculty_names[problem.course_faculty[course]]
+            slots_left = bit_count(self.search.domains[index])
+            self.add_step('info', 
+                         message=f"Faculty {faculty_name} has {slots_left} time slots left for this session",
+                         faculty_name=faculty_name,
+                         available_slots=slots_left,
+                         depth=depth)
+        elif event == 'nogood':
+            label = problem.slot_labels[slot]
+            self.add_step('conflict', 
+                         message=f"Skip time slot {label}: ruled out by an earlier dead end",
+                         course_code=code,
+                         time_slot=label,
+                         reason="nogood",
+                         depth=depth)
+        elif event == 'assign':
+            self.add_step('attempt', 
+                         message=f"Try: {code} in {problem.room_names[room]} at {problem.slot_labels[slot]}",
+                         result="trying",
+                         depth=depth,
+                         **self._describe(index, slot, room))
+        elif event == 'wipeout':
+            label = problem.slot_labels[slot]
+            self.add_step('conflict', 
+                         message=f"{code} at {label} leaves another session without a time slot",
+                         course_code=code,
+                         room_name=problem.room_names[room],
+                         time_slot=label,
+                         reason="wipeout",
+                         depth=depth)
+        elif event == 'backtrack':
+            self.add_step('backtrack', 
+                         message=f"Backtrack: Remove {code} from {problem.room_names[room]} at {problem.slot_labels[slot]}",
+                         depth=depth,
+                         **self._describe(index, slot, room))
+        elif event == 'backjump':
+            self.add_step('info', 
+                         message=f"Jump back over {code}: it is not part of the conflict",
+                         course_code=code,
+                         depth=depth)
+        elif event == 'exhausted':
             self.add_step('failure', 
-                         message=f"Failed to find valid slot for {course.code}",
-                         course_code=course.code,
-                         course_name=course.name,
+                         message=f"Failed to find valid slot for {code}",
+                         course_code=code,
+                         course_name=name,
                          depth=depth)
-                
-        return success
+    
+    def _describe(self, index, slot, room):
+        """Step fields identifying a session and its (slot, room) value"""
+        problem = self.problem
+        course = problem.sessions[index][0]
+        return {
+            'course_code': problem.course_codes[course],
+            'course_name': problem.course_names[course],
+            'room_name': problem.room_names[room],
+            'room_id': problem.room_ids[room],
+            'time_slot': problem.slot_labels[slot],
+            'time_slot_id': problem.slot_ids[slot],
+        }
@@ -0,0 +1,95 @@
+import base64
+import datetime
+import hashlib
+
+from .models import Schedule, TimeSlot
+
+# Columns of every row of the schedules API, in order
+FIELDS = [
+    'id', 'day', 'start_time', 'end_time', 'course_id', 'course_code', 'course_name',
+    'faculty_id', 'faculty_name', 'room_id', 'room_name',
+]
+COLUMNS = [
+    'id', 'time_slot__day', 'time_slot__start_time', 'time_slot__end_time', 'course_id', 'course__code',
+    'course__name', 'course__faculty_id', 'course__faculty__name', 'room_id', 'room__name',
+]
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+
+def schedule_filters(params):
+    """
+    Queryset filters from the query parameters faculty, room and course
+    (comma-separated ids), day (comma-separated day codes) and start/end
+    (HH:MM, classes within that time range). ValueError on bad values.
+    """
+    filters = {}
+    for name, lookup in (('faculty', 'course__faculty_id__in'), ('room', 'room_id__in'), ('course', 'course_id__in')):
+        if params.get(name):
+            try:
+                filters[lookup] = [int(value) for value in params[name].split(',')]
+            except ValueError:
+                raise ValueError(f"{name} must be a comma-separated list of ids")
+    if params.get('day'):
+        days = [value.strip().upper()[:3] for value in params['day'].split(',')]
+        valid = dict(TimeSlot.DAY_CHOICES)
+        unknown = [day for day in days if day not in valid]
+        if unknown:
+            raise ValueError(f"Unknown day {', '.join(unknown)}; use {', '.join(valid)}")
+        filters['time_slot__day__in'] = days
+    for name, lookup in (('start', 'time_slot__start_time__gte'), ('end', 'time_slot__end_time__lte')):
+        if params.get(name):
+            try:
+                filters[lookup] = datetime.time.fromisoformat(params[name])
+            except ValueError:
+                raise ValueError(f"{name} must be a time such as 09:00")
+    return filters
+
+
+def parse_limit(value):
+    if not value:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be a number")
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def encode_cursor(version_id, last_id):
+    return base64.urlsafe_b64encode(f"{version_id}:{last_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(version id, last schedule id) of a cursor from a previous page; ValueError when it is not one"""
+    try:
+        text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        version_id, last_id = text.split(':')
+        return int(version_id), int(last_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def schedule_page(version, filters, after=0, limit=DEFAULT_LIMIT):
+    """
+    One page of rows (lists in FIELDS order) of a version after the
+    schedule id `after`, and whether more follow. Keyset pagination on
+    the primary key, so every page costs the same however deep it is.
+    """
+    rows = list(schedule_queryset(version, filters, after)[:limit + 1])
+    more = len(rows) > limit
+    return [
+        [pk, day, start_time.strftime('%H:%M'), end_time.strftime('%H:%M'), *rest]
+        for pk, day, start_time, end_time, *rest in rows[:limit]
+    ], more
+
+
+def schedule_queryset(version, filters, after=0):
+    return Schedule.objects.filter(version=version, id__gt=after, **filters).order_by('id').values_list(*COLUMNS)
+
+
+def version_etag(version, query):
+    """ETag of an API response: the version, its last change and the query it answers"""
+    if version is None:
+        return hashlib.md5(f"none:{query}".encode()).hexdigest()
+    return hashlib.md5(f"{version.pk}:{version.updated_at.isoformat()}:{query}".encode()).hexdigest()
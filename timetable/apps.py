@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class TimetableConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "timetable"
+
+    def ready(self):
+        # Invalidate the cached timetable pages whenever what they show changes
+        from . import signals
+        signals.connect()
@@ -0,0 +1,131 @@
+import csv
+
+from django.db import connection, transaction
+
+from .models import Faculty, FacultyAvailability, TimeSlot
+
+# Columns of an availability CSV file; faculty is an id or an email address
+CSV_COLUMNS = ('faculty', 'day', 'start_time', 'available')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'off'}
+
+
+def availability_of(faculty):
+    """
+    {time_slot_id: is_available} for every time slot. A slot without a
+    stored row is unavailable, as it is to the scheduler (SchedulingProblem
+    only loads the available rows).
+    """
+    stored = dict(FacultyAvailability.objects.filter(faculty=faculty).values_list('time_slot_id', 'is_available'))
+    return {slot_id: stored.get(slot_id, False) for slot_id in TimeSlot.objects.values_list('id', flat=True)}
+
+
+def set_availability(wanted):
+    """
+    Apply {(faculty_id, time_slot_id): is_available} in one transaction.
+
+    The stored rows of the faculty involved are read with one query and
+    compared with what is wanted: missing pairs are inserted with
+    bulk_create and changed ones updated with one UPDATE per new value.
+    Both writes are split into batches the backend accepts, so the number
+    of queries grows with the number of batches only, not with the number
+    of faculty or slots.
+
+    Returns the counts of created and updated rows and the ids of the
+    faculty whose availability changed.
+    """
+    faculty_ids = {faculty_id for faculty_id, _ in wanted}
+    result = {'created': 0, 'updated': 0, 'faculty': set()}
+    with transaction.atomic():
+        stored = FacultyAvailability.objects.filter(faculty_id__in=faculty_ids).values_list(
+            'id', 'faculty_id', 'time_slot_id', 'is_available'
+        )
+        changed = {True: [], False: []}
+        missing = dict(wanted)
+        for pk, faculty_id, slot_id, is_available in stored:
+            value = missing.pop((faculty_id, slot_id), None)
+            if value is not None and value != is_available:
+                changed[value].append(pk)
+                result['faculty'].add(faculty_id)
+
+        FacultyAvailability.objects.bulk_create(
+            FacultyAvailability(faculty_id=faculty_id, time_slot_id=slot_id, is_available=value)
+            for (faculty_id, slot_id), value in missing.items()
+        )
+        # A pair without a row counts as unavailable, so only new available rows change anything
+        result['faculty'].update(faculty_id for (faculty_id, _), value in missing.items() if value)
+        for value, pks in changed.items():
+            if not pks:
+                continue
+            # Batched like bulk_create, so the IN list stays within the backend's query parameter limit
+            batch_size = connection.ops.bulk_batch_size(['id'], pks)
+            for start in range(0, len(pks), batch_size):
+                FacultyAvailability.objects.filter(pk__in=pks[start:start + batch_size]).update(is_available=value)
+        result['created'] = len(missing)
+        result['updated'] = len(changed[True]) + len(changed[False])
+    return result
+
+
+def faculty_lookup():
+    """Faculty ids by id and by email, to resolve file rows in memory"""
+    faculty = {}
+    for pk, email in Faculty.objects.values_list('id', 'email'):
+        faculty[str(pk)] = pk
+        faculty.setdefault(email.lower(), pk)
+    return faculty
+
+
+def slot_lookup():
+    """Time slot ids by (day, 'HH:MM'), to resolve file rows in memory"""
+    slots = {}
+    for pk, day, start_time in TimeSlot.objects.order_by('id').values_list('id', 'day', 'start_time'):
+        slots.setdefault((day, start_time.strftime('%H:%M')), pk)
+    return slots
+
+
+def parse_boolean(value):
+    """True or False from a file value such as yes, no, 1 or 0; ValueError otherwise"""
+    value = (value or '').strip().lower()
+    if value not in TRUE_VALUES | FALSE_VALUES:
+        raise ValueError(f"Invalid yes/no value '{value}'")
+    return value in TRUE_VALUES
+
+
+def availability_row(row, faculty, slots):
+    """((faculty_id, time_slot_id), is_available) from a file row; ValueError when it can't be resolved"""
+    faculty_id = faculty.get(str(row.get('faculty') or '').strip().lower())
+    if faculty_id is None:
+        raise ValueError(f"Unknown faculty '{row.get('faculty')}'")
+    try:
+        hour, minute = str(row.get('start_time') or '').strip().split(':')[:2]
+        start_time = f"{int(hour):02d}:{int(minute):02d}"
+    except ValueError:
+        start_time = None
+    slot_id = slots.get((str(row.get('day') or '').strip().upper()[:3], start_time))
+    if slot_id is None:
+        raise ValueError(f"No time slot on {row.get('day')} at {row.get('start_time')}")
+    return (faculty_id, slot_id), parse_boolean(str(row.get('available', '')))
+
+
+def read_availability_csv(lines):
+    """
+    Parse availability rows (faculty, day, start_time, available) from an
+    iterable of text lines. Returns the {(faculty_id, time_slot_id):
+    is_available} mapping for set_availability and a list of
+    (line number, message) errors for the rows that could not be read.
+    """
+    faculty, slots = faculty_lookup(), slot_lookup()
+    wanted = {}
+    errors = []
+    reader = csv.DictReader(lines)
+    absent = [column for column in CSV_COLUMNS if column not in (reader.fieldnames or ())]
+    if absent:
+        return wanted, [(1, f"Missing columns: {', '.join(absent)}")]
+    for row in reader:
+        try:
+            key, available = availability_row(row, faculty, slots)
+        except ValueError as e:
+            errors.append((reader.line_num, str(e)))
+            continue
+        wanted[key] = available
+    return wanted, errors
@@ -0,0 +1,72 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Bumped on every change to the data behind the cached pages, so old entries are never read again
+GENERATION_KEY = 'timetable:generation'
+# Seconds a cached grid or list lives (TIMETABLE_CACHE_TIMEOUT)
+DEFAULT_TIMEOUT = 300
+
+
+def get_cache():
+    """The cache of the timetable pages (TIMETABLE_CACHE, the default local-memory cache unless configured)"""
+    return caches[getattr(settings, 'TIMETABLE_CACHE', 'default')]
+
+
+def generation():
+    cache = get_cache()
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # Start from the clock so a lost counter can't bring old entries back
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        value = cache.get(GENERATION_KEY)
+    return value
+
+
+def invalidate(**kwargs):
+    """Forget every cached grid and list; also usable as a signal receiver"""
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def cached(name, build, *parts):
+    """
+    The value of build() for a name and key parts, cached until the next
+    invalidate(); every lookup is counted as a hit or a miss
+    """
+    cache = get_cache()
+    key = ':'.join(['timetable', name, str(generation())] + [str(part) for part in parts])
+    value = cache.get(key)
+    if value is None:
+        _count('misses')
+        value = build()
+        cache.set(key, value, getattr(settings, 'TIMETABLE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    else:
+        _count('hits')
+    return value
+
+
+def _count(name):
+    cache = get_cache()
+    key = f'timetable:{name}'
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def stats():
+    """Hit and miss counts of the timetable cache"""
+    cache = get_cache()
+    hits = cache.get('timetable:hits', 0)
+    misses = cache.get('timetable:misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+    }
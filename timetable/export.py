@@ -0,0 +1,139 @@
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Schedule, TimeSlot
+from .problem import DAYS
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ics': ('text/calendar', 'ics'),
+    'json': ('application/json', 'json'),
+}
+COLUMNS = ['day', 'start_time', 'end_time', 'course_code', 'course_name', 'faculty', 'faculty_email', 'room']
+# Rows fetched per round trip while streaming
+CHUNK_SIZE = 2000
+
+
+def export_rows(version, filter_type=None, selected_id=None):
+    """
+    The classes of a timetable version as plain rows, in day and time
+    order, from one joined query read with iterator() so that only
+    CHUNK_SIZE rows are in memory at a time. filter_type and selected_id
+    take the values of the timetable page (faculty, room or student).
+    """
+    return export_queryset(version, filter_type, selected_id).iterator(chunk_size=CHUNK_SIZE)
+
+
+def export_queryset(version, filter_type=None, selected_id=None):
+    schedules = Schedule.objects.filter(version=version)
+    if selected_id:
+        if filter_type == 'faculty':
+            schedules = schedules.filter(course__faculty_id=selected_id)
+        elif filter_type == 'room':
+            schedules = schedules.filter(room_id=selected_id)
+        elif filter_type == 'student':
+            schedules = schedules.filter(course_id=selected_id)
+    day_order = Case(*[When(time_slot__day=day, then=Value(number)) for number, day in enumerate(DAYS)],
+                     output_field=IntegerField())
+    return schedules.order_by(day_order, 'time_slot__start_time', 'room__name', 'id').values_list(
+        'id', 'time_slot__day', 'time_slot__start_time', 'time_slot__end_time', 'course__code', 'course__name',
+        'course__faculty__name', 'course__faculty__email', 'room__name', named=True,
+    )
+
+
+def export(export_format, rows, version):
+    """The rows as an iterator of text chunks in the given format (csv, ics or json)"""
+    return {'csv': csv_chunks, 'ics': ics_chunks, 'json': json_chunks}[export_format](rows, version)
+
+
+def row_values(row):
+    return [
+        row.time_slot__day, row.time_slot__start_time.strftime('%H:%M'), row.time_slot__end_time.strftime('%H:%M'),
+        row.course__code, row.course__name, row.course__faculty__name, row.course__faculty__email, row.room__name,
+    ]
+
+
+class Echo:
+    """A file-like object whose write returns the text, so csv.writer can produce one line at a time"""
+    def write(self, value):
+        return value
+
+
+def csv_chunks(rows, version):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(row_values(row))
+
+
+def json_chunks(rows, version):
+    """One JSON document written piece by piece: the version and the list of classes"""
+    yield '{"version": %s, "classes": [' % json.dumps(version.pk if version else None)
+    separator = '\n'
+    for row in rows:
+        yield separator + json.dumps(dict(zip(COLUMNS, row_values(row))))
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+def ics_chunks(rows, version):
+    """
+    An iCalendar file with one weekly recurring event per class, starting in
+    the week of TIMETABLE_TERM_START (this week by default) and repeating
+    until TIMETABLE_TERM_END when it is set
+    """
+    term_start = getattr(settings, 'TIMETABLE_TERM_START', None) or timezone.localdate()
+    if isinstance(term_start, str):
+        term_start = datetime.date.fromisoformat(term_start)
+    monday = term_start - datetime.timedelta(days=term_start.weekday())
+    term_end = getattr(settings, 'TIMETABLE_TERM_END', None)
+    if isinstance(term_end, str):
+        term_end = datetime.date.fromisoformat(term_end)
+    rule = 'FREQ=WEEKLY' + (f";UNTIL={term_end:%Y%m%d}T235959" if term_end else '')
+    stamp = (version.created_at if version else timezone.now()).astimezone(datetime.timezone.utc)
+    day_names = dict(TimeSlot.DAY_CHOICES)
+
+    yield ics_lines(['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//Automatic Timetable//EN', 'CALSCALE:GREGORIAN'])
+    for row in rows:
+        date = monday + datetime.timedelta(days=DAYS.index(row.time_slot__day))
+        start = datetime.datetime.combine(date, row.time_slot__start_time)
+        end = datetime.datetime.combine(date, row.time_slot__end_time)
+        yield ics_lines([
+            'BEGIN:VEVENT',
+            f"UID:schedule-{row.id}-{version.pk if version else 0}@timetable",
+            f"DTSTAMP:{stamp:%Y%m%dT%H%M%SZ}",
+            f"DTSTART:{start:%Y%m%dT%H%M%S}",
+            f"DTEND:{end:%Y%m%dT%H%M%S}",
+            f"RRULE:{rule}",
+            f"SUMMARY:{ics_text(f'{row.course__code}: {row.course__name}')}",
+            f"LOCATION:{ics_text(row.room__name)}",
+            f"DESCRIPTION:{ics_text(f'{row.course__faculty__name}, every {day_names[row.time_slot__day]}')}",
+            'END:VEVENT',
+        ])
+    yield ics_lines(['END:VCALENDAR'])
+
+
+def ics_text(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ics_lines(lines):
+    """Content lines ended by CRLF and folded at 75 octets, as RFC 5545 asks"""
+    folded = []
+    for line in lines:
+        data = line.encode()
+        while len(data) > 75:
+            # Continuation lines start with a space, which counts towards their 75 octets
+            cut = 75
+            # Never split a multi-byte character
+            while (data[cut] & 0xC0) == 0x80:
+                cut -= 1
+            folded.append(data[:cut].decode())
+            data = b' ' + data[cut:]
+        folded.append(data.decode())
+    return '\r\n'.join(folded) + '\r\n'
@@ -46,3 +46,43 @@ class FacultyAvailabilityForm(forms.ModelForm):
     class Meta:
         model = FacultyAvailability
         fields = ['faculty', 'time_slot', 'is_available']
+
+class BulkAvailabilityForm(forms.Form):
+    """Availability of many faculty members at once: picked ones, a whole department, or a CSV file"""
+    faculties = forms.ModelMultipleChoiceField(
+        queryset=Faculty.objects.order_by('name'), required=False,
+        widget=forms.SelectMultiple(attrs={'class': 'form-select', 'size': 8}),
+    )
+    department = forms.ChoiceField(required=False, widget=forms.Select(attrs={'class': 'form-select'}))
+    time_slots = forms.ModelMultipleChoiceField(
+        queryset=TimeSlot.objects.all(), required=False, widget=forms.CheckboxSelectMultiple,
+        help_text='Checked time slots are set available, the others unavailable.',
+    )
+    csv_file = forms.FileField(
+        required=False, widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv'}),
+        help_text='Columns: faculty (id or email), day, start_time, available. Replaces the selection above.',
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        departments = Faculty.objects.order_by('department').values_list('department', flat=True).distinct()
+        self.fields['department'].choices = [('', '---------')] + [(name, name) for name in departments]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('csv_file') and not cleaned_data.get('faculties') and not cleaned_data.get('department'):
+            raise forms.ValidationError("Select faculty members or a department, or upload a CSV file.")
+        return cleaned_data
+
+class ImportForm(forms.Form):
+    """A CSV or JSON Lines file of faculty, rooms, courses or availability to import"""
+    kind = forms.ChoiceField(choices=[
+        ('faculty', 'Faculty (name, department, email)'),
+        ('rooms', 'Rooms (name, capacity, has_projector)'),
+        ('courses', 'Courses (code, name, faculty, weekly_sessions)'),
+        ('availability', 'Faculty availability (faculty, day, start_time, available)'),
+    ], widget=forms.Select(attrs={'class': 'form-select'}))
+    file = forms.FileField(
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.json,.jsonl,.ndjson'}),
+        help_text='CSV with a header line, or JSON with one object per line. Faculty are referred to by id or email.',
+    )
@@ -0,0 +1,198 @@
+import csv
+import json
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .availability import availability_row, faculty_lookup, parse_boolean, set_availability, slot_lookup
+from .cache import invalidate
+from .models import Course, Faculty, Room
+
+# Rows written per bulk_create
+BATCH_SIZE = 1000
+# Errors kept for the report; the rest are only counted
+MAX_ERRORS = 100
+
+
+def read_rows(stream, format='csv'):
+    """
+    (line number, row dict) pairs from a text stream, read one line at a
+    time so the file is never held in memory: CSV with a header line, or
+    JSON Lines (one object per line)
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'json':
+        for line, text in enumerate(stream, 1):
+            if text.strip():
+                try:
+                    row = json.loads(text)
+                except ValueError as e:
+                    row = e
+                yield line, row
+    else:
+        raise ValueError(f"Unknown import format '{format}'")
+
+
+def format_for(filename):
+    """csv or json from a file name"""
+    return 'json' if filename.lower().endswith(('.json', '.jsonl', '.ndjson')) else 'csv'
+
+
+class Importer:
+    """
+    Streams rows of one kind (faculty, rooms, courses or availability)
+    into the database.
+
+    Lookups the rows need (existing keys and foreign keys) are loaded once
+    into dictionaries, each row is validated with the model's own field
+    validation, and valid rows are written with bulk_create every
+    batch_size rows, each batch in its own transaction. Rows whose key
+    (faculty email, room name, course code) already exists are skipped.
+    Availability rows are upserted with set_availability.
+    """
+    KINDS = ('faculty', 'rooms', 'courses', 'availability')
+    COLUMNS = {
+        'faculty': ('name', 'department', 'email'),
+        'rooms': ('name', 'capacity'),
+        'courses': ('code', 'name', 'faculty'),
+        'availability': ('faculty', 'day', 'start_time', 'available'),
+    }
+
+    def __init__(self, kind, batch_size=BATCH_SIZE, progress=None):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown import kind '{kind}'")
+        self.kind = kind
+        self.batch_size = batch_size
+        # Called with the importer after every batch
+        self.progress = progress
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = None
+        self.seconds = 0.0
+        self.batch = []
+
+    def run(self, rows):
+        """Import (line number, row) pairs, e.g. from read_rows(); returns the importer"""
+        self.started = time.perf_counter()
+        build = getattr(self, f'_{self.kind}')
+        self._load()
+        for line, row in rows:
+            self.rows += 1
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError(str(row) if isinstance(row, Exception) else 'Not an object')
+                absent = [column for column in self.COLUMNS[self.kind] if row.get(column) in (None, '')]
+                if absent:
+                    raise ValueError(f"Missing {', '.join(absent)}")
+                item = build(row)
+            except ValidationError as e:
+                self._error(line, '; '.join(f"{field}: {' '.join(errors)}" for field, errors in e.message_dict.items()))
+                continue
+            except ValueError as e:
+                self._error(line, str(e))
+                continue
+            if item is None:
+                self.skipped += 1
+                continue
+            self.batch.append(item)
+            if len(self.batch) >= self.batch_size:
+                self._flush()
+        self._flush()
+        self.seconds = time.perf_counter() - self.started
+        if self.created or self.updated:
+            # bulk_create sends no signals
+            invalidate()
+        return self
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else None
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'error_count': self.error_count,
+            'errors': [{'line': line, 'error': error} for line, error in self.errors],
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': None if self.rows_per_second is None else round(self.rows_per_second, 1),
+        }
+
+    def _error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def _flush(self):
+        if not self.batch:
+            return
+        with transaction.atomic():
+            if self.kind == 'availability':
+                result = set_availability(dict(self.batch))
+                self.created += result['created']
+                self.updated += result['updated']
+            else:
+                model = type(self.batch[0])
+                model.objects.bulk_create(self.batch)
+                self.created += len(self.batch)
+        self.batch = []
+        self.seconds = time.perf_counter() - self.started
+        if self.progress:
+            self.progress(self)
+
+    def _load(self):
+        """In-memory lookups: keys that already exist and the foreign keys rows refer to"""
+        if self.kind == 'faculty':
+            self.existing = {email.lower() for email in Faculty.objects.values_list('email', flat=True)}
+        elif self.kind == 'rooms':
+            self.existing = set(Room.objects.values_list('name', flat=True))
+        elif self.kind == 'courses':
+            self.existing = set(Course.objects.values_list('code', flat=True))
+            self.faculty = faculty_lookup()
+        else:
+            self.faculty, self.slots = faculty_lookup(), slot_lookup()
+
+    def _new(self, key, instance, exclude=()):
+        """The validated instance, or None when its key was already imported"""
+        if key in self.existing:
+            return None
+        instance.full_clean(exclude=exclude, validate_unique=False, validate_constraints=False)
+        self.existing.add(key)
+        return instance
+
+    def _faculty(self, row):
+        email = str(row['email']).strip()
+        return self._new(email.lower(), Faculty(
+            name=str(row['name']).strip(), department=str(row['department']).strip(), email=email,
+        ))
+
+    def _rooms(self, row):
+        name = str(row['name']).strip()
+        return self._new(name, Room(
+            name=name, capacity=row['capacity'],
+            has_projector=parse_boolean(str(row.get('has_projector') or 'no')),
+        ))
+
+    def _courses(self, row):
+        code = str(row['code']).strip()
+        faculty_id = self.faculty.get(str(row['faculty']).strip().lower())
+        if faculty_id is None:
+            raise ValueError(f"Unknown faculty '{row['faculty']}'")
+        return self._new(code, Course(
+            code=code, name=str(row['name']).strip(), faculty_id=faculty_id,
+            weekly_sessions=row.get('weekly_sessions') or 1,
+        ), exclude=['faculty'])
+
+    def _availability(self, row):
+        return availability_row(row, self.faculty, self.slots)
@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+from functools import wraps
+import time
+
+from django.db import connection
+
+
+class QueryCounter:
+    """Counts the ORM queries run while it is installed, and the time spent in them"""
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - start
+
+    @contextmanager
+    def count(self):
+        """Install the counter on the default connection for the duration of the block"""
+        with connection.execute_wrapper(self):
+            yield self
+
+
+class RunStats:
+    """
+    Timings and counters of one scheduling run.
+
+    phase() times a named step (load, search, persist; a name used twice
+    adds up) and counts the ORM queries issued during it. profile() also
+    times every constraint check of an engine by wrapping the methods named
+    in the engine's PROFILED attribute, on that instance only, so runs that
+    are not profiled pay nothing. Check times are inclusive: a check that
+    calls another one counts the inner one too.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.phase_queries = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.checks = {}
+        self.nodes = 0
+        self.backtracks = 0
+        self.max_depth = None
+
+    @contextmanager
+    def phase(self, name):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        try:
+            with counter.count():
+                yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+            self.phase_queries[name] = self.phase_queries.get(name, 0) + counter.queries
+            self.queries += counter.queries
+            self.query_seconds += counter.seconds
+
+    def profile(self, engine):
+        """Time the constraint checks of an engine, and of the search it drives if any"""
+        for name in getattr(engine, 'PROFILED', ()):
+            setattr(engine, name, self._timed(name, getattr(engine, name)))
+        inner = getattr(engine, 'search', None)
+        if inner is not None:
+            self.profile(inner)
+        return engine
+
+    def _timed(self, name, method):
+        entry = self.checks.setdefault(name, [0, 0.0])
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                entry[0] += 1
+                entry[1] += time.perf_counter() - start
+        return timed
+
+    def record(self, engine):
+        """Copy the search counters of a finished engine"""
+        self.nodes = engine.nodes
+        self.backtracks = engine.backtracks
+        self.max_depth = getattr(engine, 'max_depth', None)
+
+    @property
+    def nodes_per_second(self):
+        seconds = self.phases.get('search')
+        return self.nodes / seconds if seconds else None
+
+    def as_dict(self):
+        """Plain JSON-serialisable form"""
+        return {
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'total_seconds': round(sum(self.phases.values()), 6),
+            'queries': self.queries,
+            'phase_queries': dict(self.phase_queries),
+            'query_seconds': round(self.query_seconds, 6),
+            'nodes': self.nodes,
+            'backtracks': self.backtracks,
+            'nodes_per_second': None if self.nodes_per_second is None else round(self.nodes_per_second, 1),
+            'max_depth': self.max_depth,
+            'checks': {
+                name: {'calls': calls, 'seconds': round(seconds, 6),
+                       'mean_us': round(seconds / calls * 1e6, 2) if calls else None}
+                for name, (calls, seconds) in self.checks.items()
+            },
+        }
+
+    def summary(self):
+        """Human readable lines for command output"""
+        lines = []
+        for name, seconds in self.phases.items():
+            lines.append(f"{name:<8} {seconds:9.4f}s  {self.phase_queries[name]:5d} queries")
+        lines.append(f"{'total':<8} {sum(self.phases.values()):9.4f}s  {self.queries:5d} queries "
+                     f"({self.query_seconds:.4f}s in the database)")
+        rate = self.nodes_per_second
+        lines.append(f"nodes {self.nodes}, backtracks {self.backtracks}, "
+                     f"{'-' if rate is None else f'{rate:.0f}'} nodes/s, max depth "
+                     f"{'-' if self.max_depth is None else self.max_depth}")
+        for name, (calls, seconds) in sorted(self.checks.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<20} {calls:9d} calls {seconds:9.4f}s"
+                         f"  {seconds / calls * 1e6 if calls else 0:8.2f}us each")
+        return lines
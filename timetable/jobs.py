@@ -0,0 +1,217 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import OutputWrapper
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import GenerationJob
+from .scheduler import TimetableScheduler, VerboseTimetableScheduler
+
+# Generation replaces the whole timetable, so by default jobs run one at a time
+DEFAULT_WORKERS = 1
+# Engine name recorded for jobs that repair the active timetable instead of generating one
+REPAIR = 'repair'
+
+_executor = None
+_executor_lock = threading.Lock()
+_controls = {}
+_worker = None
+
+
+def worker_name():
+    """This process as host:pid:token, recorded on the jobs it queues (a new token after a fork)"""
+    global _worker
+    pid = os.getpid()
+    if _worker is None or _worker[1] != pid:
+        _worker = (f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}", pid)
+    return _worker[0]
+
+
+def get_executor():
+    """
+    The process-wide pool that runs generation jobs (TIMETABLE_JOB_WORKERS
+    threads). Jobs orphaned by an earlier process are failed when it starts.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            recover_jobs()
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'TIMETABLE_JOB_WORKERS', DEFAULT_WORKERS),
+                thread_name_prefix='timetable-job',
+            )
+        return _executor
+
+
+def submit_job(engine='backtracking', seed=None, verbose=False, activate=True):
+    """Record a generation job and queue it once the current transaction commits"""
+    if engine not in TimetableScheduler.ENGINES:
+        raise ValueError(f"Unknown scheduling engine '{engine}'")
+    job = GenerationJob.objects.create(engine=engine, seed=seed, verbose=verbose, activate=activate,
+                                       worker=worker_name())
+    transaction.on_commit(lambda: get_executor().submit(run_job, job.pk))
+    return job
+
+
+def submit_repair_job(seed=None):
+    """
+    Record a job that repairs the active timetable, full re-solve included,
+    and queue it once the current transaction commits
+    """
+    job = GenerationJob.objects.create(engine=REPAIR, seed=seed, worker=worker_name())
+    transaction.on_commit(lambda: get_executor().submit(run_job, job.pk))
+    return job
+
+
+def recover_jobs():
+    """
+    Fail the queued and running jobs whose process is gone: its queue lives
+    in memory and died with it, so they would never finish. Jobs of live
+    processes and of other hosts are left alone. Returns how many failed.
+    """
+    current = worker_name()
+    host, pid, _ = current.rsplit(':', 2)
+    orphaned = []
+    unfinished = GenerationJob.objects.filter(status__in=(GenerationJob.QUEUED, GenerationJob.RUNNING))
+    for job_id, worker in unfinished.exclude(worker=current).values_list('pk', 'worker'):
+        if not worker:
+            # Queued before jobs recorded their process
+            orphaned.append(job_id)
+            continue
+        job_host, job_pid, _ = worker.rsplit(':', 2)
+        # The same pid with another token is an earlier process (e.g. pid 1 of a restarted container)
+        if job_host == host and (job_pid == pid or not _alive(int(job_pid))):
+            orphaned.append(job_id)
+    return GenerationJob.objects.filter(pk__in=orphaned).update(
+        status=GenerationJob.FAILED, message="Interrupted: the server stopped before the job finished",
+        finished_at=timezone.now(),
+    )
+
+
+def _alive(pid):
+    if os.name != 'posix':
+        # No cheap check elsewhere: assume it is still running
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def cancel_job(job):
+    """Ask a job to stop: a queued job never starts, a running one stops at its next check"""
+    GenerationJob.objects.filter(pk=job.pk).update(cancel_requested=True)
+    control = _controls.get(job.pk)
+    if control is not None:
+        control.set()
+
+
+class JobControl:
+    """
+    The stop event handed to the engine of a job.
+
+    Engines poll is_set() regularly from the worker thread; about once per
+    INTERVAL seconds that poll also writes the job's progress and picks up
+    a cancellation requested through the database.
+    """
+    INTERVAL = 1.0
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.event = threading.Event()
+        self.scheduler = None
+        self.last_report = time.monotonic()
+
+    def set(self):
+        self.event.set()
+
+    def is_set(self):
+        now = time.monotonic()
+        if now - self.last_report >= self.INTERVAL:
+            self.last_report = now
+            self.report()
+        return self.event.is_set()
+
+    def report(self):
+        engine = getattr(self.scheduler, 'solver', None) or getattr(self.scheduler, 'search', None)
+        if engine is None:
+            return
+        # A two-phase solver reports through the slot search it is running
+        search = getattr(engine, 'search', engine)
+        fields = {'nodes': search.nodes}
+        depth = getattr(search, 'max_depth', None)
+        sessions = len(self.scheduler.problem.sessions)
+        if depth is not None and sessions:
+            fields['progress'] = depth / sessions
+        GenerationJob.objects.filter(pk=self.job_id).update(**fields)
+        if GenerationJob.objects.filter(pk=self.job_id, cancel_requested=True).exists():
+            self.event.set()
+
+
+def run_job(job_id):
+    """Run a queued job; called in a worker thread"""
+    control = JobControl(job_id)
+    _controls[job_id] = control
+    try:
+        job = GenerationJob.objects.get(pk=job_id)
+        if job.cancel_requested:
+            _finish(job_id, GenerationJob.CANCELLED, "Cancelled before it started")
+            return
+        GenerationJob.objects.filter(pk=job_id).update(status=GenerationJob.RUNNING, started_at=timezone.now())
+
+        buffer = io.StringIO()
+        if job.verbose:
+            scheduler = VerboseTimetableScheduler(OutputWrapper(buffer), seed=job.seed, profile=True, stop=control)
+        elif job.engine == REPAIR:
+            scheduler = TimetableScheduler(seed=job.seed, stop=control)
+        else:
+            scheduler = TimetableScheduler(engine=job.engine, seed=job.seed, stop=control)
+        control.scheduler = scheduler
+        if job.verbose:
+            scheduler.generate_timetable()
+        elif job.engine == REPAIR:
+            scheduler.repair_timetable()
+        else:
+            scheduler.generate_timetable(activate=job.activate)
+
+        # A cancelled run stores nothing, even when the engine still found a timetable
+        if scheduler.schedule and job.engine == REPAIR:
+            status, message = GenerationJob.SUCCEEDED, f"Repaired the timetable, {scheduler.solver.moved} classes moved"
+        elif scheduler.schedule:
+            status, message = GenerationJob.SUCCEEDED, f"Scheduled {len(scheduler.schedule)} classes"
+        elif control.event.is_set():
+            status, message = GenerationJob.CANCELLED, "Cancelled"
+        else:
+            status, message = GenerationJob.FAILED, "Couldn't generate a conflict-free timetable with current constraints."
+        fields = {
+            'seed': scheduler.seed,
+            'stats': scheduler.stats.as_dict(),
+            'nodes': scheduler.stats.nodes,
+            'log': buffer.getvalue(),
+            'version': scheduler.version,
+        }
+        if status == GenerationJob.SUCCEEDED:
+            fields['progress'] = 1.0
+        _finish(job_id, status, message, **fields)
+    except Exception as e:
+        _finish(job_id, GenerationJob.FAILED, f"Error generating timetable: {e}")
+    finally:
+        _controls.pop(job_id, None)
+        # Worker threads open their own database connection
+        connection.close()
+
+
+def _finish(job_id, status, message, **fields):
+    GenerationJob.objects.filter(pk=job_id).update(
+        status=status, message=message[:255], finished_at=timezone.now(), **fields
+    )
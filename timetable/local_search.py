@@ -0,0 +1,318 @@
+from .problem import DAYS, iter_bits
+import math
+import random
+import time
+
+
+class LocalSearchSolver:
+    """
+    Simulated annealing over complete timetables.
+
+    Every session always has a (slot, room) value taken from its faculty's
+    available slots and its eligible rooms; the remaining constraints are
+    scored instead of enforced:
+
+    - hard: two sessions of a faculty in the same slot, two sessions in the
+      same room and slot, two sessions of a course on the same day (when the
+      faculty has enough days to spread them, as in BacktrackingSearch)
+    - soft: sessions of a course sharing a day otherwise, and unbalanced
+      faculty days (sum of squared sessions per faculty day, above the best
+      possible balance)
+
+    The score is hard_weight * hard + soft. It is kept up to date through
+    per faculty/room/course counters, so a move is evaluated by looking at
+    the handful of counters it touches (delta evaluation) rather than by
+    rescoring the timetable.
+
+    The search starts from a greedy timetable (or from an initial partial
+    assignment) and tries three kinds of moves: move one session to another
+    slot and room, swap the values of two sessions, and Kempe chains (swap
+    two slots for the connected group of sessions whose faculties link them).
+    Worse moves are accepted with probability exp(-delta / temperature); the
+    temperature cools geometrically and is reheated when the search stalls.
+    It stops at the target score, when the time budget is spent or the stop
+    event is set, or when a conflict-free timetable has not improved for
+    `patience` iterations.
+    """
+    # Constraint checks timed by RunStats.profile
+    PROFILED = ('_cost', '_in_conflict')
+
+    def __init__(self, problem, rng=None, time_limit=10.0, target=0, hard_weight=100,
+                 patience=50000, initial=None, stop=None):
+        self.problem = problem
+        self.rng = rng or random.Random()
+        self.stop = stop
+        self.time_limit = time_limit
+        self.target = target
+        self.hard_weight = hard_weight
+        self.patience = patience
+        self.initial = initial or {}
+        self.sessions = problem.sessions
+
+        num_days = len(DAYS)
+        self.session_slots = [
+            list(iter_bits(problem.faculty_available[problem.course_faculty[course]]))
+            for course, _ in self.sessions
+        ]
+        self.session_rooms = [list(iter_bits(problem.course_rooms[course])) for course, _ in self.sessions]
+
+        # Sessions of a course go on different days whenever the faculty has enough days for them
+        self.spread_days = []
+        for course in range(len(problem.course_ids)):
+            available = problem.faculty_available[problem.course_faculty[course]]
+            days = sum(1 for mask in problem.day_masks if available & mask)
+            self.spread_days.append(problem.course_sessions[course] <= days)
+
+        # Best possible day balance: each faculty's sessions spread evenly over their available days
+        self.balance_bound = 0
+        for faculty in range(len(problem.faculty_ids)):
+            days = sum(1 for mask in problem.day_masks if problem.faculty_available[faculty] & mask)
+            sessions = sum(problem.course_sessions[course] for course, owner in enumerate(problem.course_faculty)
+                           if owner == faculty)
+            if days:
+                share, extra = divmod(sessions, days)
+                self.balance_bound += extra * (share + 1) ** 2 + (days - extra) * share ** 2
+
+        self.values = [None] * len(self.sessions)
+        self.faculty_slot = [[0] * problem.num_slots for _ in problem.faculty_ids]
+        self.room_slot = [[0] * problem.num_slots for _ in range(problem.num_rooms)]
+        self.room_used = [0] * problem.num_slots
+        self.course_day = [[0] * num_days for _ in problem.course_ids]
+        self.faculty_day = [[0] * num_days for _ in problem.faculty_ids]
+        self.slot_members = [set() for _ in range(problem.num_slots)]
+        self.hard = 0
+        self.soft = -self.balance_bound
+
+        self.schedule = []
+        self.best_score = None
+        self.iterations = 0
+        self.accepted = 0
+        self.backtracks = 0
+
+    @property
+    def nodes(self):
+        """Moves tried, the counterpart of search nodes"""
+        return self.iterations
+
+    @property
+    def score(self):
+        return self.hard_weight * self.hard + self.soft
+
+    def solve(self):
+        """Improve a timetable until a stopping rule fires; returns True when it has no hard violations"""
+        if any(not slots for slots in self.session_slots) or any(not rooms for rooms in self.session_rooms):
+            return False
+        deadline = time.monotonic() + self.time_limit
+        self._construct()
+
+        best = list(self.values)
+        best_score = self.score
+        best_hard = self.hard
+        temperature = start_temperature = 2.0
+        stalled = 0
+        sessions = len(self.sessions)
+
+        while best_score > self.target:
+            if self.iterations & 255 == 0 and (time.monotonic() >= deadline
+                                                or self.stop is not None and self.stop.is_set()):
+                break
+            if best_hard == 0 and stalled >= self.patience:
+                break
+            self.iterations += 1
+            stalled += 1
+
+            delta, undo = self._propose(sessions)
+            if undo is None:
+                continue
+            if delta <= 0 or self.rng.random() < math.exp(-delta / temperature):
+                self.accepted += 1
+                if self.score < best_score:
+                    best = list(self.values)
+                    best_score = self.score
+                    best_hard = self.hard
+                    stalled = 0
+            else:
+                for index, slot, room in reversed(undo):
+                    self._move(index, slot, room)
+
+            temperature *= 0.9995
+            if temperature < 0.05:
+                # Stalled in a local minimum: reheat
+                temperature = start_temperature / 4
+
+        # Go back to the best timetable so the counters describe it
+        for index, value in enumerate(best):
+            if self.values[index] != value:
+                self._move(index, *value)
+        self.best_score = best_score
+        self.schedule = [(self.sessions[index][0], room, slot) for index, (slot, room) in enumerate(best)]
+        return best_hard == 0
+
+    def assignments(self):
+        """(course, room, slot) triples of the best timetable found"""
+        return list(self.schedule)
+
+    def _construct(self):
+        """Start from the initial values, placing every other session where it costs least"""
+        for index, (slot, room) in self.initial.items():
+            self._place(index, slot, room)
+        order = sorted((index for index in range(len(self.sessions)) if index not in self.initial),
+                       key=lambda index: (len(self.session_slots[index]), self.rng.random()))
+        for index in order:
+            best = None
+            for slot in self.session_slots[index]:
+                room = self._pick_room(index, slot)
+                cost = self._delta(index, slot, room)
+                if best is None or cost < best[0]:
+                    best = (cost, slot, room)
+            self._place(index, best[1], best[2])
+
+    def _pick_room(self, index, slot):
+        """A free eligible room of the slot if there is one, otherwise any eligible room"""
+        free = self.problem.course_rooms[self.sessions[index][0]] & ~self.room_used[slot]
+        if free:
+            return (free & -free).bit_length() - 1
+        return self.rng.choice(self.session_rooms[index])
+
+    def _propose(self, sessions):
+        """Apply a random move; returns its score delta and the values needed to undo it"""
+        rng = self.rng
+        index = rng.randrange(sessions)
+        if self.hard:
+            # Mostly work on sessions that are part of a violation
+            for _ in range(8):
+                if self._in_conflict(index):
+                    break
+                index = rng.randrange(sessions)
+
+        kind = rng.random()
+        slot, room = self.values[index]
+        if kind < 0.6:
+            new_slot = rng.choice(self.session_slots[index])
+            new_room = self._pick_room(index, new_slot)
+            if (new_slot, new_room) == (slot, room):
+                return 0, None
+            return self._move(index, new_slot, new_room), [(index, slot, room)]
+        if kind < 0.9:
+            return self._swap(index, rng.randrange(sessions))
+        return self._kempe(index, rng.choice(self.session_slots[index]))
+
+    def _in_conflict(self, index):
+        course = self.sessions[index][0]
+        slot, room = self.values[index]
+        problem = self.problem
+        return (self.faculty_slot[problem.course_faculty[course]][slot] > 1
+                or self.room_slot[room][slot] > 1
+                or (self.spread_days[course] and self.course_day[course][problem.slot_days[slot]] > 1))
+
+    def _swap(self, index, other):
+        """Exchange the values of two sessions when each may take the other's"""
+        first = self.values[index]
+        second = self.values[other]
+        if index == other or first == second:
+            return 0, None
+        problem = self.problem
+        if not (problem.faculty_available[problem.course_faculty[self.sessions[index][0]]] >> second[0] & 1
+                and problem.faculty_available[problem.course_faculty[self.sessions[other][0]]] >> first[0] & 1
+                and problem.course_rooms[self.sessions[index][0]] >> second[1] & 1
+                and problem.course_rooms[self.sessions[other][0]] >> first[1] & 1):
+            return 0, None
+        delta = self._move(index, *second) + self._move(other, *first)
+        return delta, [(index, *first), (other, *second)]
+
+    def _kempe(self, index, target):
+        """
+        Move the Kempe chain of a session between its slot and the target slot:
+        the sessions of both slots connected to it through shared faculties
+        """
+        source = self.values[index][0]
+        if source == target:
+            return 0, None
+        problem = self.problem
+        faculty_of = lambda other: problem.course_faculty[self.sessions[other][0]]
+
+        chain = {index}
+        frontier = [index]
+        members = self.slot_members[source] | self.slot_members[target]
+        while frontier:
+            faculty = faculty_of(frontier.pop())
+            for other in members:
+                if other not in chain and faculty_of(other) == faculty:
+                    chain.add(other)
+                    frontier.append(other)
+
+        moves = []
+        for other in chain:
+            slot, room = self.values[other]
+            new_slot = target if slot == source else source
+            if not problem.faculty_available[faculty_of(other)] >> new_slot & 1:
+                return 0, None
+            moves.append((other, new_slot, room))
+
+        delta = 0
+        undo = []
+        for other, new_slot, room in moves:
+            undo.append((other, *self.values[other]))
+            delta += self._move(other, new_slot, room)
+        return delta, undo
+
+    def _cost(self, index, slot, room):
+        """(hard, soft) violations added by giving an unplaced session (slot, room)"""
+        problem = self.problem
+        course = self.sessions[index][0]
+        faculty = problem.course_faculty[course]
+        day = problem.slot_days[slot]
+        same_day = self.course_day[course][day]
+        hard = self.faculty_slot[faculty][slot] + self.room_slot[room][slot]
+        soft = 2 * self.faculty_day[faculty][day] + 1
+        if self.spread_days[course]:
+            hard += same_day
+        else:
+            soft += same_day
+        return hard, soft
+
+    def _delta(self, index, slot, room):
+        """Score change of giving an unplaced session (slot, room)"""
+        hard, soft = self._cost(index, slot, room)
+        return self.hard_weight * hard + soft
+
+    def _place(self, index, slot, room):
+        """Give an unplaced session (slot, room), updating the counters and the score"""
+        hard, soft = self._cost(index, slot, room)
+        self.hard += hard
+        self.soft += soft
+        self._count(index, slot, room, 1)
+        self.values[index] = (slot, room)
+
+    def _remove(self, index):
+        slot, room = self.values[index]
+        self._count(index, slot, room, -1)
+        self.values[index] = None
+        hard, soft = self._cost(index, slot, room)
+        self.hard -= hard
+        self.soft -= soft
+
+    def _move(self, index, slot, room):
+        """Move a placed session to (slot, room); returns the score change"""
+        before = self.score
+        self._remove(index)
+        self._place(index, slot, room)
+        return self.score - before
+
+    def _count(self, index, slot, room, step):
+        problem = self.problem
+        course = self.sessions[index][0]
+        faculty = problem.course_faculty[course]
+        day = problem.slot_days[slot]
+        self.faculty_slot[faculty][slot] += step
+        self.room_slot[room][slot] += step
+        if self.room_slot[room][slot]:
+            self.room_used[slot] |= 1 << room
+        else:
+            self.room_used[slot] &= ~(1 << room)
+        self.course_day[course][day] += step
+        self.faculty_day[faculty][day] += step
+        if step > 0:
+            self.slot_members[slot].add(index)
+        else:
+            self.slot_members[slot].discard(index)
@@ -0,0 +1,128 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from timetable.api import schedule_queryset
+from timetable.export import export_queryset
+from timetable.models import FacultyAvailability, Room, Schedule, TimeSlot, TimetableVersion
+from timetable.synthetic import SIZES, SyntheticInstance, parse_size
+import random
+import statistics
+import time as time_lib
+
+# Indexes added for the queries below, dropped for the comparison run
+INDEXES = ['schedule_version_course_idx', 'availability_faculty_idx']
+
+class Command(BaseCommand):
+    help = ("Time the timetable's hot queries and show their SQLite query plans on a large synthetic "
+            "database, with and without the indexes of migration 0005")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', default='xlarge',
+                            help=f"Instance size: {', '.join(SIZES)} or FxCxRxDxS "
+                                 "(faculties x courses x rooms x days x slots per day)")
+        parser.add_argument('--versions', type=int, default=21,
+                            help='Timetable versions to fill (the active one and the kept candidates)')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query; the median is reported')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Query plans are read with SQLite's EXPLAIN QUERY PLAN")
+        try:
+            size = parse_size(options['size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        with transaction.atomic():
+            rows = self.fill(SyntheticInstance(*size, seed=options['seed']), options['versions'], options['seed'])
+            self.stderr.write(f"{rows} scheduled classes in {options['versions']} versions")
+            queries = self.queries(random.Random(options['seed']))
+
+            results = {}
+            for label in ('with', 'without'):
+                if label == 'without':
+                    with connection.cursor() as cursor:
+                        for name in INDEXES:
+                            cursor.execute(f'DROP INDEX "{name}"')
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                for name, queryset in queries:
+                    results.setdefault(name, {})[label] = self.measure(queryset, options['repeat'])
+
+            # Leave the real data and indexes untouched
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{'query':<28} {'without (ms)':>12} {'with (ms)':>10}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<28} {result['without'][0]:>12.3f} {result['with'][0]:>10.3f}")
+        for name, result in results.items():
+            self.stdout.write(f"\n{name}")
+            for label in ('without', 'with'):
+                self.stdout.write(f"  {label}:")
+                for line in result[label][1]:
+                    self.stdout.write(f"    {line}")
+
+    def fill(self, instance, versions, seed):
+        """Write the instance and fill every version with classes on distinct (room, slot) places"""
+        instance.save()
+        # The availability page stores every slot of a faculty member, unavailable ones included
+        available = set(instance.availability)
+        FacultyAvailability.objects.bulk_create(
+            (FacultyAvailability(faculty_id=faculty[0], time_slot_id=slot[0], is_available=False)
+             for faculty in instance.faculties for slot in instance.slots
+             if (faculty[0], slot[0]) not in available),
+            batch_size=5000,
+        )
+        rng = random.Random(seed)
+        courses = [course[0] for course in instance.courses]
+        sessions = [course for course, *_, weekly in instance.courses for _ in range(weekly)]
+        places = [(room[0], slot[0]) for room in instance.rooms for slot in instance.slots]
+        schedules = []
+        for number in range(versions):
+            version = TimetableVersion.objects.create(label=f"Benchmark {number}", is_active=number == versions - 1)
+            rng.shuffle(places)
+            schedules.extend(
+                Schedule(version=version, course_id=course or rng.choice(courses), room_id=room, time_slot_id=slot)
+                for course, (room, slot) in zip(sessions, places)
+            )
+        Schedule.objects.bulk_create(schedules, batch_size=5000)
+        return len(schedules)
+
+    def queries(self, rng):
+        """The timetable's hot queries, named, with arguments picked from the filled data"""
+        version = TimetableVersion.active()
+        schedule = Schedule.objects.filter(version=version).select_related('course', 'time_slot').first()
+        faculty_id = schedule.course.faculty_id
+        slot = schedule.time_slot
+        room_id = rng.choice(list(Room.objects.values_list('id', flat=True)))
+        related = ('course__faculty', 'room', 'time_slot')
+        return [
+            ('timetable by faculty', Schedule.objects.filter(version=version, course__faculty_id=faculty_id)
+                .select_related(*related)),
+            ('timetable by course', Schedule.objects.filter(version=version, course_id=schedule.course_id)
+                .select_related(*related)),
+            ('timetable by room', Schedule.objects.filter(version=version, room_id=room_id).select_related(*related)),
+            ('faculty busy in slot', Schedule.objects.filter(version=version, course__faculty_id=faculty_id,
+                                                             time_slot=slot).values('id')[:1]),
+            ('available faculty slots', FacultyAvailability.objects.filter(is_available=True)
+                .values_list('faculty_id', 'time_slot_id')),
+            ('faculty availability', FacultyAvailability.objects.filter(faculty_id=faculty_id, is_available=True)
+                .values_list('time_slot_id', flat=True)),
+            ('time slot lookup', TimeSlot.objects.filter(day=slot.day, start_time=slot.start_time,
+                                                         end_time=slot.end_time)),
+            ('export by faculty', export_queryset(version, 'faculty', faculty_id)),
+            ('api page by faculty', schedule_queryset(version, {'course__faculty_id__in': [faculty_id]})[:101]),
+        ]
+
+    def measure(self, queryset, repeat):
+        """Median milliseconds of a query's SQL (without building model instances) and its plan"""
+        sql, params = queryset.query.sql_with_params()
+        times = []
+        with connection.cursor() as cursor:
+            for _ in range(repeat):
+                start = time_lib.perf_counter()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                times.append((time_lib.perf_counter() - start) * 1000)
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        return statistics.median(times), plan
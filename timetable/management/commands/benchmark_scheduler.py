@@ -0,0 +1,140 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from timetable.instrumentation import QueryCounter
+from timetable.scheduler import TimetableScheduler
+from timetable.synthetic import SIZES, SyntheticInstance, parse_size
+from contextlib import redirect_stdout
+import csv
+import datetime
+import django
+import io
+import json
+import platform
+import random
+import threading
+import time as time_lib
+import tracemalloc
+
+FIELDS = [
+    'size', 'faculties', 'courses', 'rooms', 'slots', 'sessions', 'density', 'tightness', 'seed',
+    'engine', 'mode', 'status', 'seconds', 'nodes', 'backtracks', 'queries', 'peak_kb',
+]
+
+class Command(BaseCommand):
+    help = 'Benchmark the scheduling engines on synthetic instances over a grid of sizes and seeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', default=['small', 'medium'],
+                            help=f"Instance sizes: {', '.join(SIZES)} or FxCxRxDxS "
+                                 "(faculties x courses x rooms x days x slots per day)")
+        parser.add_argument('--seeds', type=int, default=3, help='Number of seeds per size')
+        parser.add_argument('--first-seed', type=int, default=0, help='First seed of the grid')
+        parser.add_argument('--engines', nargs='+', choices=sorted(TimetableScheduler.ENGINES),
+                            default=sorted(TimetableScheduler.ENGINES))
+        parser.add_argument('--density', type=float, default=0.8, help='Probability a faculty is available in a slot')
+        parser.add_argument('--tightness', type=float, default=0.5,
+                            help='Weekly sessions over the number of (slot, room) places')
+        parser.add_argument('--mode', choices=['memory', 'db'], default='memory',
+                            help='memory: search only; db: load, search and persist through the ORM '
+                                 '(inside a transaction that is rolled back)')
+        parser.add_argument('--time-limit', type=float, default=30.0, help='Seconds before a run is stopped')
+        parser.add_argument('--no-memory', action='store_true',
+                            help='Skip tracemalloc (it slows the search down, so timings are more accurate without it)')
+        parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+        parser.add_argument('--output', help='Write the report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [(size, parse_size(size)) for size in options['sizes']]
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        records = []
+        for size, (faculties, courses, rooms, days, slots_per_day) in sizes:
+            for seed in range(options['first_seed'], options['first_seed'] + options['seeds']):
+                instance = SyntheticInstance(faculties, courses, rooms, days, slots_per_day,
+                                             options['density'], options['tightness'], seed)
+                for engine in options['engines']:
+                    record = {
+                        'size': size, 'faculties': faculties, 'courses': courses, 'rooms': rooms,
+                        'slots': len(instance.slots), 'sessions': instance.num_sessions,
+                        'density': options['density'], 'tightness': options['tightness'], 'seed': seed,
+                        'engine': engine, 'mode': options['mode'],
+                    }
+                    record.update(self.run(instance, engine, seed, options))
+                    records.append(record)
+                    self.stderr.write(f"{size} seed={seed} {engine}: {record['status']} in {record['seconds']:.3f}s, "
+                                      f"{record['nodes']} nodes, {record['queries']} queries")
+
+        report = self.report(records, options['format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as stream:
+                stream.write(report)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {len(records)} runs to {options['output']}"))
+        else:
+            self.stdout.write(report, ending='')
+
+    def run(self, instance, engine, seed, options):
+        """Run one engine on one instance and measure it"""
+        stop = threading.Event()
+        timer = threading.Timer(options['time_limit'], stop.set)
+        engine_options = {'stop': stop}
+        if engine == 'local_search':
+            engine_options['time_limit'] = options['time_limit']
+        measure_memory = not options['no_memory']
+
+        with transaction.atomic():
+            if options['mode'] == 'db':
+                instance.save()
+            else:
+                problem = instance.problem()
+
+            if measure_memory:
+                tracemalloc.start()
+            timer.start()
+            with QueryCounter().count() as queries:
+                start = time_lib.perf_counter()
+                if options['mode'] == 'db':
+                    solver = TimetableScheduler(engine=engine, seed=seed, **engine_options)
+                    # Keep the scheduler's failure message out of the report on stdout
+                    with redirect_stdout(io.StringIO()):
+                        solver.generate_timetable()
+                    solved = bool(solver.schedule)
+                else:
+                    solver = TimetableScheduler.ENGINES[engine](problem, rng=random.Random(seed), **engine_options)
+                    solved = solver.solve()
+                seconds = time_lib.perf_counter() - start
+            timer.cancel()
+            peak = None
+            if measure_memory:
+                peak = tracemalloc.get_traced_memory()[1] // 1024
+                tracemalloc.stop()
+
+            # Leave the real data untouched
+            transaction.set_rollback(True)
+
+        return {
+            'status': 'solved' if solved else ('timeout' if stop.is_set() else 'failed'),
+            'seconds': round(seconds, 4),
+            'nodes': solver.nodes,
+            'backtracks': solver.backtracks,
+            'queries': queries.queries,
+            'peak_kb': peak,
+        }
+
+    def report(self, records, output_format):
+        """The records as CSV or JSON text"""
+        stream = io.StringIO()
+        if output_format == 'json':
+            json.dump({
+                'generated': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'runs': records,
+            }, stream, indent=2)
+            stream.write('\n')
+        else:
+            writer = csv.DictWriter(stream, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        return stream.getvalue()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from timetable.export import FORMATS, export, export_rows
+from timetable.models import TimetableVersion
+
+class Command(BaseCommand):
+    help = 'Export a timetable, whole or for one faculty member, room or course, as CSV, iCalendar or JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--timetable-version', type=int,
+                            help='Timetable version to export (the active one by default)')
+        parser.add_argument('--faculty', type=int, help='Only the classes of this faculty member (id)')
+        parser.add_argument('--room', type=int, help='Only the classes in this room (id)')
+        parser.add_argument('--course', type=int, help='Only the classes of this course (id)')
+        parser.add_argument('--output', help='Write to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['timetable_version'] is not None:
+            version = TimetableVersion.objects.filter(pk=options['timetable_version']).first()
+            if version is None:
+                raise CommandError(f"Timetable version {options['timetable_version']} does not exist")
+        else:
+            version = TimetableVersion.active()
+            if version is None:
+                raise CommandError("No timetable has been generated yet")
+
+        filter_type, selected_id = 'all', None
+        for option, name in (('faculty', 'faculty'), ('room', 'room'), ('course', 'student')):
+            if options[option] is not None:
+                filter_type, selected_id = name, options[option]
+
+        # Rows are written as they are read, so memory use does not depend on the size of the timetable
+        chunks = export(options['format'], export_rows(version, filter_type, selected_id), version)
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as stream:
+                stream.writelines(chunks)
+            self.stderr.write(self.style.SUCCESS(f"Exported {version} to {options['output']}"))
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from timetable.importer import BATCH_SIZE, Importer, format_for, read_rows
+import json
+import sys
+
+class Command(BaseCommand):
+    help = 'Import faculty, rooms, courses or faculty availability from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=Importer.KINDS)
+        parser.add_argument('path', help="File to import, or - for standard input")
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help='csv (with a header line) or json (one object per line); '
+                                 'guessed from the file name when omitted')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per bulk insert')
+        parser.add_argument('--report', help='Write the full report, errors included, to this JSON file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or format_for(path)
+        importer = Importer(options['kind'], batch_size=options['batch_size'], progress=self.progress)
+        try:
+            if path == '-':
+                importer.run(read_rows(sys.stdin, input_format))
+            else:
+                with open(path, newline='', encoding='utf-8-sig') as stream:
+                    importer.run(read_rows(stream, input_format))
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for line, error in importer.errors:
+            self.stderr.write(f"Line {line}: {error}")
+        if importer.error_count > len(importer.errors):
+            self.stderr.write(f"... and {importer.error_count - len(importer.errors)} more errors")
+        if options['report']:
+            with open(options['report'], 'w') as stream:
+                json.dump(importer.as_dict(), stream, indent=2)
+
+        rate = importer.rows_per_second
+        summary = (f"Imported {importer.rows} {options['kind']} rows in {importer.seconds:.2f}s "
+                   f"({'-' if rate is None else f'{rate:.0f}'} rows/s): {importer.created} created, "
+                   f"{importer.updated} updated, {importer.skipped} already present, {importer.error_count} errors")
+        self.stdout.write(self.style.WARNING(summary) if importer.error_count else self.style.SUCCESS(summary))
+
+    def progress(self, importer):
+        rate = importer.rows_per_second
+        self.stderr.write(f"{importer.rows} rows, {importer.created + importer.updated} written"
+                          f"{'' if rate is None else f', {rate:.0f} rows/s'}")
@@ -0,0 +1,72 @@
+from collections import deque
+
+
+def hopcroft_karp(adjacency, num_right):
+    """
+    Maximum bipartite matching.
+
+    adjacency[u] lists the right vertices left vertex u may be matched to.
+    Returns (match_left, match_right) where match_left[u] is the right vertex
+    matched to u (or None) and match_right[v] the left vertex matched to v.
+    """
+    num_left = len(adjacency)
+    match_left = [None] * num_left
+    match_right = [None] * num_right
+    distance = [0] * num_left
+
+    def bfs():
+        # Layer the free left vertices and everything reachable from them by alternating paths
+        queue = deque()
+        for u in range(num_left):
+            if match_left[u] is None:
+                distance[u] = 0
+                queue.append(u)
+            else:
+                distance[u] = None
+        found = False
+        while queue:
+            u = queue.popleft()
+            for v in adjacency[u]:
+                w = match_right[v]
+                if w is None:
+                    found = True
+                elif distance[w] is None:
+                    distance[w] = distance[u] + 1
+                    queue.append(w)
+        return found
+
+    def dfs(u):
+        # Follow the layers to a free right vertex and flip the path
+        for v in adjacency[u]:
+            w = match_right[v]
+            if w is None or (distance[w] == distance[u] + 1 and dfs(w)):
+                match_left[u] = v
+                match_right[v] = u
+                return True
+        distance[u] = None
+        return False
+
+    while bfs():
+        for u in range(num_left):
+            if match_left[u] is None:
+                dfs(u)
+
+    return match_left, match_right
+
+
+def hall_violator(adjacency, match_right, start):
+    """
+    Left vertices reachable from the unmatched left vertex start by
+    alternating paths. With a maximum matching this set has more vertices
+    than neighbours, which is why it cannot be matched completely.
+    """
+    reached = {start}
+    queue = deque([start])
+    while queue:
+        u = queue.popleft()
+        for v in adjacency[u]:
+            w = match_right[v]
+            if w is not None and w not in reached:
+                reached.add(w)
+                queue.append(w)
+    return reached
@@ -0,0 +1,61 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_initial_version(apps, schema_editor):
+    """Put the existing timetable into a first, active version"""
+    Schedule = apps.get_model('timetable', 'Schedule')
+    TimetableVersion = apps.get_model('timetable', 'TimetableVersion')
+    if Schedule.objects.exists():
+        version = TimetableVersion.objects.create(label='Initial timetable', is_active=True)
+        Schedule.objects.update(version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetable', '0002_generationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimetableVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(blank=True, max_length=100)),
+                ('engine', models.CharField(blank=True, max_length=20)),
+                ('seed', models.BigIntegerField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('is_active',), name='single_active_timetable_version')],
+            },
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='version',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='schedules', to='timetable.timetableversion'),
+        ),
+        migrations.RunPython(create_initial_version, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='schedule',
+            name='version',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedules', to='timetable.timetableversion'),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='activate',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='timetable.timetableversion'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='schedule',
+            unique_together={('version', 'room', 'time_slot')},
+        ),
+    ]
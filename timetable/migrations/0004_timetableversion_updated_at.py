@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetable', '0003_timetableversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timetableversion',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+
+def merge_duplicate_time_slots(apps, schema_editor):
+    """
+    Fold time slots with the same day, start and end into the oldest one
+    before they are made unique. Availability and classes move over to it;
+    a row that would then repeat one already there (the same faculty, or the
+    same room in the same version) is dropped.
+    """
+    TimeSlot = apps.get_model('timetable', 'TimeSlot')
+    FacultyAvailability = apps.get_model('timetable', 'FacultyAvailability')
+    Schedule = apps.get_model('timetable', 'Schedule')
+    keep = {}
+    for slot in TimeSlot.objects.order_by('id'):
+        key = (slot.day, slot.start_time, slot.end_time)
+        if key not in keep:
+            keep[key] = slot.pk
+            continue
+        kept = keep[key]
+        faculty = set(FacultyAvailability.objects.filter(time_slot_id=kept).values_list('faculty_id', flat=True))
+        FacultyAvailability.objects.filter(time_slot=slot, faculty_id__in=faculty).delete()
+        FacultyAvailability.objects.filter(time_slot=slot).update(time_slot_id=kept)
+        for version_id, room_id in Schedule.objects.filter(time_slot_id=kept).values_list('version_id', 'room_id'):
+            Schedule.objects.filter(time_slot=slot, version_id=version_id, room_id=room_id).delete()
+        Schedule.objects.filter(time_slot=slot).update(time_slot_id=kept)
+        slot.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetable', '0004_timetableversion_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_time_slots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='timeslot',
+            constraint=models.UniqueConstraint(fields=('day', 'start_time', 'end_time'), name='unique_time_slot'),
+        ),
+        migrations.AddIndex(
+            model_name='facultyavailability',
+            index=models.Index(fields=['faculty', 'is_available', 'time_slot'], name='availability_faculty_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['version', 'course', 'time_slot'], name='schedule_version_course_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetable', '0005_indexes_and_unique_time_slot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='worker',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
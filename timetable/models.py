@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 # Create your models here.
 class Faculty(models.Model):
@@ -22,6 +23,12 @@ class TimeSlot(models.Model):
     start_time = models.TimeField()
     end_time = models.TimeField()
 
+    class Meta:
+        constraints = [
+            # get_or_create in init_timeslots and create_sample_data relies on it
+            models.UniqueConstraint(fields=['day', 'start_time', 'end_time'], name='unique_time_slot'),
+        ]
+
     def __str__(self):
         return f"{self.get_day_display()} {self.start_time.strftime('%H:%M')} - {self.end_time.strftime('%H:%M')}"
 
@@ -33,6 +40,10 @@ class FacultyAvailability(models.Model):
     class Meta:
         unique_together = ('faculty', 'time_slot')
         verbose_name_plural = 'Faculty Availabilities'
+        indexes = [
+            # The slots a faculty member is (un)available in, read from the index alone
+            models.Index(fields=['faculty', 'is_available', 'time_slot'], name='availability_faculty_idx'),
+        ]
 
 class Room(models.Model):
     name = models.CharField(max_length=50)
@@ -51,13 +62,177 @@ class Course(models.Model):
     def __str__(self):
         return f"{self.code}: {self.name}"
 
+class TimetableVersion(models.Model):
+    """
+    One generated timetable. Several versions can be kept side by side;
+    the single active one is the timetable everybody sees.
+    """
+    label = models.CharField(max_length=100, blank=True)
+    engine = models.CharField(max_length=20, blank=True)
+    seed = models.BigIntegerField(null=True, blank=True)
+    is_active = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last change to anything the version shows; the API derives its ETag and Last-Modified from it
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        constraints = [
+            models.UniqueConstraint(fields=['is_active'], condition=models.Q(is_active=True),
+                                    name='single_active_timetable_version'),
+        ]
+
+    def __str__(self):
+        return self.label or f"Version {self.pk}"
+
+    @classmethod
+    def active(cls):
+        return cls.objects.filter(is_active=True).first()
+
+    def activate(self):
+        """
+        Make this the published timetable; readers switch over in one
+        transaction. updated_at moves too, so an API client polling with
+        If-Modified-Since sees the switch even to an older version.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            TimetableVersion.objects.filter(is_active=True).exclude(pk=self.pk).update(is_active=False)
+            TimetableVersion.objects.filter(pk=self.pk).update(is_active=True, updated_at=now)
+        self.is_active = True
+        self.updated_at = now
+
+    def diff(self, other):
+        """
+        Changes from this version to other: classes added and removed,
+        classes moved to another time slot and classes that only changed
+        room. The rows that differ are found by the database (EXCEPT on the
+        indexed version columns), so only those are compared in Python.
+        """
+        fields = ('course_id', 'room_id', 'time_slot_id')
+        mine = Schedule.objects.filter(version=self).values_list(*fields)
+        theirs = Schedule.objects.filter(version=other).values_list(*fields)
+        removed = sorted(mine.difference(theirs))
+        added = sorted(theirs.difference(mine))
+
+        # Same course and slot on both sides: only the room changed
+        added_at = {(course, slot): room for course, room, slot in added}
+        room_changes = []
+        left = []
+        for course, room, slot in removed:
+            new_room = added_at.pop((course, slot), None)
+            if new_room is None:
+                left.append((course, room, slot))
+            else:
+                room_changes.append({'course': course, 'time_slot': slot, 'from_room': room, 'to_room': new_room})
+
+        # Same course on both sides: the class moved to another slot
+        added_for = {}
+        for (course, slot), room in sorted(added_at.items()):
+            added_for.setdefault(course, []).append((room, slot))
+        moved = []
+        removed = []
+        for course, room, slot in left:
+            targets = added_for.get(course)
+            if targets:
+                to_room, to_slot = targets.pop(0)
+                moved.append({'course': course, 'from_room': room, 'from_time_slot': slot,
+                              'to_room': to_room, 'to_time_slot': to_slot})
+            else:
+                removed.append((course, room, slot))
+        added = [(course, room, slot) for course, targets in added_for.items() for room, slot in targets]
+
+        return {
+            'from_version': self.pk,
+            'to_version': other.pk,
+            'moved': moved,
+            'room_changes': room_changes,
+            'added': [dict(zip(('course', 'room', 'time_slot'), row)) for row in added],
+            'removed': [dict(zip(('course', 'room', 'time_slot'), row)) for row in removed],
+        }
+
+class ScheduleQuerySet(models.QuerySet):
+    def active(self):
+        """Classes of the active timetable version"""
+        return self.filter(version__is_active=True)
+
 class Schedule(models.Model):
+    version = models.ForeignKey(TimetableVersion, on_delete=models.CASCADE, related_name='schedules')
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
     time_slot = models.ForeignKey(TimeSlot, on_delete=models.CASCADE)
+
+    objects = ScheduleQuerySet.as_manager()
     
     class Meta:
-        unique_together = ('room', 'time_slot')  # A room can only have one class at a time
+        unique_together = ('version', 'room', 'time_slot')  # A room can only have one class at a time
+        indexes = [
+            # Classes of a course, or of a faculty member through its courses, and their time slots
+            models.Index(fields=['version', 'course', 'time_slot'], name='schedule_version_course_idx'),
+        ]
         
     def __str__(self):
         return f"{self.course} in {self.room} at {self.time_slot}"
+
+class GenerationJob(models.Model):
+    """A timetable generation run executed in the background (see timetable.jobs)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    engine = models.CharField(max_length=20, default='backtracking')
+    verbose = models.BooleanField(default=False)
+    seed = models.BigIntegerField(null=True, blank=True)
+    activate = models.BooleanField(default=True)  # Publish the result, or keep it as a candidate version
+    version = models.ForeignKey(TimetableVersion, null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.FloatField(default=0)  # Deepest share of sessions placed so far, 0 to 1
+    nodes = models.BigIntegerField(default=0)
+    message = models.CharField(max_length=255, blank=True)
+    stats = models.JSONField(null=True, blank=True)
+    log = models.TextField(blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    worker = models.CharField(max_length=100, blank=True)  # host:pid:token of the process that queued the job
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Generation job {self.pk} ({self.get_status_display()})"
+
+    @property
+    def finished(self):
+        return self.status in (self.SUCCEEDED, self.FAILED, self.CANCELLED)
+
+    def as_dict(self):
+        """Status payload of the job API"""
+        return {
+            'id': self.pk,
+            'engine': self.engine,
+            'verbose': self.verbose,
+            'seed': self.seed,
+            'activate': self.activate,
+            'version': self.version_id,
+            'status': self.status,
+            'finished': self.finished,
+            'progress': round(self.progress, 4),
+            'nodes': self.nodes,
+            'message': self.message,
+            'cancel_requested': self.cancel_requested,
+            'stats': self.stats,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,77 @@
+from .problem import iter_bits
+
+
+class OccupancyIndex:
+    """
+    Tracks which time slots are taken for every faculty, room and course.
+
+    Each of them owns one integer bitmask over the time slots of a
+    SchedulingProblem, so every feasibility check and every place/remove
+    (including the undo on backtrack) is a constant number of bit operations.
+    """
+    def __init__(self, problem):
+        self.problem = problem
+        self.faculty_busy = [0] * len(problem.faculty_ids)
+        self.room_busy = [0] * problem.num_rooms
+        self.course_slots = [0] * len(problem.course_ids)
+
+    def faculty_free(self, faculty, slot):
+        """Faculty is available for the slot and not already teaching in it"""
+        bit = 1 << slot
+        return bool(self.problem.faculty_available[faculty] & bit) and not self.faculty_busy[faculty] & bit
+
+    def room_free(self, room, slot):
+        """Room is not booked for the slot"""
+        return not self.room_busy[room] >> slot & 1
+
+    def course_has_day(self, course, day):
+        """Course already has a session on the given day index"""
+        return bool(self.course_slots[course] & self.problem.day_masks[day])
+
+    def course_day_count(self, course):
+        """Number of distinct days the course already has a session on"""
+        slots = self.course_slots[course]
+        return sum(1 for mask in self.problem.day_masks if slots & mask)
+
+    def course_days(self, course):
+        """Day indices the course already has a session on"""
+        return sorted({self.problem.slot_days[slot] for slot in iter_bits(self.course_slots[course])})
+
+    def free_rooms(self, slot):
+        """Rooms that are not booked for the slot"""
+        return [room for room in range(self.problem.num_rooms) if not self.room_busy[room] >> slot & 1]
+
+    def free_rooms_by_class(self, slot, course=None):
+        """
+        Free rooms of the slot grouped by room equivalence class (empty classes
+        dropped), limited to the rooms the course may use when one is given
+        """
+        bit = 1 << slot
+        eligible = self.problem.all_rooms if course is None else self.problem.course_rooms[course]
+        groups = []
+        for members in self.problem.room_classes:
+            free = [room for room in members if eligible >> room & 1 and not self.room_busy[room] & bit]
+            if free:
+                groups.append(free)
+        return groups
+
+    def can_place(self, course, room, slot):
+        """Hard constraints for placing one session of a course"""
+        return (self.faculty_free(self.problem.course_faculty[course], slot)
+                and self.problem.course_rooms[course] >> room & 1
+                and self.room_free(room, slot))
+
+    def place(self, course, room, slot):
+        """Book the slot; room may be None while only time slots are being decided"""
+        bit = 1 << slot
+        self.faculty_busy[self.problem.course_faculty[course]] |= bit
+        if room is not None:
+            self.room_busy[room] |= bit
+        self.course_slots[course] |= bit
+
+    def remove(self, course, room, slot):
+        mask = ~(1 << slot)
+        self.faculty_busy[self.problem.course_faculty[course]] &= mask
+        if room is not None:
+            self.room_busy[room] &= mask
+        self.course_slots[course] &= mask
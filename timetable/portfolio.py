@@ -0,0 +1,150 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+import pickle
+import random
+import time
+
+# Engine configurations the workers cycle through after the requested engine
+PORTFOLIO = [
+    ('backtracking', {}),
+    ('local_search', {}),
+    ('two_phase', {}),
+    ('backtracking', {'max_nogood_size': 32}),
+    ('local_search', {'hard_weight': 20}),
+]
+
+# Set in every worker process by _start_worker
+_problem = None
+_stop = None
+
+
+def _start_worker(snapshot, stop):
+    """
+    Worker initializer: unpickle the shared problem once per process. It is
+    sent as bytes so that Django is set up before the models are imported
+    (needed when processes are spawned rather than forked).
+    """
+    global _problem, _stop
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    _problem = pickle.loads(snapshot)
+    _stop = stop
+
+
+def _run_configuration(engine, options, seed):
+    """Run one engine configuration in a worker; returns a picklable summary"""
+    from .scheduler import TimetableScheduler
+    from .search import BacktrackingSearch
+
+    start = time.perf_counter()
+    kwargs = dict(options)
+    kwargs['rng'] = random.Random(seed)
+    # Always the race's own event, or the worker could not be called off
+    kwargs['stop'] = _stop
+    solver = TimetableScheduler.ENGINES[engine](_problem, **kwargs)
+    solved = solver.solve()
+    if solved:
+        status = 'solved'
+    elif isinstance(solver, BacktrackingSearch) and solver.status == solver.FAILED:
+        # Exact search ran out of values: no timetable exists at all
+        status = 'infeasible'
+    else:
+        status = 'gave_up'
+    return {
+        'engine': engine,
+        'options': options,
+        'seed': seed,
+        'status': status,
+        'assignments': solver.assignments(),
+        'score': getattr(solver, 'best_score', None),
+        'nodes': solver.nodes,
+        'backtracks': solver.backtracks,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+class PortfolioSolver:
+    """
+    Runs differently seeded and configured engines in parallel processes.
+
+    Every worker gets the same pickled SchedulingProblem and a shared stop
+    event. The first worker to finish with a complete timetable (or with a
+    proof that none exists) sets the event and the others stop at their next
+    check. Without a winner the lowest scored local search result is kept
+    in `best` for reporting, but solve() still returns False.
+
+    Worker 0 runs the requested engine with its options, the others cycle
+    through PORTFOLIO; worker i uses seed + i. A `stop` event in the options
+    stays in this process: setting it calls the race off, as the time limit
+    running out does.
+    """
+    # Seconds between checks of the caller's stop event
+    POLL = 0.1
+
+    def __init__(self, problem, workers, engine='backtracking', options=None, seed=None, time_limit=None):
+        self.problem = problem
+        self.workers = workers
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.time_limit = time_limit
+        options = dict(options or {})
+        self.stop = options.pop('stop', None)
+        self.configurations = [(engine, options)]
+        while len(self.configurations) < workers:
+            self.configurations.append(PORTFOLIO[(len(self.configurations) - 1) % len(PORTFOLIO)])
+        self.results = []
+        self.best = None
+        self.schedule = []
+        self.nodes = 0
+        self.backtracks = 0
+
+    def solve(self):
+        """Run the portfolio; returns True when some worker found a complete timetable"""
+        context = multiprocessing.get_context()
+        stop = context.Event()
+        deadline = None if self.time_limit is None else time.monotonic() + self.time_limit
+        self.results = []
+        self.best = None
+
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_start_worker,
+                                 initargs=(pickle.dumps(self.problem), stop)) as pool:
+            pending = {
+                pool.submit(_run_configuration, engine, options, self.seed + worker)
+                for worker, (engine, options) in enumerate(self.configurations)
+            }
+            while pending:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if self.stop is not None:
+                    timeout = self.POLL if timeout is None else min(timeout, self.POLL)
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                out_of_time = deadline is not None and time.monotonic() >= deadline
+                if out_of_time or self.stop is not None and self.stop.is_set():
+                    # Out of time or called off: ask everybody to stop and collect what they have
+                    stop.set()
+                    deadline = None
+                for future in done:
+                    result = future.result()
+                    self.results.append(result)
+                    if result['status'] in ('solved', 'infeasible'):
+                        stop.set()
+
+        self.nodes = sum(result['nodes'] for result in self.results)
+        self.backtracks = sum(result['backtracks'] for result in self.results)
+
+        for result in self.results:
+            if result['status'] == 'solved':
+                self.best = result
+                break
+            if result['score'] is not None and (self.best is None or result['score'] < self.best['score']):
+                self.best = result
+
+        if self.best is not None and self.best['status'] == 'solved':
+            self.schedule = self.best['assignments']
+            return True
+        self.schedule = []
+        return False
+
+    def assignments(self):
+        """(course, room, slot) triples of the winning timetable"""
+        return list(self.schedule)
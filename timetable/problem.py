@@ -0,0 +1,150 @@
+from .models import Course, Faculty, Room, TimeSlot, FacultyAvailability, Schedule
+
+DAYS = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT']
+
+
+def bit_count(mask):
+    """Number of set bits in an integer bitmask"""
+    return bin(mask).count('1')
+
+
+def iter_bits(mask):
+    """Yield the indices of the set bits of an integer bitmask, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class SchedulingProblem:
+    """
+    Read-only snapshot of everything the scheduler needs, loaded once.
+
+    Time slots, rooms, faculty and courses are numbered 0..n-1 in the order
+    they were loaded, and any set of time slots is stored as an integer
+    bitmask where bit i stands for time slot i. The search never touches
+    the database; database ids are only needed again when persisting.
+    """
+    def __init__(self, slots, rooms, faculties, courses, availability, eligible_rooms=None):
+        """
+        slots:          (id, day, label) tuples
+        rooms:          (id, name, capacity, has_projector) tuples
+        faculties:      (id, name) tuples
+        courses:        (id, code, name, faculty_id, weekly_sessions) tuples
+        availability:   (faculty_id, time_slot_id) pairs marked as available
+        eligible_rooms: optional (course_id, room_id) pairs restricting the rooms
+                        a course may use; courses not listed may use any room
+        """
+        # Time slots
+        self.slot_ids = [slot[0] for slot in slots]
+        self.slot_days = [DAYS.index(slot[1]) for slot in slots]
+        self.slot_labels = [slot[2] for slot in slots]
+        self.slot_index = {slot_id: i for i, slot_id in enumerate(self.slot_ids)}
+        self.all_slots = (1 << len(slots)) - 1
+        self.day_masks = [0] * len(DAYS)
+        for i, day in enumerate(self.slot_days):
+            self.day_masks[day] |= 1 << i
+
+        # Rooms
+        self.room_ids = [room[0] for room in rooms]
+        self.room_names = [room[1] for room in rooms]
+        self.room_capacity = [room[2] for room in rooms]
+        self.room_projector = [room[3] for room in rooms]
+        self.room_index = {room_id: i for i, room_id in enumerate(self.room_ids)}
+        self.all_rooms = (1 << len(rooms)) - 1
+
+        # Faculty and the time slots each of them is available for
+        self.faculty_ids = [faculty[0] for faculty in faculties]
+        self.faculty_names = [faculty[1] for faculty in faculties]
+        self.faculty_index = {faculty_id: i for i, faculty_id in enumerate(self.faculty_ids)}
+        self.faculty_available = [0] * len(faculties)
+        for faculty_id, slot_id in availability:
+            if faculty_id in self.faculty_index and slot_id in self.slot_index:
+                self.faculty_available[self.faculty_index[faculty_id]] |= 1 << self.slot_index[slot_id]
+
+        # Courses
+        self.course_ids = [course[0] for course in courses]
+        self.course_codes = [course[1] for course in courses]
+        self.course_names = [course[2] for course in courses]
+        self.course_faculty = [self.faculty_index[course[3]] for course in courses]
+        self.course_sessions = [course[4] for course in courses]
+        self.course_index = {course_id: i for i, course_id in enumerate(self.course_ids)}
+        self.faculty_course_count = [0] * len(faculties)
+        for faculty in self.course_faculty:
+            self.faculty_course_count[faculty] += 1
+
+        # Rooms each course may use, as bitmasks over the rooms
+        self.course_rooms = [self.all_rooms] * len(courses)
+        if eligible_rooms is not None:
+            restricted = {}
+            for course_id, room_id in eligible_rooms:
+                if course_id in self.course_index and room_id in self.room_index:
+                    course = self.course_index[course_id]
+                    restricted[course] = restricted.get(course, 0) | 1 << self.room_index[room_id]
+            for course, mask in restricted.items():
+                self.course_rooms[course] = mask
+        self.rooms_interchangeable = all(mask == self.all_rooms for mask in self.course_rooms)
+
+        # Rooms with the same attributes that the same courses may use are interchangeable
+        classes = {}
+        for room in range(len(rooms)):
+            barred = tuple(course for course, mask in enumerate(self.course_rooms) if not mask >> room & 1)
+            key = (self.room_capacity[room], self.room_projector[room], barred)
+            classes.setdefault(key, []).append(room)
+        self.room_classes = list(classes.values())
+        self.room_class = [0] * len(rooms)
+        for number, members in enumerate(self.room_classes):
+            for room in members:
+                self.room_class[room] = number
+
+        # Every weekly session of every course is one variable of the search
+        self.sessions = [
+            (course, session)
+            for course in range(len(self.course_ids))
+            for session in range(1, self.course_sessions[course] + 1)
+        ]
+
+    @classmethod
+    def from_db(cls):
+        """Load the problem with one query per table"""
+        slots = [(ts.id, ts.day, str(ts)) for ts in TimeSlot.objects.order_by('id')]
+        rooms = list(Room.objects.order_by('id').values_list('id', 'name', 'capacity', 'has_projector'))
+        faculties = list(Faculty.objects.order_by('id').values_list('id', 'name'))
+        courses = list(Course.objects.order_by('id').values_list(
+            'id', 'code', 'name', 'faculty_id', 'weekly_sessions'
+        ))
+        availability = FacultyAvailability.objects.filter(
+            is_available=True
+        ).values_list('faculty_id', 'time_slot_id')
+        return cls(slots, rooms, faculties, courses, availability)
+
+    @property
+    def num_slots(self):
+        return len(self.slot_ids)
+
+    @property
+    def num_rooms(self):
+        return len(self.room_ids)
+
+    def slot_day(self, slot):
+        """Day code ('MON', ...) of a time slot index"""
+        return DAYS[self.slot_days[slot]]
+
+    def to_schedules(self, assignments):
+        """Unsaved Schedule objects for (course, room, slot) index triples"""
+        return [
+            Schedule(
+                course_id=self.course_ids[course],
+                room_id=self.room_ids[room],
+                time_slot_id=self.slot_ids[slot],
+            )
+            for course, room, slot in assignments
+        ]
+
+    def from_schedules(self, rows):
+        """(course, room, slot) index triples for (course_id, room_id, time_slot_id) rows"""
+        return [
+            (self.course_index[course_id], self.room_index[room_id], self.slot_index[slot_id])
+            for course_id, room_id, slot_id in rows
+            if course_id in self.course_index and room_id in self.room_index and slot_id in self.slot_index
+        ]
@@ -0,0 +1,128 @@
+from .occupancy import OccupancyIndex
+from .search import BacktrackingSearch
+import random
+
+
+class ScheduleRepair:
+    """
+    Repairs an existing timetable after an edit instead of solving from scratch.
+
+    The current (course, room, slot) assignments are matched to sessions
+    and checked one by one against the hard constraints; whatever is still
+    valid is kept fixed and only the sessions left without a valid value are
+    searched for. When they cannot be placed around the fixed ones within
+    max_nodes, the neighbourhood is widened: first to every session of the
+    faculties involved, then to every session sitting in a slot those
+    faculties could use, and finally to a full re-solve. Each step reuses
+    BacktrackingSearch with its fixed assignments, so small edits touch only
+    a few classes and finish in a fraction of a second.
+
+    The full re-solve has no node budget, so it only runs with full=True;
+    callers that must answer quickly (a web request) pass full=False and
+    hand the repair to a background job when the bounded steps fail.
+    Before any of that, the search's root checks are run without fixed
+    values: when they fail no timetable exists at all, and `infeasible` is
+    set (as it is when the full re-solve fails) so no larger repair is tried.
+    """
+    def __init__(self, problem, current, rng=None, max_nodes=20000, full=True, stop=None):
+        self.problem = problem
+        self.current = current
+        self.rng = rng or random.Random()
+        self.max_nodes = max_nodes
+        self.full = full
+        self.stop = stop
+        self.search = BacktrackingSearch(problem, rng=self.rng, stop=stop)
+        self.previous = {}
+        self.invalid = []
+        # Proven that no timetable exists, so widening any further can't help
+        self.infeasible = False
+        # How many times the neighbourhood had to be widened
+        self.level = None
+        self.nodes = 0
+        self.backtracks = 0
+        self.max_depth = 0
+
+    def solve(self):
+        """Repair the timetable; returns True when every session has a valid value"""
+        search = self.search
+        kept = self._keep()
+        freed = set(range(len(self.problem.sessions))) - kept.keys()
+        self.nodes = self.backtracks = self.max_depth = 0
+        if search.start() == search.FAILED:
+            self.infeasible = True
+            return False
+
+        # Widen the neighbourhood until the freed sessions fit; None frees everything (only with full)
+        for level, neighbourhood in enumerate(self._neighbourhoods(freed, kept)):
+            self.level = level
+            fixed = None if neighbourhood is None else {
+                index: value for index, value in kept.items() if index not in neighbourhood
+            }
+            status = search.start(fixed)
+            if status != search.FAILED:
+                status = search.run(self.max_nodes if neighbourhood is not None else None)
+            self.nodes += search.nodes
+            self.backtracks += search.backtracks
+            self.max_depth = max(self.max_depth, search.max_depth)
+            if status == search.SOLVED:
+                return True
+            if status == search.PAUSED and self.stop is not None and self.stop.is_set():
+                return False
+            if neighbourhood is None and status == search.FAILED:
+                self.infeasible = True
+        return False
+
+    def assignments(self):
+        """(course, room, slot) triples of the repaired timetable"""
+        return self.search.assignments()
+
+    @property
+    def moved(self):
+        """Sessions placed differently than before the repair, newly placed ones included"""
+        return sum(
+            1 for index, value in enumerate(self.search.assignment)
+            if value is not None and self.previous.get(index) != value
+        )
+
+    def _keep(self):
+        """Map the current assignments to sessions and keep the ones that are still valid"""
+        problem = self.problem
+        search = self.search
+        occupancy = OccupancyIndex(problem)
+        open_sessions = {course: list(indices) for course, indices in enumerate(search.course_sessions)}
+        kept = {}
+        for course, room, slot in self.current:
+            if not open_sessions[course]:
+                # The course has fewer weekly sessions than it is scheduled for
+                self.invalid.append((course, room, slot))
+                continue
+            index = open_sessions[course].pop(0)
+            self.previous[index] = (slot, room)
+            if (not occupancy.can_place(course, room, slot)
+                    or search.spread_days[course] and occupancy.course_has_day(course, problem.slot_days[slot])):
+                self.invalid.append((course, room, slot))
+                continue
+            occupancy.place(course, room, slot)
+            kept[index] = (slot, room)
+        return kept
+
+    def _neighbourhoods(self, freed, kept):
+        """Growing sets of sessions to search for, ending with None (everything) when full"""
+        problem = self.problem
+        search = self.search
+        yield freed
+
+        faculties = {problem.course_faculty[problem.sessions[index][0]] for index in freed}
+        wider = freed | {index for faculty in faculties for index in search.faculty_sessions[faculty]}
+        if wider != freed:
+            yield wider
+
+        slots = 0
+        for faculty in faculties:
+            slots |= problem.faculty_available[faculty]
+        widest = wider | {index for index, (slot, _) in kept.items() if slots >> slot & 1}
+        if widest != wider and len(widest) < len(problem.sessions):
+            yield widest
+
+        if self.full:
+            yield None
@@ -1,111 +1,293 @@
-from .models import Course, Faculty, Room, TimeSlot, FacultyAvailability, Schedule
+from .cache import invalidate
+from .instrumentation import RunStats
+from .models import Schedule, TimetableVersion
+from .problem import DAYS, SchedulingProblem, bit_count
+from .local_search import LocalSearchSolver
+from .portfolio import PortfolioSolver
+from .repair import ScheduleRepair
+from .search import BacktrackingSearch
+from .two_phase import TwoPhaseSolver
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import transaction
+from django.utils import timezone
 import random
+import time as time_lib
+
+# Inactive timetable versions kept besides the active one (TIMETABLE_VERSIONS_KEPT)
+VERSIONS_KEPT = 20
+
+def publish_schedule(schedules, engine='', seed=None, label='', activate=True):
+    """
+    Store unsaved Schedule objects as a new TimetableVersion in one
+    transaction and, with activate, make it the published timetable, so
+    readers see either the old timetable or the new one. The oldest
+    inactive versions beyond TIMETABLE_VERSIONS_KEPT are dropped.
+    """
+    with transaction.atomic():
+        version = TimetableVersion.objects.create(engine=engine, seed=seed, label=label)
+        for schedule in schedules:
+            schedule.version = version
+        Schedule.objects.bulk_create(schedules)
+        if activate:
+            version.activate()
+        kept = getattr(settings, 'TIMETABLE_VERSIONS_KEPT', VERSIONS_KEPT)
+        stale = TimetableVersion.objects.filter(is_active=False).values_list('pk', flat=True)[kept:]
+        TimetableVersion.objects.filter(pk__in=list(stale)).delete()
+        # Bulk writes send no signals: drop the cached pages once the new rows are visible
+        transaction.on_commit(invalidate)
+    return version
+
 
 class TimetableScheduler:
-    def __init__(self):
-        self.courses = Course.objects.all()
-        self.rooms = Room.objects.all()
-        self.time_slots = TimeSlot.objects.all()
+    # Available search engines, selectable by name
+    ENGINES = {
+        'backtracking': BacktrackingSearch,
+        'two_phase': TwoPhaseSolver,
+        'local_search': LocalSearchSolver,
+    }
+
+    def __init__(self, engine='backtracking', workers=1, seed=None, profile=False, portfolio_time_limit=None,
+                 **options):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown scheduling engine '{engine}'")
+        # Phase timings and query counts; with profile=True also the time spent in each constraint check
+        self.stats = RunStats()
+        self.profile = profile
+        # Everything the search needs is loaded once; the search itself never queries the database
+        with self.stats.phase('load'):
+            self.problem = SchedulingProblem.from_db()
+        self.engine = engine
+        # Extra keyword arguments for the engine, e.g. time_limit and target for local_search
+        self.options = options
+        # With more than one worker a PortfolioSolver races several configurations in parallel processes
+        self.workers = workers
+        # Seconds the whole race may take; None lets it run until some worker finishes
+        self.portfolio_time_limit = portfolio_time_limit
+        self.winner = None
+        # Every random choice comes from this seed, so a run can be repeated exactly
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.solver = None
+        self.version = None
         self.schedule = []
+        self.nodes = 0
+        self.backtracks = 0
+
+    @property
+    def cancelled(self):
+        """Whether the stop event handed to the engine (e.g. by a cancelled job) has been set"""
+        stop = self.options.get('stop')
+        return stop is not None and stop.is_set()
+
+    def generate_timetable(self, activate=True):
+        """
+        Generate a timetable using backtracking with graph coloring principles.
+        Each course needs to be assigned a (room, time_slot) combination that satisfies all constraints.
+        The search runs entirely in memory and the result is stored as a new timetable version in one
+        transaction, published unless activate is False (a candidate to compare or activate later);
+        when no timetable is found nothing is stored.
+        """
+        # Run the selected engine (see BacktrackingSearch, TwoPhaseSolver and LocalSearchSolver)
+        with self.stats.phase('search'):
+            if self.workers > 1:
+                solver = PortfolioSolver(self.problem, self.workers, engine=self.engine, options=self.options,
+                                         seed=self.seed, time_limit=self.portfolio_time_limit)
+            else:
+                solver = self.ENGINES[self.engine](self.problem, rng=random.Random(self.seed), **self.options)
+            if self.profile:
+                self.stats.profile(solver)
+            self.solver = solver
+            success = solver.solve()
+        self.stats.record(solver)
+        self.winner = getattr(solver, 'best', None)
+        self.nodes = solver.nodes
+        self.backtracks = solver.backtracks
+
+        if success and self.cancelled:
+            # Local search hands back its best timetable when stopped, but a cancelled run publishes nothing
+            self.schedule = []
+            return Schedule.objects.none()
+        if not success:
+            print("Failed to generate a complete schedule with the given constraints.")
+            self.schedule = []
+            return Schedule.objects.none()
+        self.schedule = solver.assignments()
+
+        # A portfolio's timetable comes from its winning worker, whose engine and seed repeat it
+        engine, seed = (self.winner['engine'], self.winner['seed']) if self.winner else (self.engine, self.seed)
+        with self.stats.phase('persist'):
+            self.version = publish_schedule(self.problem.to_schedules(self.schedule), engine=engine, seed=seed,
+                                            activate=activate)
+
+        return Schedule.objects.filter(version=self.version)
+
+    def repair_timetable(self, full=True):
+        """
+        Bring the active timetable version back in line with the current
+        constraints, moving as few classes as possible (see ScheduleRepair).
+        The version is updated in place and only the rows that change are
+        deleted or inserted; when no repair is found it is left as it was.
+        With full=False the unbounded full re-solve is skipped.
+        """
+        with self.stats.phase('load'):
+            self.version = TimetableVersion.active()
+            rows = list(Schedule.objects.filter(version=self.version).order_by('id').values_list(
+                'id', 'course_id', 'room_id', 'time_slot_id'
+            ))
+        current = self.problem.from_schedules(row[1:] for row in rows)
+
+        with self.stats.phase('search'):
+            solver = ScheduleRepair(self.problem, current, rng=random.Random(self.seed), full=full, **self.options)
+            if self.profile:
+                self.stats.profile(solver)
+            self.solver = solver
+            success = solver.solve()
+        self.stats.record(solver)
+        self.nodes = solver.nodes
+        self.backtracks = solver.backtracks
+
+        if not success or self.cancelled:
+            self.schedule = []
+            return Schedule.objects.none()
+        self.schedule = solver.assignments()
+
+        if self.version is None:
+            # Nothing was published yet: the repair is a first timetable
+            with self.stats.phase('persist'):
+                self.version = publish_schedule(self.problem.to_schedules(self.schedule), engine='repair',
+                                                seed=self.seed)
+            return Schedule.objects.filter(version=self.version)
+
+        # Keep the rows whose class did not move; replace the rest
+        problem = self.problem
+        wanted = {}
+        for course, room, slot in self.schedule:
+            key = (problem.course_ids[course], problem.room_ids[room], problem.slot_ids[slot])
+            wanted[key] = wanted.get(key, 0) + 1
+        stale = []
+        for pk, *key in rows:
+            key = tuple(key)
+            if wanted.get(key):
+                wanted[key] -= 1
+            else:
+                stale.append(pk)
+        with self.stats.phase('persist'), transaction.atomic():
+            Schedule.objects.filter(pk__in=stale).delete()
+            Schedule.objects.bulk_create(
+                Schedule(version=self.version, course_id=course_id, room_id=room_id, time_slot_id=slot_id)
+                for (course_id, room_id, slot_id), count in wanted.items()
+                for _ in range(count)
+            )
+            TimetableVersion.objects.filter(pk=self.version.pk).update(updated_at=timezone.now())
+            transaction.on_commit(invalidate)
+
+        return Schedule.objects.filter(version=self.version)
+
+
+class VerboseTimetableScheduler:
+    """Backtracking run that logs every search step to a stream (run_scheduler --verbose, verbose jobs)"""
+    def __init__(self, stdout, style=None, seed=None, profile=False, stop=None):
+        self.stats = RunStats()
+        self.profile = profile
+        with self.stats.phase('load'):
+            self.problem = SchedulingProblem.from_db()
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.stop = stop
+        self.search = None
+        self.version = None
+        self.schedule = []
+        self.stdout = stdout
+        # Plain text when writing somewhere without a command style (e.g. a StringIO buffer)
+        self.style = style or no_style()
+        self.indent = 0
+        self.assignments_tried = 0
+        self.backtracks = 0
+        
+    def log(self, message):
+        self.stdout.write(' ' * self.indent + message)
         
     def generate_timetable(self):
         """
         Generate a timetable using backtracking with graph coloring principles.
         Each course needs to be assigned a (room, time_slot) combination that satisfies all constraints.
         """
-        # Clear any existing schedules
-        Schedule.objects.all().delete()
+        start_time = time_lib.time()
+        problem = self.problem
         
-        # Sort courses by constraints (courses with most constraints first)
-        courses_with_sessions = []
+        # The current schedules stay published until the new timetable replaces them
+        self.log("Keeping existing schedules until the new timetable is ready...")
         
-        # 1. First add courses with higher weekly sessions as they have more constraints
-        for course in sorted(self.courses, key=lambda x: x.weekly_sessions, reverse=True):
-            for i in range(course.weekly_sessions):
-                courses_with_sessions.append((course, i+1))
+        self.log("Expanding courses to individual sessions...")
+        for course, session in problem.sessions:
+            self.log(f"  Added {problem.course_codes[course]}: {problem.course_names[course]}, Session {session}")
         
-        # 2. Track faculty assignments to ensure even distribution across days
-        faculty_day_assignments = {}
-        for faculty in Faculty.objects.all():
-            faculty_day_assignments[faculty.id] = {'MON': 0, 'TUE': 0, 'WED': 0, 'THU': 0, 'FRI': 0, 'SAT': 0}
-            
-        # Start the backtracking algorithm
-        success = self._schedule_courses(courses_with_sessions, faculty_day_assignments)
+        # Start the backtracking algorithm; log_event reports every step of it
+        self.log("\nStarting backtracking algorithm...")
+        with self.stats.phase('search'):
+            self.search = BacktrackingSearch(problem, rng=random.Random(self.seed), listener=self.log_event,
+                                             stop=self.stop)
+            if self.profile:
+                self.stats.profile(self.search)
+            result = self.search.solve()
+        self.stats.record(self.search)
+        self.indent = 0
+        self.assignments_tried = self.search.nodes
+        self.backtracks = self.search.backtracks
         
-        if not success:
-            print("Failed to generate a complete schedule with the given constraints.")
+        if self.stop is not None and self.stop.is_set():
+            # Cancelled: never publish, even if the search finished just before
+            result = False
+        if result:
+            self.schedule = self.search.assignments()
+            with self.stats.phase('persist'):
+                self.version = publish_schedule(problem.to_schedules(self.schedule), engine='backtracking',
+                                                seed=self.seed)
+        
+        end_time = time_lib.time()
+        duration = end_time - start_time
+        
+        self.log("")
+        if result:
+            self.log(self.style.SUCCESS(f"Successfully generated timetable in {duration:.2f} seconds"))
+            self.log(f"Tried {self.assignments_tried} assignments with {self.backtracks} backtracks")
+        else:
+            self.log(self.style.ERROR("Failed to generate a conflict-free timetable with current constraints"))
+            return Schedule.objects.none()
         
-        return Schedule.objects.all()
+        return Schedule.objects.filter(version=self.version)
     
-    def _schedule_courses(self, courses_to_schedule, faculty_day_assignments, index=0):
+    def log_event(self, event, index=None, slot=None, room=None, depth=0, **data):
         """
-        Backtracking algorithm to schedule courses
+        Log a BacktrackingSearch event, indented by the depth of the session it concerns
         """
-        # Base case: all courses are scheduled
-        if index >= len(courses_to_schedule):
-            return True
-            
-        course, session = courses_to_schedule[index]
-        faculty = course.faculty
-        
-        # Get available time slots for this faculty
-        faculty_availabilities = FacultyAvailability.objects.filter(
-            faculty=faculty, is_available=True
-        ).values_list('time_slot_id', flat=True)
-        
-        available_time_slots = list(TimeSlot.objects.filter(id__in=faculty_availabilities))
-        
-        # 3. Sort time slots to prioritize days with fewer assignments for this faculty
-        available_time_slots.sort(
-            key=lambda ts: (faculty_day_assignments[faculty.id][ts.day], random.random())
-        )
-        
-        # Track assigned time slots for this course to avoid scheduling multiple sessions on same day
-        course_days = set()
-        for sched in Schedule.objects.filter(course=course):
-            course_days.add(sched.time_slot.day)
+        problem = self.problem
+        self.indent = 2 * depth
+        if event == 'solved':
+            self.log(self.style.SUCCESS("All courses successfully scheduled!"))
+            return
+        if event == 'failed':
+            return
         
-        for time_slot in available_time_slots:
-            # 4. Try to distribute course sessions across different days 
-            if session > 1 and time_slot.day in course_days and len(course_days) < faculty.course_set.count():
-                continue
-                
-            # Check if faculty is already scheduled for this time slot
-            if Schedule.objects.filter(course__faculty=faculty, time_slot=time_slot).exists():
-                continue
-                
-            # Try each available room
-            rooms_to_try = list(self.rooms)
-            
-            # 5. Prioritize rooms with appropriate capacity for the course
-            random.shuffle(rooms_to_try)  # Add some randomness to avoid same room assignments
-            
-            for room in rooms_to_try:
-                # Check if room is already booked for this time slot
-                if Schedule.objects.filter(room=room, time_slot=time_slot).exists():
-                    continue
-                    
-                # Create a tentative schedule
-                schedule = Schedule(course=course, room=room, time_slot=time_slot)
-                schedule.save()
-                
-                # Update faculty day assignments count
-                faculty_day_assignments[faculty.id][time_slot.day] += 1
-                if time_slot.day not in course_days:
-                    course_days.add(time_slot.day)
-                
-                # Recursively try to schedule the next course
-                if self._schedule_courses(courses_to_schedule, faculty_day_assignments, index + 1):
-                    return True
-                    
-                # If we reach here, this assignment didn't work, so remove it and try another
-                faculty_day_assignments[faculty.id][time_slot.day] -= 1
-                if schedule.time_slot.day in course_days and not Schedule.objects.filter(
-                    course=course, time_slot__day=schedule.time_slot.day
-                ).exclude(id=schedule.id).exists():
-                    course_days.remove(schedule.time_slot.day)
-                
-                schedule.delete()
+        course, session = problem.sessions[index]
+        code = problem.course_codes[course]
+        label = None if slot is None else problem.slot_labels[slot]
+        room_name = None if room is None else problem.room_names[room]
         
-        # If no assignment worked, return False
-        return False
+        if event == 'select':
+            faculty_name = problem.faculty_names[problem.course_faculty[course]]
+            self.log(f"Scheduling {code} (Session {session}/{problem.course_sessions[course]})")
+            self.log(f"Faculty {faculty_name} has {bit_count(self.search.domains[index])} time slots left for this session")
+            for day in self.search.occupancy.course_days(course):
+                self.log(f"Course {code} already scheduled on {DAYS[day]}")
+        elif event == 'nogood':
+            self.log(f"  ❌ Skip time slot {label}: ruled out by an earlier dead end")
+        elif event == 'assign':
+            self.log(f"  ✅ Try: {code} in {room_name} at {label}")
+        elif event == 'wipeout':
+            self.log(f"  ❌ {code} at {label} leaves another session without a time slot")
+        elif event == 'backtrack':
+            self.log(f"  ⏪ Backtrack: Removing {code} from {room_name} at {label}")
+        elif event == 'backjump':
+            self.log(f"  ⏪ Jump back over {code}: it is not part of the conflict")
+        elif event == 'exhausted':
+            self.log(f"❗ Failed to find valid slot for {code}")
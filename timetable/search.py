@@ -0,0 +1,593 @@
+from .occupancy import OccupancyIndex
+from .problem import DAYS, bit_count, iter_bits
+import random
+
+
+class _Frame:
+    """One level of the search stack: a session, its values and how far through them we are"""
+    __slots__ = ('index', 'values', 'position', 'conflict', 'value', 'mark')
+
+    def __init__(self, index, values, conflict, position=0, value=None, mark=0):
+        self.index = index
+        self.values = values
+        self.conflict = conflict
+        self.position = position
+        self.value = value
+        self.mark = mark
+
+    def dump(self):
+        return [self.index, [list(value) for value in self.values], sorted(self.conflict),
+                self.position, None if self.value is None else list(self.value), self.mark]
+
+    @classmethod
+    def load(cls, entry):
+        index, values, conflict, position, value, mark = entry
+        return cls(index, [tuple(item) for item in values], set(conflict), position,
+                   None if value is None else tuple(value), mark)
+
+
+class BacktrackingSearch:
+    """
+    Backtracking search over course sessions with forward checking.
+
+    Every unassigned session keeps a domain: the bitmask of time slots it
+    could still take. Assigning a session removes that slot from the other
+    sessions of the same faculty, removes that day from the other sessions
+    of the same course and, once every room is booked, removes the slot from
+    everybody. As soon as a domain becomes empty the branch is abandoned.
+
+    The next session is picked by minimum remaining values, breaking ties by
+    the number of unassigned sessions that share its faculty (degree). The
+    domain sizes, the degrees and the room counts behind _rooms_exhausted
+    are counters kept up to date as sessions are assigned and domains
+    shrink, so a node does not recount every session.
+
+    Dead ends are handled with conflict-directed backjumping: every pruned
+    slot remembers which assigned sessions removed it, a failing session
+    returns the union of those reasons, and the search unwinds straight to
+    the most recent session in that set instead of the chronologically
+    previous one. Each such conflict set is also learned as a nogood (a
+    combination of session -> slot assignments that cannot be completed) and
+    values completing a known nogood are rejected without being explored.
+
+    When every course may use every room, rooms are interchangeable for
+    feasibility: only the number of free rooms in a slot matters, so
+    conflicts and nogoods are expressed on slots, and for each slot only one
+    free room per equivalence class (same capacity and projector) is tried
+    rather than every free room.
+
+    With assign_rooms=False only time slots are decided (rooms are left as
+    None and a slot is full once it holds as many sessions as there are
+    rooms); TwoPhaseSolver matches the rooms afterwards.
+
+    The search keeps its own stack of frames instead of recursing, so the
+    number of sessions is not bounded by Python's recursion limit. run() can
+    stop after a number of nodes and be called again to continue, and
+    snapshot()/restore() carry a paused search across processes or requests.
+    A listener, when given, is called with every search event (select,
+    assign, wipeout, nogood, backtrack, backjump, exhausted, solved, failed)
+    so the verbose and animated schedulers can report progress. Setting the
+    stop event pauses the search at the next check (every 256 nodes).
+    """
+    SOLVED = 'solved'
+    FAILED = 'failed'
+    PAUSED = 'paused'
+
+    # Constraint checks timed by RunStats.profile
+    PROFILED = ('_forward_check', '_overcommitted', '_rooms_exhausted', '_nogood_reason')
+
+    def __init__(self, problem, rng=None, assign_rooms=True, max_nogoods=20000, max_nogood_size=16,
+                 listener=None, stop=None):
+        self.problem = problem
+        self.rng = rng or random.Random()
+        self.listener = listener
+        # Anything with is_set() (threading or multiprocessing Event); the search pauses once it is set
+        self.stop = stop
+        self.assign_rooms = assign_rooms
+        self.max_nogoods = max_nogoods
+        self.max_nogood_size = max_nogood_size
+        self.sessions = problem.sessions
+        self.session_faculty = [problem.course_faculty[course] for course, _ in self.sessions]
+
+        # Slot-level nogoods are only exact when rooms do not matter for feasibility
+        self.learning = not assign_rooms or problem.rooms_interchangeable
+        self.nogood_watch = {}
+        self.nogood_list = []
+        self.nogoods = 0
+
+        # Sessions grouped by the faculty and by the course they belong to
+        self.faculty_sessions = [[] for _ in problem.faculty_ids]
+        self.course_sessions = [[] for _ in problem.course_ids]
+        for index, (course, session) in enumerate(self.sessions):
+            self.faculty_sessions[problem.course_faculty[course]].append(index)
+            self.course_sessions[course].append(index)
+
+        # Sessions of a course go on different days whenever the faculty has enough days for them
+        self.spread_days = []
+        for course in range(len(problem.course_ids)):
+            available = problem.faculty_available[problem.course_faculty[course]]
+            days = sum(1 for mask in problem.day_masks if available & mask)
+            self.spread_days.append(problem.course_sessions[course] <= days)
+
+        # Room groups: all rooms, plus every distinct set of rooms some course is limited to.
+        # A slot holds at most as many sessions confined to a group as the group has rooms.
+        group_masks = [problem.all_rooms] + sorted(set(problem.course_rooms) - {problem.all_rooms})
+        self.group_capacity = [bit_count(mask) for mask in group_masks]
+        self.course_groups = [
+            [group for group, mask in enumerate(group_masks) if not rooms & ~mask]
+            for rooms in problem.course_rooms
+        ]
+        self.group_members = [[] for _ in group_masks]
+        for index, (course, _) in enumerate(self.sessions):
+            for group in self.course_groups[course]:
+                self.group_members[group].append(index)
+        self.group_faculties = [{self.session_faculty[index] for index in members} for members in self.group_members]
+
+        self.reset()
+
+    def reset(self):
+        problem = self.problem
+        self.occupancy = OccupancyIndex(problem)
+        self.domains = [problem.faculty_available[problem.course_faculty[course]] for course, _ in self.sessions]
+        self.assignment = [None] * len(self.sessions)
+        self.unassigned = set(range(len(self.sessions)))
+        self.trail = []
+        self.pruners = [[] for _ in self.sessions]
+        self.slot_sessions = [[] for _ in range(problem.num_slots)]
+        self.group_slot_sessions = [[[] for _ in range(problem.num_slots)] for _ in self.group_capacity]
+        self.faculty_day_load = [[0] * len(DAYS) for _ in problem.faculty_ids]
+        self._recount()
+        self.fixed = []
+        self.stack = []
+        self.failure = None
+        self.status = self.PAUSED
+        self.max_depth = 0
+        self.nodes = 0
+        self.backtracks = 0
+        self.backjumps = 0
+        self.nogood_prunes = 0
+
+    def start(self, fixed=None):
+        """
+        Set up a new search without trying any value yet; fixed maps session
+        indices to (slot, room) values they must keep. Returns the status.
+        """
+        self.reset()
+        for index, (slot, room) in (fixed or {}).items():
+            self.fixed.append((index, slot, room))
+            self._assign(index, slot, room)
+            if self._forward_check(index, slot) is not None:
+                self.status = self.FAILED
+                return self.status
+        if any(self._overcommitted(faculty) is not None for faculty in range(len(self.problem.faculty_ids))):
+            self.status = self.FAILED
+        elif self._rooms_exhausted() is not None:
+            self.status = self.FAILED
+        else:
+            self.status = self.PAUSED
+        return self.status
+
+    def solve(self, fixed=None):
+        """
+        Search for a complete assignment; returns True when one is found.
+        fixed maps session indices to (slot, room) values they must keep.
+        """
+        return self.start(fixed) != self.FAILED and self.run() == self.SOLVED
+
+    def run(self, max_nodes=None):
+        """
+        Continue the search until it is solved, fails, or max_nodes more
+        values have been tried; returns SOLVED, FAILED or PAUSED
+        """
+        if self.status != self.PAUSED:
+            return self.status
+        limit = None if max_nodes is None else self.nodes + max_nodes
+        stack = self.stack
+
+        while True:
+            if self.failure is not None:
+                # 1. Unwind a dead end: undo the value on top of the stack and see whether it is to blame
+                if not stack:
+                    self.status = self.FAILED
+                    self._notify('failed')
+                    return self.status
+                frame = stack[-1]
+                slot, room = frame.value
+                self._unassign(frame.index, slot, room, frame.mark)
+                frame.value = None
+                self.backtracks += 1
+                self._notify('backtrack', index=frame.index, slot=slot, room=room, depth=len(stack))
+
+                if frame.index not in self.failure:
+                    # This session took no part in the conflict: jump back over it
+                    self.backjumps += 1
+                    stack.pop()
+                    self._notify('backjump', index=frame.index, depth=len(stack) + 1)
+                    continue
+                self.failure.discard(frame.index)
+                frame.conflict |= self.failure
+                self.failure = None
+
+            elif not self.unassigned:
+                # 2. Every session has a value
+                self.status = self.SOLVED
+                self._notify('solved', depth=len(stack))
+                return self.status
+
+            elif not stack or stack[-1].value is not None:
+                # 3. Open a frame for the next session
+                index = self._select_session()
+                values, conflict = self._candidate_values(index)
+                conflict |= self._reasons(index)
+                stack.append(_Frame(index, values, conflict))
+                if len(stack) > self.max_depth:
+                    self.max_depth = len(stack)
+                self._notify('select', index=index, depth=len(stack), values=len(values))
+
+            # 4. Try the next value of the frame on top
+            frame = stack[-1]
+            index = frame.index
+            while frame.position < len(frame.values):
+                if limit is not None and self.nodes >= limit:
+                    self.status = self.PAUSED
+                    return self.status
+                if self.stop is not None and not self.nodes & 255 and self.stop.is_set():
+                    self.status = self.PAUSED
+                    return self.status
+
+                slot, room = frame.values[frame.position]
+                frame.position += 1
+                reason = self._nogood_reason(index, slot)
+                if reason is not None:
+                    self.nogood_prunes += 1
+                    frame.conflict |= reason
+                    self._notify('nogood', index=index, slot=slot, room=room, depth=len(stack))
+                    continue
+
+                self.nodes += 1
+                frame.mark = len(self.trail)
+                self._assign(index, slot, room)
+                frame.value = (slot, room)
+                self._notify('assign', index=index, slot=slot, room=room, depth=len(stack))
+
+                self.failure = self._forward_check(index, slot)
+                if self.failure is not None:
+                    self._notify('wipeout', index=index, slot=slot, room=room, depth=len(stack),
+                                 conflict=self.failure)
+                break
+            else:
+                # No value left: the conflict set of the frame explains the dead end
+                self._learn(frame.conflict)
+                stack.pop()
+                self.failure = frame.conflict
+                self._notify('exhausted', index=index, depth=len(stack) + 1)
+
+    def add_nogood(self, literals):
+        """Forbid a combination of (session index, slot) values from ever being assigned together"""
+        nogood = tuple(literals)
+        for literal in nogood:
+            self.nogood_watch.setdefault(literal, []).append(nogood)
+        self.nogood_list.append(nogood)
+        self.nogoods += 1
+
+    def assignments(self):
+        """(course, room, slot) triples of the current assignment"""
+        result = []
+        for index, value in enumerate(self.assignment):
+            if value is not None:
+                slot, room = value
+                result.append((self.sessions[index][0], room, slot))
+        return result
+
+    def snapshot(self):
+        """
+        State of the search as plain lists, numbers and strings (JSON
+        serialisable), so a paused search can be stored and continued later
+        with restore()
+        """
+        # The k-th trail entry of a session goes with the k-th reason in its pruners
+        seen = [0] * len(self.sessions)
+        trail = []
+        for other, domain in self.trail:
+            trail.append([other, domain, list(self.pruners[other][seen[other]])])
+            seen[other] += 1
+
+        version, internal, gauss = self.rng.getstate()
+        return {
+            'sessions': len(self.sessions),
+            'assign_rooms': self.assign_rooms,
+            'max_nogoods': self.max_nogoods,
+            'max_nogood_size': self.max_nogood_size,
+            'status': self.status,
+            'fixed': [list(entry) for entry in self.fixed],
+            'stack': [frame.dump() for frame in self.stack],
+            'failure': None if self.failure is None else sorted(self.failure),
+            'domains': list(self.domains),
+            'trail': trail,
+            'nogoods': [[list(literal) for literal in nogood] for nogood in self.nogood_list],
+            'counters': [self.nodes, self.backtracks, self.backjumps, self.nogood_prunes, self.max_depth],
+            'rng': [version, list(internal), gauss],
+        }
+
+    @classmethod
+    def restore(cls, problem, state, listener=None):
+        """Rebuild a search from snapshot() taken on the same problem; continue it with run()"""
+        if state['sessions'] != len(problem.sessions):
+            raise ValueError("Snapshot was taken on a different scheduling problem")
+        search = cls(problem, assign_rooms=state['assign_rooms'], max_nogoods=state['max_nogoods'],
+                     max_nogood_size=state['max_nogood_size'], listener=listener)
+        for nogood in state['nogoods']:
+            search.add_nogood(tuple(literal) for literal in nogood)
+
+        # Replay the assignments in their original order, then put back the pruned domains
+        for index, slot, room in state['fixed']:
+            search.fixed.append((index, slot, room))
+            search._assign(index, slot, room)
+        for entry in state['stack']:
+            frame = _Frame.load(entry)
+            search.stack.append(frame)
+            if frame.value is not None:
+                search._assign(frame.index, *frame.value)
+        search.domains = list(state['domains'])
+        search._recount()
+        for other, domain, reason in state['trail']:
+            search.trail.append((other, domain))
+            search.pruners[other].append(tuple(reason))
+
+        search.failure = None if state['failure'] is None else set(state['failure'])
+        search.nodes, search.backtracks, search.backjumps, search.nogood_prunes, search.max_depth = state['counters']
+        search.status = state['status']
+        version, internal, gauss = state['rng']
+        search.rng.setstate((version, tuple(internal), gauss))
+        return search
+
+    def _notify(self, event, **data):
+        """Report a search event to the listener, if there is one"""
+        if self.listener is not None:
+            self.listener(event, **data)
+
+    def _select_session(self):
+        """Minimum remaining values, ties broken by faculty degree, then by index"""
+        best = None
+        best_key = None
+        sizes = self.domain_sizes
+        faculty_unassigned = self.faculty_unassigned
+        session_faculty = self.session_faculty
+        for index in self.unassigned:
+            key = (sizes[index], -faculty_unassigned[session_faculty[index]], index)
+            if best_key is None or key < best_key:
+                best, best_key = index, key
+        return best
+
+    def _candidate_values(self, index):
+        """
+        (slot, room) values for a session, least loaded faculty days first,
+        with one representative room per class of identical rooms, and the
+        sessions whose rooms block slots left without an eligible free room
+        """
+        problem = self.problem
+        course = self.sessions[index][0]
+        day_load = self.faculty_day_load[problem.course_faculty[course]]
+        slots = list(iter_bits(self.domains[index]))
+        slots.sort(key=lambda slot: (day_load[problem.slot_days[slot]], self.rng.random()))
+
+        if not self.assign_rooms:
+            return [(slot, None) for slot in slots], set()
+
+        values = []
+        blocked = set()
+        for slot in slots:
+            rooms = [self.rng.choice(group) for group in self.occupancy.free_rooms_by_class(slot, course)]
+            if not rooms:
+                blocked.update(self.slot_sessions[slot])
+            self.rng.shuffle(rooms)
+            values.extend((slot, room) for room in rooms)
+        return values, blocked
+
+    def _assign(self, index, slot, room):
+        course = self.sessions[index][0]
+        faculty = self.session_faculty[index]
+        self.occupancy.place(course, room, slot)
+        self.assignment[index] = (slot, room)
+        self.unassigned.discard(index)
+        self.faculty_unassigned[faculty] -= 1
+        self._reach(index, self.domains[index], -1)
+        self.slot_sessions[slot].append(index)
+        for group in self.course_groups[course]:
+            self.group_unassigned[group] -= 1
+            occupants = self.group_slot_sessions[group][slot]
+            occupants.append(index)
+            free = self.group_capacity[group] - len(occupants)
+            teachers = self.group_teachers[group][slot]
+            self.group_room[group] += min(free, teachers) - min(free + 1, teachers)
+        self.faculty_day_load[faculty][self.problem.slot_days[slot]] += 1
+
+    def _unassign(self, index, slot, room, mark):
+        course = self.sessions[index][0]
+        faculty = self.session_faculty[index]
+        while len(self.trail) > mark:
+            other, domain = self.trail.pop()
+            restored = domain & ~self.domains[other]
+            self._reach(other, restored, 1)
+            self.domain_sizes[other] += bit_count(restored)
+            self.domains[other] = domain
+            self.pruners[other].pop()
+        self.occupancy.remove(course, room, slot)
+        self.assignment[index] = None
+        self.unassigned.add(index)
+        self.faculty_unassigned[faculty] += 1
+        self._reach(index, self.domains[index], 1)
+        self.slot_sessions[slot].pop()
+        for group in self.course_groups[course]:
+            self.group_unassigned[group] += 1
+            occupants = self.group_slot_sessions[group][slot]
+            occupants.pop()
+            free = self.group_capacity[group] - len(occupants)
+            teachers = self.group_teachers[group][slot]
+            self.group_room[group] += min(free, teachers) - min(free - 1, teachers)
+        self.faculty_day_load[faculty][self.problem.slot_days[slot]] -= 1
+
+    def _prune(self, other, mask, reason):
+        """Remove slots from an unassigned session's domain; False on wipe-out"""
+        domain = self.domains[other]
+        removed = domain & mask
+        if removed:
+            self.trail.append((other, domain))
+            self.pruners[other].append(reason)
+            self._reach(other, removed, -1)
+            self.domain_sizes[other] -= bit_count(removed)
+            domain &= ~mask
+            self.domains[other] = domain
+        return bool(domain)
+
+    def _recount(self):
+        """
+        Rebuild the counters kept alongside the domains: the size of every
+        domain, the unassigned sessions of every faculty (their degree) and,
+        behind _rooms_exhausted, per room group: group_reach
+        counts, per faculty and slot, the unassigned members of that faculty
+        that can still use the slot; group_teachers the faculties reaching
+        each slot; group_room the sessions the group's slots can still take
+        (at most one per free room and one per faculty in a slot).
+        """
+        num_slots = self.problem.num_slots
+        self.domain_sizes = [bit_count(domain) for domain in self.domains]
+        self.faculty_unassigned = [sum(1 for other in sessions if self.assignment[other] is None)
+                                   for sessions in self.faculty_sessions]
+        self.group_reach = [{faculty: [0] * num_slots for faculty in faculties} for faculties in self.group_faculties]
+        self.group_teachers = [[0] * num_slots for _ in self.group_capacity]
+        self.group_room = [0] * len(self.group_capacity)
+        self.group_unassigned = [0] * len(self.group_capacity)
+        for index in self.unassigned:
+            for group in self.course_groups[self.sessions[index][0]]:
+                self.group_unassigned[group] += 1
+            self._reach(index, self.domains[index], 1)
+
+    def _reach(self, index, mask, step):
+        """Count (step 1) or stop counting (step -1) the slots of mask as usable by a session"""
+        faculty = self.session_faculty[index]
+        for group in self.course_groups[self.sessions[index][0]]:
+            reach = self.group_reach[group][faculty]
+            teachers = self.group_teachers[group]
+            occupants = self.group_slot_sessions[group]
+            capacity = self.group_capacity[group]
+            for slot in iter_bits(mask):
+                count = reach[slot]
+                reach[slot] = count + step
+                if not count or not reach[slot]:
+                    # The faculty starts or stops reaching this slot
+                    free = capacity - len(occupants[slot])
+                    before = teachers[slot]
+                    teachers[slot] = before + step
+                    self.group_room[group] += min(free, before + step) - min(free, before)
+
+    def _reasons(self, index):
+        """Assigned sessions responsible for the slots missing from a domain"""
+        reasons = set()
+        for reason in self.pruners[index]:
+            reasons.update(reason)
+        return reasons
+
+    def _forward_check(self, index, slot):
+        """Prune the neighbours of a new assignment; returns the conflict set on a wipe-out"""
+        problem = self.problem
+        course = self.sessions[index][0]
+        faculty = problem.course_faculty[course]
+        bit = 1 << slot
+        mark = len(self.trail)
+
+        # The faculty cannot teach twice in the same slot
+        for other in self.faculty_sessions[faculty]:
+            if self.assignment[other] is None and not self._prune(other, bit, (index,)):
+                return self._reasons(other)
+        faculties = {faculty}
+
+        # Every room of a group is booked: nobody confined to the group can use this slot
+        for group in self.course_groups[course]:
+            occupants = self.group_slot_sessions[group][slot]
+            if len(occupants) < self.group_capacity[group]:
+                continue
+            reason = tuple(occupants)
+            for other in (list(self.unassigned) if group == 0 else self.group_members[group]):
+                if self.assignment[other] is None and self.domains[other] & bit:
+                    if not self._prune(other, bit, reason):
+                        return self._reasons(other)
+                    faculties.add(problem.course_faculty[self.sessions[other][0]])
+
+        # The other sessions of the course go on other days
+        if self.spread_days[course]:
+            day_mask = problem.day_masks[problem.slot_days[slot]]
+            for other in self.course_sessions[course]:
+                if self.assignment[other] is None and not self._prune(other, day_mask, (index,)):
+                    return self._reasons(other)
+
+        for other_faculty in faculties:
+            conflict = self._overcommitted(other_faculty)
+            if conflict is not None:
+                return conflict
+
+        # Only the groups of this session and of the sessions just pruned can have run out of room
+        groups = set(self.course_groups[course])
+        for other, _ in self.trail[mark:]:
+            groups.update(self.course_groups[self.sessions[other][0]])
+        return self._rooms_exhausted(groups)
+
+    def _overcommitted(self, faculty):
+        """
+        Conflict set when a faculty has more unassigned sessions than slots
+        left in their domains (each of them needs a slot of its own)
+        """
+        remaining = [other for other in self.faculty_sessions[faculty] if self.assignment[other] is None]
+        slots = 0
+        for other in remaining:
+            slots |= self.domains[other]
+        if len(remaining) <= bit_count(slots):
+            return None
+        conflict = set()
+        for other in remaining:
+            conflict |= self._reasons(other)
+        return conflict
+
+    def _rooms_exhausted(self, groups=None):
+        """
+        Conflict set when the unassigned sessions confined to a room group
+        cannot all fit in the slots they can still use: a slot takes at most
+        one of them per free room of the group and one per faculty. Only the
+        given groups are checked (all of them by default).
+        """
+        for group in range(len(self.group_capacity)) if groups is None else sorted(groups):
+            if self.group_unassigned[group] <= self.group_room[group]:
+                continue
+            members = self.unassigned if group == 0 else [
+                other for other in self.group_members[group] if self.assignment[other] is None
+            ]
+            slots = 0
+            conflict = set()
+            for other in members:
+                slots |= self.domains[other]
+                conflict |= self._reasons(other)
+            for slot in iter_bits(slots):
+                conflict.update(self.group_slot_sessions[group][slot])
+            return conflict
+        return None
+
+    def _learn(self, conflict):
+        """Remember that the current slots of the conflict set cannot all be kept"""
+        if not self.learning or len(conflict) > self.max_nogood_size or self.nogoods >= self.max_nogoods:
+            return
+        self.add_nogood((other, self.assignment[other][0]) for other in conflict)
+
+    def _nogood_reason(self, index, slot):
+        """Sessions of a learned nogood that assigning this slot would complete"""
+        for nogood in self.nogood_watch.get((index, slot), ()):
+            reason = set()
+            for other, other_slot in nogood:
+                if other == index:
+                    continue
+                value = self.assignment[other]
+                if value is None or value[0] != other_slot:
+                    break
+                reason.add(other)
+            else:
+                return reason
+        return None
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .cache import invalidate
+from .models import Course, Faculty, Room, Schedule, TimeSlot, TimetableVersion
+
+# Models shown on the cached timetable pages. Schedule rows are written and
+# deleted in bulk by publish_schedule and repairs, which invalidate the cache
+# themselves: a post_delete receiver on Schedule would stop Django from
+# deleting old versions with a single query.
+SAVED = (Schedule, Course, Faculty, Room, TimeSlot)
+DELETED = (Course, Faculty, Room, TimeSlot)
+
+
+def touch_versions(**kwargs):
+    """A course, faculty member, room or time slot changed: every version that shows it is modified"""
+    TimetableVersion.objects.update(updated_at=timezone.now())
+
+
+def connect():
+    for model in SAVED:
+        post_save.connect(invalidate, sender=model, dispatch_uid=f'timetable-cache-save-{model.__name__}')
+    for model in DELETED:
+        post_delete.connect(invalidate, sender=model, dispatch_uid=f'timetable-cache-delete-{model.__name__}')
+        post_save.connect(touch_versions, sender=model, dispatch_uid=f'timetable-touch-save-{model.__name__}')
+        post_delete.connect(touch_versions, sender=model, dispatch_uid=f'timetable-touch-delete-{model.__name__}')
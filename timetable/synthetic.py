@@ -0,0 +1,122 @@
+from datetime import time
+import random
+
+from .models import Course, Faculty, Room, TimeSlot, FacultyAvailability, Schedule, TimetableVersion
+from .problem import DAYS, SchedulingProblem
+
+# Named instance sizes for benchmarks: faculties, courses, rooms, days, slots per day
+SIZES = {
+    'small': (5, 12, 5, 5, 6),
+    'medium': (20, 60, 10, 5, 8),
+    'large': (80, 300, 30, 5, 8),
+    'xlarge': (200, 800, 50, 6, 10),
+}
+
+
+def parse_size(size):
+    """SIZES name or 'FxCxRxDxS' (faculties x courses x rooms x days x slots per day)"""
+    if size in SIZES:
+        return SIZES[size]
+    try:
+        values = tuple(int(part) for part in size.split('x'))
+    except ValueError:
+        values = ()
+    if len(values) != 5:
+        raise ValueError(f"Unknown instance size '{size}'; use one of {', '.join(SIZES)} or FxCxRxDxS")
+    return values
+
+
+class SyntheticInstance:
+    """
+    A random but reproducible scheduling instance.
+
+    density is the probability that a faculty is available in a time slot
+    (every faculty is given at least as many slots as sessions to teach) and
+    tightness is the number of weekly sessions over the number of (slot,
+    room) places. The instance can be used directly as a SchedulingProblem
+    or written to the database to exercise the full load/search/persist path.
+    """
+    def __init__(self, faculties=5, courses=12, rooms=5, days=5, slots_per_day=6,
+                 density=0.8, tightness=0.5, seed=0):
+        if not 1 <= days <= len(DAYS):
+            raise ValueError(f"days must be between 1 and {len(DAYS)}")
+        if not 1 <= slots_per_day <= 14:
+            raise ValueError("slots_per_day must be between 1 and 14")
+        rng = random.Random(seed)
+        day_names = dict(TimeSlot.DAY_CHOICES)
+
+        # Hourly slots from 08:00, each 50 minutes long
+        self.slots = []
+        for day in DAYS[:days]:
+            for period in range(slots_per_day):
+                self.slots.append((len(self.slots) + 1, day, time(8 + period, 0), time(8 + period, 50)))
+        self.slot_labels = [
+            f"{day_names[day]} {start.strftime('%H:%M')} - {end.strftime('%H:%M')}"
+            for _, day, start, end in self.slots
+        ]
+
+        self.rooms = [
+            (number, f"Room {number}", rng.choice([20, 30, 45, 60, 100]), rng.random() < 0.7)
+            for number in range(1, rooms + 1)
+        ]
+        self.faculties = [(number, f"Faculty {number}") for number in range(1, faculties + 1)]
+
+        # Spread the weekly sessions over the courses, at most one per day and three per course
+        most = min(days, 3)
+        total = min(max(courses, round(tightness * len(self.slots) * rooms)), courses * most)
+        sessions = [1] * courses
+        open_courses = list(range(courses))
+        for _ in range(total - courses):
+            course = rng.choice(open_courses)
+            sessions[course] += 1
+            if sessions[course] == most:
+                open_courses.remove(course)
+        self.courses = [
+            (number + 1, f"SYN{number + 1}", f"Synthetic Course {number + 1}", number % faculties + 1, sessions[number])
+            for number in range(courses)
+        ]
+
+        self.availability = []
+        for faculty, _ in self.faculties:
+            load = sum(course[4] for course in self.courses if course[3] == faculty)
+            available = [slot for slot, *_ in self.slots if rng.random() < density]
+            missing = [slot for slot, *_ in self.slots if slot not in available]
+            rng.shuffle(missing)
+            available += missing[:max(load - len(available), 0)]
+            self.availability.extend((faculty, slot) for slot in sorted(available))
+
+    @property
+    def num_sessions(self):
+        return sum(course[4] for course in self.courses)
+
+    def problem(self):
+        """The instance as an in-memory SchedulingProblem"""
+        slots = [(slot, day, label) for (slot, day, _, _), label in zip(self.slots, self.slot_labels)]
+        return SchedulingProblem(slots, self.rooms, self.faculties, self.courses, self.availability)
+
+    def save(self):
+        """
+        Replace every scheduling table with this instance. Run it inside a
+        transaction that is rolled back afterwards to keep the real data.
+        """
+        for model in (Schedule, TimetableVersion, FacultyAvailability, Course, Room, TimeSlot, Faculty):
+            model.objects.all().delete()
+        Faculty.objects.bulk_create(
+            Faculty(id=number, name=name, department='Synthetic', email=f"faculty{number}@example.com")
+            for number, name in self.faculties
+        )
+        TimeSlot.objects.bulk_create(
+            TimeSlot(id=slot, day=day, start_time=start, end_time=end) for slot, day, start, end in self.slots
+        )
+        Room.objects.bulk_create(
+            Room(id=number, name=name, capacity=capacity, has_projector=projector)
+            for number, name, capacity, projector in self.rooms
+        )
+        Course.objects.bulk_create(
+            Course(id=number, code=code, name=name, faculty_id=faculty, weekly_sessions=weekly)
+            for number, code, name, faculty, weekly in self.courses
+        )
+        FacultyAvailability.objects.bulk_create(
+            FacultyAvailability(faculty_id=faculty, time_slot_id=slot, is_available=True)
+            for faculty, slot in self.availability
+        )
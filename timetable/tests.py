@@ -1,3 +1,1268 @@
-from django.test import TestCase
+from datetime import time, timedelta
+from itertools import permutations
+import csv
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time as time_lib
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .algorithm_visualizer import AnimatedTimetableScheduler
+from .availability import read_availability_csv, set_availability
+from .export import ics_lines
+from .importer import Importer, read_rows
+from .instrumentation import RunStats
+from .jobs import REPAIR, cancel_job, get_executor, recover_jobs, run_job, submit_job, submit_repair_job, worker_name
+from .local_search import LocalSearchSolver
+from .matching import hall_violator, hopcroft_karp
+from .models import Faculty, Course, Room, TimeSlot, FacultyAvailability, Schedule, TimetableVersion, GenerationJob
+from .occupancy import OccupancyIndex
+from .portfolio import PortfolioSolver
+from .problem import DAYS, SchedulingProblem
+from .scheduler import TimetableScheduler, publish_schedule
+from .search import BacktrackingSearch
+from .synthetic import SyntheticInstance, parse_size
+from .trace import new_trace_path
+from .two_phase import TwoPhaseSolver
+
+
+class TimetableTestCase(TestCase):
+    """A week of slots, five rooms and one course, with helpers to schedule classes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.slots = TimeSlot.objects.bulk_create(
+            TimeSlot(day=day, start_time=time(8 + hour), end_time=time(8 + hour, 50))
+            for day in ('MON', 'TUE', 'WED', 'THU', 'FRI') for hour in range(6)
+        )
+        cls.rooms = Room.objects.bulk_create(Room(name=f"Room {number}", capacity=30) for number in range(5))
+        cls.faculty = Faculty.objects.create(name='Faculty', department='Test', email='faculty@example.com')
+        cls.course = Course.objects.create(code='T100', name='Test Course', faculty=cls.faculty)
+        cls.version = TimetableVersion.objects.create(is_active=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def schedule(self, count):
+        Schedule.objects.bulk_create(
+            Schedule(version=self.version, course=self.course, room=self.rooms[number % len(self.rooms)],
+                     time_slot=self.slots[number // len(self.rooms)])
+            for number in range(count)
+        )
+
+
+class ViewTimetableQueriesTest(TimetableTestCase):
+    """The timetable page costs the same number of queries whatever the number of classes"""
+    # Active version, classes with their related rows, distinct slot times
+    QUERIES = 3
+
+    def test_constant_queries(self):
+        for count in (1, 40, 150):
+            with self.subTest(classes=count):
+                Schedule.objects.all().delete()
+                self.schedule(count)
+                cache.clear()
+                with self.assertNumQueries(self.QUERIES):
+                    response = self.client.get(reverse('view-timetable'))
+                self.assertEqual(len(response.context['schedules']), count)
+                self.assertContains(response, 'Room: Room 4' if count > 4 else 'Room: Room 0')
+
+    def test_grid(self):
+        self.schedule(6)
+        response = self.client.get(reverse('view-timetable'))
+        rows = response.context['timetable']
+        self.assertEqual(len(rows), 6)
+        # Classes 0-4 fill the five rooms on Monday 08:00, class 5 is on Monday 09:00
+        self.assertEqual(len(rows[0]['cells'][0]), 5)
+        self.assertEqual(len(rows[1]['cells'][0]), 1)
+        self.assertEqual(sum(len(cell) for row in rows for cell in row['cells']), 6)
+
+
+class TimetableCacheTest(TimetableTestCase):
+    """Cached grids are served without querying and dropped when what they show changes"""
+
+    def setUp(self):
+        super().setUp()
+        self.schedule(6)
+
+    def test_hit(self):
+        self.client.get(reverse('view-timetable'))
+        # Only the active version is looked up
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('view-timetable'))
+        self.assertEqual(len(response.context['schedules']), 6)
+        stats = self.client.get(reverse('timetable-cache-stats')).json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_filters_are_cached_apart(self):
+        self.client.get(reverse('view-timetable'))
+        response = self.client.get(reverse('view-timetable'), {'type': 'room', 'id': self.rooms[0].pk})
+        self.assertEqual(len(response.context['schedules']), 2)
+        self.assertEqual([room['name'] for room in response.context['rooms']][:2], ['Room 0', 'Room 1'])
+
+    def test_invalidated_on_change(self):
+        self.client.get(reverse('view-timetable'))
+        self.course.name = 'Renamed Course'
+        self.course.save()
+        response = self.client.get(reverse('view-timetable'))
+        self.assertContains(response, 'Renamed Course')
+        Room.objects.filter(pk=self.rooms[0].pk).delete()
+        self.client.get(reverse('view-timetable'))
+        stats = self.client.get(reverse('timetable-cache-stats')).json()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 3))
+
+
+class BulkAvailabilityTest(TimetableTestCase):
+    """Availability is written as a diff against the stored rows, in a fixed number of queries"""
+
+    def test_constant_queries(self):
+        faculties = Faculty.objects.bulk_create(
+            Faculty(name=f"Faculty {number}", department='Bulk', email=f"f{number}@example.com") for number in range(10)
+        )
+        wanted = {(faculty.pk, slot.pk): slot.day != 'FRI' for faculty in faculties for slot in self.slots}
+        # Savepoint, stored rows, inserts, release
+        with self.assertNumQueries(4):
+            result = set_availability(wanted)
+        self.assertEqual((result['created'], result['updated']), (300, 0))
+
+        wanted = {key: not value for key, value in wanted.items()}
+        # Savepoint, stored rows, one update per new value, release
+        with self.assertNumQueries(5):
+            result = set_availability(wanted)
+        self.assertEqual((result['created'], result['updated']), (0, 300))
+        self.assertEqual(FacultyAvailability.objects.filter(is_available=True).count(), 60)
+
+    def test_batches(self):
+        faculties = Faculty.objects.bulk_create(
+            Faculty(name=f"Faculty {number}", department='Bulk', email=f"f{number}@example.com") for number in range(10)
+        )
+        wanted = {(faculty.pk, slot.pk): slot.day != 'FRI' for faculty in faculties for slot in self.slots}
+        # A backend that takes 100 rows or ids per query
+        with mock.patch.object(connection.ops, 'bulk_batch_size', return_value=100):
+            # Savepoint, stored rows, three inserts, release
+            with self.assertNumQueries(6):
+                set_availability(wanted)
+            # Savepoint, stored rows, three updates to unavailable and one to available, release
+            with self.assertNumQueries(7):
+                result = set_availability({key: not value for key, value in wanted.items()})
+        self.assertEqual((result['created'], result['updated']), (0, 300))
+        self.assertEqual(FacultyAvailability.objects.filter(is_available=True).count(), 60)
+
+    def test_csv(self):
+        lines = [
+            'faculty,day,start_time,available',
+            'faculty@example.com,MON,8:00,no',
+            f"{self.faculty.pk},Tuesday,09:00:00,yes",
+            'nobody@example.com,MON,08:00,yes',
+            'faculty@example.com,SUN,08:00,yes',
+        ]
+        wanted, errors = read_availability_csv(lines)
+        self.assertEqual(wanted, {(self.faculty.pk, self.slots[0].pk): False, (self.faculty.pk, self.slots[7].pk): True})
+        self.assertEqual([line for line, _ in errors], [4, 5])
+
+    def test_department_form(self):
+        self.client.post(reverse('bulk-availability'), {'department': 'Test', 'time_slots': [self.slots[0].pk]})
+        self.assertEqual(
+            list(FacultyAvailability.objects.filter(is_available=True).values_list('time_slot_id', flat=True)),
+            [self.slots[0].pk],
+        )
+        self.assertEqual(FacultyAvailability.objects.count(), len(self.slots))
+
+
+class AvailabilityMeaningTest(TimetableTestCase):
+    """The availability page and the scheduler agree on slots that have no stored row"""
+
+    def available_slots(self):
+        problem = SchedulingProblem.from_db()
+        mask = problem.faculty_available[problem.faculty_index[self.faculty.pk]]
+        return {slot_id for number, slot_id in enumerate(problem.slot_ids) if mask >> number & 1}
+
+    def test_missing_rows_are_unavailable(self):
+        url = reverse('faculty-availability', args=[self.faculty.pk])
+        response = self.client.get(url)
+        self.assertFalse(any(response.context['availabilities'].values()))
+        self.assertEqual(self.available_slots(), set())
+        # Viewing the page stores nothing
+        self.assertFalse(FacultyAvailability.objects.exists())
+
+        self.client.post(url, {f'timeslot_{slot.pk}': 'on' for slot in self.slots[:3]})
+        response = self.client.get(url)
+        shown = {slot_id for slot_id, available in response.context['availabilities'].items() if available}
+        self.assertEqual(shown, {slot.pk for slot in self.slots[:3]})
+        self.assertEqual(self.available_slots(), shown)
+
+
+class RepairAfterAvailabilityTest(TimetableTestCase):
+    """An availability edit repairs the timetable in the request only within the bounded steps"""
+
+    def setUp(self):
+        super().setUp()
+        # One room: the other faculty's class at Monday 08:00 blocks the only slot left to this one
+        Room.objects.exclude(pk=self.rooms[0].pk).delete()
+        other = Faculty.objects.create(name='Other', department='Test', email='other@example.com')
+        self.other_course = Course.objects.create(code='T200', name='Other Course', faculty=other)
+        set_availability({(self.faculty.pk, self.slots[0].pk): True, (self.faculty.pk, self.slots[1].pk): True,
+                          (other.pk, self.slots[0].pk): True, (other.pk, self.slots[2].pk): True})
+        Schedule.objects.bulk_create([
+            Schedule(version=self.version, course=self.course, room=self.rooms[0], time_slot=self.slots[1]),
+            Schedule(version=self.version, course=self.other_course, room=self.rooms[0], time_slot=self.slots[0]),
+        ])
+
+    def placed(self):
+        return dict(Schedule.objects.filter(version=self.version).values_list('course__code', 'time_slot_id'))
+
+    def test_full_resolve_goes_to_a_job(self):
+        before = self.placed()
+        url = reverse('faculty-availability', args=[self.faculty.pk])
+        self.client.post(url, {f'timeslot_{self.slots[0].pk}': 'on'})
+        # The bounded steps can't move the other class, so the request leaves the timetable to a repair job
+        self.assertEqual(self.placed(), before)
+        self.assertEqual(list(GenerationJob.objects.values_list('engine', 'status')),
+                         [(REPAIR, GenerationJob.QUEUED)])
+        self.assertFalse(TimetableScheduler().repair_timetable(full=False).exists())
+
+        scheduler = TimetableScheduler()
+        scheduler.repair_timetable()
+        self.assertEqual(self.placed(), {'T100': self.slots[0].pk, 'T200': self.slots[2].pk})
+
+    def test_infeasible_not_queued(self):
+        before = self.placed()
+        url = reverse('faculty-availability', args=[self.faculty.pk])
+        # No slot left for the faculty: the repair gives up at once and queues nothing
+        response = self.client.post(url, {}, follow=True)
+        self.assertEqual(self.placed(), before)
+        self.assertFalse(GenerationJob.objects.exists())
+        self.assertIn("No conflict-free timetable fits the new availability",
+                      [str(message) for message in response.context['messages']][-1])
+
+    def test_bulk_page(self):
+        before = self.placed()
+        response = self.client.post(reverse('bulk-availability'), {
+            'faculties': [self.faculty.pk], 'time_slots': [self.slots[0].pk], 'format': 'json',
+        })
+        job = GenerationJob.objects.get()
+        self.assertEqual(job.engine, REPAIR)
+        self.assertIn(f"job {job.pk}", response.json()['timetable'])
+        self.assertEqual(self.placed(), before)
+
+
+class CancelledRunTest(TimetableTestCase):
+    """A run whose stop event is set publishes nothing, even when the engine still returns a timetable"""
+
+    def test_local_search_not_published(self):
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots})
+        stop = threading.Event()
+        stop.set()
+        scheduler = TimetableScheduler(engine='local_search', seed=1, stop=stop)
+        scheduler.generate_timetable()
+        # The greedy start is already conflict-free, so the engine itself reports success
+        self.assertTrue(scheduler.solver.schedule)
+        self.assertEqual(scheduler.schedule, [])
+        self.assertIsNone(scheduler.version)
+        self.assertEqual(TimetableVersion.objects.count(), 1)
+
+
+def random_problem(rng):
+    """A small instance where some courses are limited to some of the rooms"""
+    days, per_day = rng.randint(2, 3), 2
+    slots = [(slot, DAYS[slot // per_day], f"Slot {slot}") for slot in range(days * per_day)]
+    rooms = [(room, f"Room {room}", 30, False) for room in range(rng.randint(1, 3))]
+    faculties = [(faculty, f"Faculty {faculty}") for faculty in range(rng.randint(2, 4))]
+    courses = [(course, f"C{course}", f"Course {course}", rng.randrange(len(faculties)), rng.randint(1, 2))
+               for course in range(rng.randint(3, 6))]
+    availability = [(faculty, slot) for faculty, _ in faculties for slot, *_ in slots if rng.random() < 0.75]
+    eligible = [(course, room) for course, *_ in courses for room, *_ in rooms if rng.random() < 0.6]
+    return SchedulingProblem(slots, rooms, faculties, courses, availability, eligible)
+
+
+class GenerationJobTest(TimetableTestCase):
+    """Jobs are queued once the request commits, run in a worker and record how they ended"""
+
+    def setUp(self):
+        super().setUp()
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots})
+
+    def run_job(self, job):
+        # A worker thread closes its connection when done; here the test's connection must stay open
+        with mock.patch('timetable.jobs.connection'):
+            run_job(job.pk)
+        job.refresh_from_db()
+        return job
+
+    def test_queued_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            job = submit_job(seed=3)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual((job.status, job.worker), (GenerationJob.QUEUED, worker_name()))
+        with self.assertRaises(ValueError):
+            submit_job(engine='unknown')
+
+    def test_run(self):
+        job = self.run_job(submit_job(seed=3))
+        self.assertEqual((job.status, job.message, job.progress), (GenerationJob.SUCCEEDED, "Scheduled 1 classes", 1.0))
+        self.assertEqual(TimetableVersion.active(), job.version)
+        self.assertEqual((job.version.engine, job.version.seed, job.seed), ('backtracking', 3, 3))
+        self.assertTrue(job.started_at and job.finished_at and job.stats)
+
+    def test_candidate_and_verbose(self):
+        job = self.run_job(submit_job(seed=3, activate=False))
+        self.assertFalse(job.version.is_active)
+        self.assertEqual(TimetableVersion.active(), self.version)
+        job = self.run_job(submit_job(seed=3, verbose=True))
+        self.assertEqual(job.status, GenerationJob.SUCCEEDED)
+        self.assertIn("Starting backtracking algorithm", job.log)
+
+    def test_cancelled_before_start(self):
+        job = submit_job(seed=3)
+        cancel_job(job)
+        job = self.run_job(job)
+        self.assertEqual((job.status, job.version), (GenerationJob.CANCELLED, None))
+        self.assertEqual(TimetableVersion.objects.count(), 1)
+
+    def test_repair(self):
+        self.schedule(1)
+        job = self.run_job(submit_repair_job(seed=3))
+        self.assertEqual((job.status, job.message), (GenerationJob.SUCCEEDED, "Repaired the timetable, 0 classes moved"))
+        self.assertEqual(job.version, self.version)
+
+    def test_recover(self):
+        host = worker_name().rsplit(':', 2)[0]
+        finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True)
+        dead = int(finished.stdout)
+        workers = {
+            'dead': f"{host}:{dead}:0000",
+            'restarted': f"{host}:{os.getpid()}:0000",
+            'unrecorded': '',
+            'live': f"{host}:{os.getppid()}:0000",
+            'elsewhere': f"elsewhere:{dead}:0000",
+            'current': worker_name(),
+        }
+        jobs = {name: GenerationJob.objects.create(worker=worker, status=GenerationJob.RUNNING)
+                for name, worker in workers.items()}
+        done = GenerationJob.objects.create(worker=workers['dead'], status=GenerationJob.SUCCEEDED)
+        self.assertEqual(recover_jobs(), 3)
+        statuses = {name: GenerationJob.objects.get(pk=job.pk).status for name, job in jobs.items()}
+        self.assertEqual(statuses, {'dead': GenerationJob.FAILED, 'restarted': GenerationJob.FAILED,
+                                    'unrecorded': GenerationJob.FAILED, 'live': GenerationJob.RUNNING,
+                                    'elsewhere': GenerationJob.RUNNING, 'current': GenerationJob.RUNNING})
+        self.assertEqual(GenerationJob.objects.get(pk=done.pk).status, GenerationJob.SUCCEEDED)
+
+    def test_recovered_when_the_pool_starts(self):
+        with mock.patch('timetable.jobs._executor', None), mock.patch('timetable.jobs.recover_jobs') as recover:
+            get_executor().shutdown()
+            get_executor()
+        recover.assert_called_once_with()
+
+
+class RoomSymmetryTest(SimpleTestCase):
+    """Rooms no course can tell apart form one class, and the search tries one room of each"""
+
+    def problem(self, eligible=None):
+        slots = [(slot, DAYS[slot // 2], f"Slot {slot}") for slot in range(4)]
+        rooms = [(0, 'A', 30, False), (1, 'B', 30, False), (2, 'C', 30, True), (3, 'D', 60, False),
+                 (4, 'E', 30, False)]
+        faculties = [(0, 'Faculty')]
+        courses = [(0, 'C0', 'Course 0', 0, 2), (1, 'C1', 'Course 1', 0, 1)]
+        availability = [(0, slot) for slot, *_ in slots]
+        return SchedulingProblem(slots, rooms, faculties, courses, availability, eligible)
+
+    def test_classes(self):
+        problem = self.problem()
+        self.assertEqual(problem.room_classes, [[0, 1, 4], [2], [3]])
+        self.assertEqual(problem.room_class, [0, 0, 1, 2, 0])
+        # A course that may use only some of the identical rooms tells them apart
+        eligible = [(0, 0), (0, 1), (0, 2), (0, 3)] + [(1, room) for room in range(5)]
+        self.assertEqual(self.problem(eligible).room_classes, [[0, 1], [2], [3], [4]])
+
+    def test_free_rooms_by_class(self):
+        problem = self.problem([(0, 0), (0, 4)] + [(1, room) for room in range(5)])
+        occupancy = OccupancyIndex(problem)
+        occupancy.place(1, 0, 1)
+        self.assertEqual(problem.room_classes, [[0, 4], [1], [2], [3]])
+        self.assertEqual(occupancy.free_rooms_by_class(0), [[0, 4], [1], [2], [3]])
+        self.assertEqual(occupancy.free_rooms_by_class(1), [[4], [1], [2], [3]])
+        self.assertEqual(occupancy.free_rooms_by_class(1, course=0), [[4]])
+        occupancy.place(1, 4, 1)
+        self.assertEqual(occupancy.free_rooms_by_class(1, course=0), [])
+
+    def test_one_room_per_class(self):
+        problem = self.problem()
+        search = BacktrackingSearch(problem, rng=random.Random(0))
+        search.start()
+        values, blocked = search._candidate_values(0)
+        self.assertEqual(sorted((slot, problem.room_class[room]) for slot, room in values),
+                         [(slot, number) for slot in range(4) for number in range(3)])
+        self.assertEqual(blocked, set())
+        self.assertTrue(search.solve())
+        # Both sessions of course 0 and the one of course 1 need a slot each; rooms never cause a backtrack
+        self.assertEqual((search.nodes, search.backtracks), (3, 0))
+
+
+class TwoPhaseTest(TimetableTestCase):
+    """Slots are coloured first, then each slot's sessions are matched to rooms"""
+
+    def test_matching(self):
+        # The greedy choice of room 0 for the first session must be undone to match everyone
+        adjacency = [[0, 1], [0], [1, 2]]
+        match_left, match_right = hopcroft_karp(adjacency, 3)
+        self.assertEqual(match_left, [1, 0, 2])
+        self.assertEqual(match_right, [1, 0, 2])
+
+    def test_hall_violator(self):
+        # Three sessions that may only use rooms 0 and 1 can't all be matched
+        adjacency = [[0, 1], [0], [1], [0, 1, 2]]
+        match_left, match_right = hopcroft_karp(adjacency, 3)
+        self.assertEqual(match_left.count(None), 1)
+        self.assertEqual(match_left[3], 2)
+        violator = hall_violator(adjacency, match_right, match_left.index(None))
+        self.assertEqual(violator, {0, 1, 2})
+        self.assertEqual(len({room for position in violator for room in adjacency[position]}), 2)
+
+    def test_rooms_left_to_matching(self):
+        # The slot search never picks rooms; the matching gives each session of a slot its own
+        problem = SyntheticInstance(8, 20, 3, 3, 4, density=0.5, tightness=0.9, seed=2).problem()
+        solver = TwoPhaseSolver(problem, rng=random.Random(0))
+        self.assertTrue(solver.solve())
+        self.assertEqual({room for _, room in solver.search.assignment}, {None})
+        places = {(room, slot) for _, room, slot in solver.assignments()}
+        self.assertEqual(len(places), len(problem.sessions))
+
+    def test_scheduler(self):
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots})
+        Course.objects.create(code='T300', name='Weekly Course', faculty=self.faculty, weekly_sessions=3)
+        scheduler = TimetableScheduler(engine='two_phase', seed=4)
+        schedules = scheduler.generate_timetable()
+        self.assertEqual(schedules.count(), 4)
+        self.assertEqual((scheduler.version.engine, scheduler.version.seed), ('two_phase', 4))
+        self.assertEqual(scheduler.solver.rounds, 1)
+        self.assertEqual(TimetableVersion.active(), scheduler.version)
+
+
+class LocalSearchTest(SimpleTestCase):
+    """Simulated annealing keeps its score by delta evaluation and stops on its own rules"""
+
+    def rescore(self, solver):
+        """(hard, soft) of the solver's current timetable, counted from scratch"""
+        problem = solver.problem
+        pairs = lambda counts: sum(count * (count - 1) // 2 for count in counts.values())
+        faculty_slot, room_slot, course_day, faculty_day = {}, {}, {}, {}
+        for index, (slot, room) in enumerate(solver.values):
+            course = problem.sessions[index][0]
+            faculty = problem.course_faculty[course]
+            day = problem.slot_days[slot]
+            for counts, key in ((faculty_slot, (faculty, slot)), (room_slot, (room, slot)),
+                                (course_day, (course, day)), (faculty_day, (faculty, day))):
+                counts[key] = counts.get(key, 0) + 1
+        spread = {key: count for key, count in course_day.items() if solver.spread_days[key[0]]}
+        shared = {key: count for key, count in course_day.items() if not solver.spread_days[key[0]]}
+        hard = pairs(faculty_slot) + pairs(room_slot) + pairs(spread)
+        soft = sum(count * count for count in faculty_day.values()) + pairs(shared) - solver.balance_bound
+        return hard, soft
+
+    def test_delta_evaluation(self):
+        problem = SyntheticInstance(8, 20, 3, 3, 4, density=0.5, tightness=0.9, seed=2).problem()
+        solver = LocalSearchSolver(problem, rng=random.Random(0))
+        solver._construct()
+        for step in range(2000):
+            solver._propose(len(problem.sessions))
+            if step % 100 == 0:
+                self.assertEqual((solver.hard, solver.soft), self.rescore(solver))
+        self.assertEqual((solver.hard, solver.soft), self.rescore(solver))
+
+    def test_solve(self):
+        problem = SyntheticInstance(8, 20, 3, 3, 4, density=0.5, tightness=0.9, seed=2).problem()
+        solver = LocalSearchSolver(problem, rng=random.Random(0), target=-1, patience=2000)
+        self.assertTrue(solver.solve())
+        # The counters are moved back to the best timetable, which is the one handed out
+        self.assertEqual((solver.hard, solver.soft), self.rescore(solver))
+        self.assertEqual(solver.score, solver.best_score)
+        self.assertEqual(solver.assignments(), [(problem.sessions[index][0], room, slot)
+                                                for index, (slot, room) in enumerate(solver.values)])
+        self.assertEqual(self.rescore(solver)[0], 0)
+
+    def test_stopping_rules(self):
+        problem = SyntheticInstance(8, 20, 3, 3, 4, density=0.5, tightness=0.9, seed=2).problem()
+        solver = LocalSearchSolver(problem, rng=random.Random(0), time_limit=0)
+        solver.solve()
+        self.assertEqual(solver.nodes, 0)
+        # A target the first timetable already meets needs no moves either
+        solver = LocalSearchSolver(problem, rng=random.Random(0), target=10 ** 9)
+        solver.solve()
+        self.assertEqual(solver.nodes, 0)
+        stop = threading.Event()
+        stop.set()
+        solver = LocalSearchSolver(problem, rng=random.Random(0), stop=stop)
+        solver.solve()
+        self.assertEqual(solver.nodes, 0)
+
+    def test_hard_violations(self):
+        # Two courses of one faculty member who is available in one slot can't both be placed
+        slots = [(slot, DAYS[slot], f"Slot {slot}") for slot in range(2)]
+        rooms = [(0, 'Room', 30, False)]
+        courses = [(course, f"C{course}", f"Course {course}", 0, 1) for course in range(2)]
+        problem = SchedulingProblem(slots, rooms, [(0, 'Faculty')], courses, [(0, 0)])
+        solver = LocalSearchSolver(problem, rng=random.Random(0), time_limit=0.1)
+        self.assertFalse(solver.solve())
+        self.assertEqual(self.rescore(solver)[0], 2)
+        self.assertEqual(solver.best_score, solver.hard_weight * 2 + solver.soft)
+        # The best timetable found is still handed out
+        self.assertEqual(solver.assignments(), [(0, 0, 0), (1, 0, 0)])
+        # A session with no slot at all fails at once
+        problem = SchedulingProblem(slots, rooms, [(0, 'Faculty')], courses, [])
+        self.assertFalse(LocalSearchSolver(problem).solve())
+
+
+class SyntheticInstanceTest(TimetableTestCase):
+    """Synthetic instances are reproducible, sized as asked and benchmarked without touching the real data"""
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('small'), (5, 12, 5, 5, 6))
+        self.assertEqual(parse_size('3x6x2x4x5'), (3, 6, 2, 4, 5))
+        for size in ('huge', '3x6x2', '3x6x2xAx5'):
+            with self.assertRaises(ValueError):
+                parse_size(size)
+
+    def test_instance(self):
+        instance = SyntheticInstance(4, 10, 3, 5, 4, density=0.3, tightness=0.4, seed=1)
+        again = SyntheticInstance(4, 10, 3, 5, 4, density=0.3, tightness=0.4, seed=1)
+        self.assertEqual((again.rooms, again.courses, again.availability),
+                         (instance.rooms, instance.courses, instance.availability))
+        self.assertNotEqual(SyntheticInstance(4, 10, 3, 5, 4, density=0.3, seed=2).availability,
+                            instance.availability)
+        self.assertEqual(len(instance.slots), 20)
+        # 0.4 of the 60 (slot, room) places, at most three sessions per course
+        self.assertEqual(instance.num_sessions, 24)
+        self.assertLessEqual(max(course[4] for course in instance.courses), 3)
+        for faculty, _ in instance.faculties:
+            load = sum(course[4] for course in instance.courses if course[3] == faculty)
+            self.assertGreaterEqual(sum(1 for owner, _ in instance.availability if owner == faculty), load)
+        self.assertEqual(len(instance.problem().sessions), 24)
+        with self.assertRaises(ValueError):
+            SyntheticInstance(days=7)
+
+    def test_save(self):
+        instance = SyntheticInstance(seed=3)
+        instance.save()
+        self.assertEqual(Course.objects.count(), 12)
+        self.assertFalse(Schedule.objects.exists())
+        problem = SchedulingProblem.from_db()
+        expected = instance.problem()
+        self.assertEqual((problem.sessions, problem.faculty_available, problem.slot_labels),
+                         (expected.sessions, expected.faculty_available, expected.slot_labels))
+
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command('benchmark_scheduler', sizes=['3x6x3x2x4'], seeds=2, engines=['backtracking', 'two_phase'],
+                     no_memory=True, format='json', stdout=out, stderr=io.StringIO())
+        runs = json.loads(out.getvalue())['runs']
+        self.assertEqual([(run['seed'], run['engine']) for run in runs],
+                         [(0, 'backtracking'), (0, 'two_phase'), (1, 'backtracking'), (1, 'two_phase')])
+        self.assertEqual({(run['status'], run['queries'], run['peak_kb']) for run in runs}, {('solved', 0, None)})
+
+        out = io.StringIO()
+        call_command('benchmark_scheduler', sizes=['small'], seeds=1, engines=['backtracking'], mode='db',
+                     stdout=out, stderr=io.StringIO())
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual((len(rows), rows[0]['status'], rows[0]['mode']), (1, 'solved', 'db'))
+        self.assertGreater(int(rows[0]['queries']), 0)
+        self.assertGreater(int(rows[0]['peak_kb']), 0)
+        # The instance was rolled back
+        self.assertEqual(list(Course.objects.all()), [self.course])
+        self.assertEqual(TimetableVersion.active(), self.version)
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark_scheduler', sizes=['huge'], stdout=io.StringIO(), stderr=io.StringIO())
+
+
+class RunStatsTest(TimetableTestCase):
+    """Scheduling runs report phase timings, query counts and, when profiled, constraint check times"""
+
+    def test_phases(self):
+        stats = RunStats()
+        with stats.phase('load'):
+            list(Course.objects.all())
+        with stats.phase('search'):
+            pass
+        with stats.phase('load'):
+            list(Room.objects.all())
+            list(TimeSlot.objects.all())
+        self.assertEqual(list(stats.phases), ['load', 'search'])
+        self.assertEqual((stats.phase_queries, stats.queries), ({'load': 3, 'search': 0}, 3))
+        self.assertGreater(stats.query_seconds, 0)
+
+    def test_profile(self):
+        problem = SyntheticInstance(seed=0).problem()
+        stats = RunStats()
+        solver = stats.profile(TwoPhaseSolver(problem, rng=random.Random(0)))
+        self.assertTrue(solver.solve())
+        stats.record(solver)
+        # The slot search the solver drives is profiled as well
+        self.assertEqual(set(stats.checks), set(TwoPhaseSolver.PROFILED) | set(BacktrackingSearch.PROFILED))
+        self.assertEqual(stats.checks['_match_rooms'][0], solver.rounds)
+        self.assertEqual((stats.nodes, stats.backtracks), (solver.nodes, solver.backtracks))
+        # Only the profiled instance is wrapped
+        self.assertNotIn('_forward_check', vars(BacktrackingSearch(problem)))
+
+    def test_scheduler(self):
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots})
+        scheduler = TimetableScheduler(seed=1, profile=True)
+        scheduler.generate_timetable()
+        report = json.loads(json.dumps(scheduler.stats.as_dict()))
+        self.assertEqual(list(report['phases']), ['load', 'search', 'persist'])
+        # Everything is loaded up front: the search itself never queries the database
+        self.assertEqual(report['phase_queries']['search'], 0)
+        self.assertGreater(report['phase_queries']['load'], 0)
+        self.assertEqual(report['nodes'], scheduler.nodes)
+        self.assertTrue(report['checks'])
+        self.assertFalse(TimetableScheduler(seed=1).stats.checks)
+
+    def test_command(self):
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots})
+        out = io.StringIO()
+        call_command('run_scheduler', '--profile', '--seed', '1', stdout=out)
+        output = out.getvalue()
+        self.assertIn("Profile\n=======", output)
+        self.assertRegex(output, r"search +[0-9.]+s +0 queries")
+        self.assertIn("nodes 1, backtracks 0", output)
+        out = io.StringIO()
+        call_command('run_scheduler', '--seed', '1', stdout=out)
+        self.assertNotIn("Profile", out.getvalue())
+
+
+class SearchOracleTest(SimpleTestCase):
+    """
+    The search engines agree with an exhaustive search on small instances:
+    nogood learning, backjumping and the pruning checks never rule out a
+    timetable that exists, and every timetable found keeps the hard rules
+    """
+
+    def exhaustive(self, problem, fixed=None):
+        """
+        Whether a timetable exists, by trying every slot for every session
+        (only the given one for sessions in fixed) and every room order in a slot
+        """
+        fixed = fixed or {}
+        sessions = problem.sessions
+        spread = [problem.course_sessions[course] <= self.days_available(problem, problem.course_faculty[course])
+                  for course in range(len(problem.course_ids))]
+        members = [[] for _ in range(problem.num_slots)]
+        days = [[] for _ in problem.course_ids]
+
+        def rooms_fit(courses):
+            return any(all(problem.course_rooms[course] >> room & 1 for course, room in zip(courses, rooms))
+                       for rooms in permutations(range(problem.num_rooms), len(courses)))
+
+        def place(position):
+            if position == len(sessions):
+                return True
+            course = sessions[position][0]
+            faculty = problem.course_faculty[course]
+            for slot in [fixed[position]] if position in fixed else range(problem.num_slots):
+                day = problem.slot_days[slot]
+                if (not problem.faculty_available[faculty] >> slot & 1
+                        or any(problem.course_faculty[other] == faculty for other in members[slot])
+                        or spread[course] and day in days[course]
+                        or not rooms_fit(members[slot] + [course])):
+                    continue
+                members[slot].append(course)
+                days[course].append(day)
+                if place(position + 1):
+                    return True
+                members[slot].pop()
+                days[course].pop()
+            return False
+        return place(0)
+
+    def days_available(self, problem, faculty):
+        return sum(1 for mask in problem.day_masks if problem.faculty_available[faculty] & mask)
+
+    def assertValid(self, problem, assignments):
+        self.assertEqual(sorted(course for course, _, _ in assignments), [course for course, _ in problem.sessions])
+        places, teaching, course_days = set(), set(), {}
+        for course, room, slot in assignments:
+            faculty = problem.course_faculty[course]
+            self.assertTrue(problem.faculty_available[faculty] >> slot & 1)
+            self.assertTrue(problem.course_rooms[course] >> room & 1)
+            self.assertNotIn((room, slot), places)
+            self.assertNotIn((faculty, slot), teaching)
+            places.add((room, slot))
+            teaching.add((faculty, slot))
+            course_days.setdefault(course, []).append(problem.slot_days[slot])
+        for course, days in course_days.items():
+            if problem.course_sessions[course] <= self.days_available(problem, problem.course_faculty[course]):
+                self.assertEqual(len(days), len(set(days)))
+
+    def check(self, problem, seed, totals):
+        expected = self.exhaustive(problem)
+        search = BacktrackingSearch(problem, rng=random.Random(seed))
+        self.assertEqual(search.solve(), expected)
+        if expected:
+            self.assertValid(problem, search.assignments())
+        two_phase = TwoPhaseSolver(problem, rng=random.Random(seed))
+        self.assertEqual(two_phase.solve(), expected)
+        if expected:
+            self.assertValid(problem, two_phase.assignments())
+        for name in totals:
+            totals[name] += getattr(search, name)
+        # Every learned nogood really is one: its session -> slot values can't all be part of a timetable
+        for nogood in search.nogood_list:
+            self.assertFalse(self.exhaustive(problem, dict(nogood)), nogood)
+
+    def test_interchangeable_rooms(self):
+        # Tight instances where slot nogoods are learned and used to jump back
+        totals = {'backjumps': 0, 'nogoods': 0, 'nogood_prunes': 0}
+        for seed in range(60):
+            with self.subTest(seed=seed):
+                problem = SyntheticInstance(4, 7, 2, 2, 3, density=0.5, tightness=0.9, seed=seed).problem()
+                self.check(problem, seed, totals)
+        self.assertTrue(all(totals.values()), totals)
+
+    def test_restricted_rooms(self):
+        rng = random.Random(0)
+        totals = {'backtracks': 0}
+        for seed in range(150):
+            with self.subTest(seed=seed):
+                self.check(random_problem(rng), seed, totals)
+        self.assertTrue(totals['backtracks'])
+
+    def test_hall_violator(self):
+        # Four courses of different faculty limited to three of the four rooms: no slot can hold all of them,
+        # though every room group count allows it, so only room matching finds out
+        def problem(num_slots):
+            rooms = [(room, f"Room {room}", 30, False) for room in range(4)]
+            faculties = [(faculty, f"Faculty {faculty}") for faculty in range(4)]
+            courses = [(course, f"C{course}", f"Course {course}", course, 1) for course in range(4)]
+            eligible = [(course, room) for course, rooms in enumerate([(0, 1), (1, 2), (0, 2), (0, 1)]) for room in rooms]
+            slots = [(slot, DAYS[slot], f"Slot {slot}") for slot in range(num_slots)]
+            availability = [(faculty, slot) for faculty in range(4) for slot in range(num_slots)]
+            return SchedulingProblem(slots, rooms, faculties, courses, availability, eligible)
+
+        one_slot = problem(1)
+        self.assertFalse(self.exhaustive(one_slot))
+        solver = TwoPhaseSolver(one_slot, rng=random.Random(0))
+        self.assertFalse(solver.solve())
+        self.assertGreater(solver.rounds, 1)
+        self.assertFalse(BacktrackingSearch(one_slot, rng=random.Random(0)).solve())
+
+        two_slots = problem(2)
+        rounds = []
+        for seed in range(10):
+            solver = TwoPhaseSolver(two_slots, rng=random.Random(seed))
+            self.assertTrue(solver.solve())
+            self.assertValid(two_slots, solver.assignments())
+            rounds.append(solver.rounds)
+        # Some seeds colour all four into one slot first and recover from the failed matching
+        self.assertGreater(max(rounds), 1)
+
+    def test_overcommitted_faculty(self):
+        # Three courses of one faculty member available in two slots: no search needed to give up
+        slots = [(slot, 'MON', f"Slot {slot}") for slot in range(4)]
+        rooms = [(room, f"Room {room}", 30, False) for room in range(3)]
+        courses = [(course, f"C{course}", f"Course {course}", 0, 1) for course in range(3)]
+        problem = SchedulingProblem(slots, rooms, [(0, 'Faculty')], courses, [(0, 0), (0, 1)])
+        self.assertFalse(self.exhaustive(problem))
+        search = BacktrackingSearch(problem, rng=random.Random(0))
+        self.assertEqual(search.start(), search.FAILED)
+        self.assertFalse(search.solve())
+        self.assertEqual(search.nodes, 0)
+        solver = TwoPhaseSolver(problem, rng=random.Random(0))
+        self.assertFalse(solver.solve())
+        self.assertEqual(solver.nodes, 0)
+
+
+class SearchCountersTest(SimpleTestCase):
+    """The counters the search keeps up to date node by node always equal a recount from scratch"""
+    COUNTERS = ('domain_sizes', 'faculty_unassigned', 'group_reach', 'group_teachers', 'group_room',
+                'group_unassigned')
+
+    def assertCounted(self, problem, seed, every):
+        search = BacktrackingSearch(problem, rng=random.Random(seed))
+        status = search.start()
+        while True:
+            kept = {name: json.dumps(getattr(search, name), sort_keys=True) for name in self.COUNTERS}
+            search._recount()
+            self.assertEqual(kept, {name: json.dumps(getattr(search, name), sort_keys=True)
+                                    for name in self.COUNTERS})
+            if status != search.PAUSED:
+                return search
+            status = search.run(max_nodes=every)
+
+    def test_backtracking(self):
+        problem = SyntheticInstance(8, 20, 3, 3, 4, density=0.5, tightness=0.9, seed=2).problem()
+        search = self.assertCounted(problem, 2, 97)
+        self.assertGreater(search.backtracks, 0)
+
+    def test_restricted_rooms(self):
+        rng = random.Random(1)
+        groups = 0
+        for seed in range(40):
+            with self.subTest(seed=seed):
+                search = self.assertCounted(random_problem(rng), seed, 1)
+                groups = max(groups, len(search.group_capacity))
+        self.assertGreater(groups, 2)
+
+
+class SearchSnapshotTest(SimpleTestCase):
+    """A search paused, sent through JSON and restored explores exactly the nodes of an uninterrupted one"""
+    COUNTERS = ('nodes', 'backtracks', 'backjumps', 'nogood_prunes', 'nogoods', 'max_depth')
+
+    def test_resume(self):
+        # Tight enough to backtrack a few thousand times and learn nogoods on the way
+        problem = SyntheticInstance(8, 20, 3, 3, 4, density=0.5, tightness=0.9, seed=2).problem()
+        whole = BacktrackingSearch(problem, rng=random.Random(2))
+        self.assertTrue(whole.solve())
+        self.assertGreater(whole.backjumps, 0)
+
+        search = BacktrackingSearch(problem, rng=random.Random(2))
+        search.start()
+        pauses = 0
+        while search.run(max_nodes=700) == search.PAUSED:
+            pauses += 1
+            search = BacktrackingSearch.restore(problem, json.loads(json.dumps(search.snapshot())))
+        self.assertGreater(pauses, 1)
+        self.assertEqual(search.status, search.SOLVED)
+        self.assertEqual(search.assignment, whole.assignment)
+        self.assertEqual({name: getattr(search, name) for name in self.COUNTERS},
+                         {name: getattr(whole, name) for name in self.COUNTERS})
+
+
+class PortfolioTest(TimetableTestCase):
+    """The first worker with a complete timetable wins the race, calls off the others and is what gets stored"""
+    # A local search that never reaches its target and only stops when told to or out of time
+    SLOW = {'time_limit': 60, 'target': -1, 'patience': 10 ** 9}
+
+    def test_first_result_wins(self):
+        problem = SyntheticInstance(seed=0).problem()
+        solver = PortfolioSolver(problem, 2, engine='local_search', options=self.SLOW, seed=7)
+        self.assertEqual(solver.configurations[1], ('backtracking', {}))
+        self.assertTrue(solver.solve())
+        self.assertEqual((solver.best['engine'], solver.best['seed'], solver.best['status']),
+                         ('backtracking', 8, 'solved'))
+        self.assertIs(solver.results[0], solver.best)
+        self.assertEqual(solver.assignments(), solver.best['assignments'])
+        # The losing local search stopped long before its own budget
+        loser = solver.results[1]
+        self.assertEqual(loser['engine'], 'local_search')
+        self.assertLess(loser['seconds'], 30)
+
+    def test_time_limit(self):
+        problem = SyntheticInstance(seed=0).problem()
+        solver = PortfolioSolver(problem, 2, engine='local_search', options=self.SLOW, seed=7, time_limit=0.5)
+        solver.configurations[1] = ('local_search', self.SLOW)
+        start = time_lib.monotonic()
+        solver.solve()
+        self.assertLess(time_lib.monotonic() - start, 30)
+        self.assertEqual(len(solver.results), 2)
+        self.assertIsNotNone(solver.best)
+
+    def test_stop_in_options(self):
+        # The caller's stop event calls the race off instead of being handed to the workers
+        problem = SyntheticInstance(seed=0).problem()
+        stop = threading.Event()
+        threading.Timer(0.5, stop.set).start()
+        solver = PortfolioSolver(problem, 2, engine='local_search', options=dict(self.SLOW, stop=stop), seed=7)
+        solver.configurations[1] = ('local_search', self.SLOW)
+        start = time_lib.monotonic()
+        solver.solve()
+        self.assertLess(time_lib.monotonic() - start, 30)
+        self.assertEqual(len(solver.results), 2)
+
+    def test_command_time_limit(self):
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots})
+        with mock.patch('timetable.scheduler.PortfolioSolver', wraps=PortfolioSolver) as portfolio:
+            call_command('run_scheduler', '--workers', '2', '--time-limit', '0.5', stdout=io.StringIO())
+        self.assertEqual(portfolio.call_args.kwargs['time_limit'], 0.5)
+
+    def test_winner_published(self):
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots})
+        scheduler = TimetableScheduler(engine='local_search', workers=2, seed=3, **self.SLOW)
+        scheduler.generate_timetable()
+        self.assertEqual((scheduler.winner['engine'], scheduler.winner['seed']), ('backtracking', 4))
+        version = TimetableVersion.active()
+        self.assertEqual((version.engine, version.seed), ('backtracking', 4))
+        # The stored engine and seed repeat the winning run
+        again = TimetableScheduler(engine=version.engine, seed=version.seed)
+        again.generate_timetable(activate=False)
+        self.assertEqual(again.schedule, scheduler.schedule)
+
+
+class AnimatedTimetableTest(TimetableTestCase):
+    """The visualizer pages stream or replay a run without touching the published timetable"""
+
+    def setUp(self):
+        super().setUp()
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots})
+        Course.objects.create(code='T300', name='Weekly Course', faculty=self.faculty, weekly_sessions=3)
+        self.schedule(1)
+
+    def steps(self, seed):
+        """Every step of a run, for comparison"""
+        return list(AnimatedTimetableScheduler(seed=seed).iter_steps(persist=False))
+
+    def events(self, response):
+        """(event, data) pairs of a Server-Sent Events response"""
+        body = b''.join(response.streaming_content).decode()
+        events = []
+        for block in body.strip().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in block.split('\n'))
+            events.append((fields['event'], json.loads(fields['data'])))
+        return events
+
+    def test_stream_keeps_a_candidate(self):
+        events = self.events(self.client.get(reverse('timetable-stream'), {'seed': 5}))
+        done = events[-1][1]
+        self.assertTrue(done['success'])
+        self.assertEqual(TimetableVersion.active(), self.version)
+        candidate = TimetableVersion.objects.get(pk=done['version'])
+        self.assertFalse(candidate.is_active)
+        self.assertEqual((candidate.engine, candidate.seed, candidate.schedules.count()), ('backtracking', 5, 4))
+
+    def test_stream_events(self):
+        events = self.events(self.client.get(reverse('timetable-stream'), {'seed': 5}))
+        self.assertEqual(events[0], ('start', {'seed': 5, 'sessions': 4}))
+        self.assertEqual({event for event, _ in events[1:-1]}, {'step'})
+        steps = [data for _, data in events[1:-1]]
+        self.assertEqual(steps, self.steps(5))
+        self.assertEqual((steps[0]['type'], steps[-1]['type']), ('init', 'complete'))
+        event, done = events[-1]
+        self.assertEqual(event, 'done')
+        self.assertEqual((done['seed'], done['success'], done['total_steps']), (5, True, len(steps)))
+        self.assertEqual(done['assignments_tried'], 4)
+
+    def test_step_replay(self):
+        expected = self.steps(5)
+        url = reverse('timetable-step')
+        with tempfile.TemporaryDirectory() as path, override_settings(TIMETABLE_TRACE_DIR=path):
+            first = self.client.get(url, {'seed': 5}).json()
+            # The session keeps the trace file's path, the seed and the statistics, never the steps
+            run = self.client.session['algorithm_run']
+            self.assertEqual(set(run), {'trace', 'seed', 'version', 'assignments_tried', 'backtracks',
+                                        'total_steps', 'profile'})
+            self.assertEqual((run['seed'], run['total_steps']), (5, len(expected)))
+            self.assertEqual(first['step'], expected[0])
+            for number in (len(expected) - 1, 3, 1):
+                response = self.client.get(url, {'step': number}).json()
+                self.assertEqual(response['step'], expected[number])
+                self.assertEqual(response['next_step'], number + 1)
+            self.assertFalse(response['completed'])
+            self.assertEqual(first['stats']['seed'], 5)
+            self.assertTrue(self.client.get(url, {'step': len(expected) - 1}).json()['completed'])
+        # Later requests replayed the trace instead of running again
+        self.assertEqual(TimetableVersion.objects.filter(is_active=False).count(), 1)
+
+    def test_step_keeps_a_candidate(self):
+        with tempfile.TemporaryDirectory() as path, override_settings(TIMETABLE_TRACE_DIR=path):
+            stats = self.client.get(reverse('timetable-step'), {'seed': 5}).json()['stats']
+        self.assertEqual(TimetableVersion.active(), self.version)
+        self.assertFalse(TimetableVersion.objects.get(pk=stats['version']).is_active)
+
+
+class ReproducibleSeedTest(TimetableTestCase):
+    """The same seed repeats a run exactly: the same timetable after the same search"""
+
+    def run_engine(self, engine, problem, seed, **options):
+        solver = TimetableScheduler.ENGINES[engine](problem, rng=random.Random(seed), **options)
+        self.assertTrue(solver.solve())
+        return solver.assignments(), solver.nodes, solver.backtracks
+
+    def test_engines(self):
+        problem = SyntheticInstance(8, 20, 3, 3, 4, density=0.5, tightness=0.9, seed=2).problem()
+        # Local search must stop on patience, not on the clock, to be repeatable
+        options = {'local_search': {'time_limit': 60, 'target': -1, 'patience': 2000}}
+        for engine in ('backtracking', 'two_phase', 'local_search'):
+            with self.subTest(engine=engine):
+                first = self.run_engine(engine, problem, 9, **options.get(engine, {}))
+                self.assertEqual(self.run_engine(engine, problem, 9, **options.get(engine, {})), first)
+        # The instance makes the backtracking search work for it
+        self.assertGreater(self.run_engine('backtracking', problem, 9)[2], 0)
+
+    def test_scheduler(self):
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots[::3]})
+        Course.objects.create(code='T300', name='Weekly Course', faculty=self.faculty, weekly_sessions=3)
+        runs = []
+        for _ in range(2):
+            scheduler = TimetableScheduler(seed=11)
+            scheduler.generate_timetable(activate=False)
+            runs.append((scheduler.schedule, scheduler.nodes, scheduler.backtracks))
+        self.assertEqual(runs[0], runs[1])
+        self.assertEqual(len(runs[0][0]), 4)
+
+    def test_animated(self):
+        set_availability({(self.faculty.pk, slot.pk): True for slot in self.slots})
+        Course.objects.create(code='T300', name='Weekly Course', faculty=self.faculty, weekly_sessions=3)
+        runs = []
+        for _ in range(2):
+            scheduler = AnimatedTimetableScheduler(seed=11)
+            steps = list(scheduler.iter_steps(persist=False))
+            runs.append((steps, scheduler.schedule, scheduler.assignments_tried, scheduler.backtracks))
+        self.assertEqual(runs[0], runs[1])
+        self.assertEqual(len(runs[0][1]), 4)
+
+
+class TimetableVersionTest(TimetableTestCase):
+    """Versions are compared class by class, only one is ever active and old candidates are pruned"""
+
+    def test_diff(self):
+        courses = [self.course] + list(Course.objects.bulk_create(
+            Course(code=f"T{number}", name=f"Course {number}", faculty=self.faculty) for number in range(1, 5)
+        ))
+        other = TimetableVersion.objects.create()
+        rooms, slots = self.rooms, self.slots
+        Schedule.objects.bulk_create([
+            Schedule(version=self.version, course=courses[0], room=rooms[0], time_slot=slots[0]),
+            Schedule(version=self.version, course=courses[1], room=rooms[0], time_slot=slots[1]),
+            Schedule(version=self.version, course=courses[2], room=rooms[0], time_slot=slots[2]),
+            Schedule(version=self.version, course=courses[3], room=rooms[0], time_slot=slots[3]),
+            # Same slot, another room
+            Schedule(version=other, course=courses[0], room=rooms[1], time_slot=slots[0]),
+            # Another slot
+            Schedule(version=other, course=courses[1], room=rooms[0], time_slot=slots[5]),
+            # Unchanged
+            Schedule(version=other, course=courses[2], room=rooms[0], time_slot=slots[2]),
+            # courses[3] is dropped and courses[4] is new
+            Schedule(version=other, course=courses[4], room=rooms[2], time_slot=slots[4]),
+        ])
+        diff = self.version.diff(other)
+        self.assertEqual((diff['from_version'], diff['to_version']), (self.version.pk, other.pk))
+        self.assertEqual(diff['room_changes'], [{'course': courses[0].pk, 'time_slot': slots[0].pk,
+                                                 'from_room': rooms[0].pk, 'to_room': rooms[1].pk}])
+        self.assertEqual(diff['moved'], [{'course': courses[1].pk, 'from_room': rooms[0].pk,
+                                          'from_time_slot': slots[1].pk, 'to_room': rooms[0].pk,
+                                          'to_time_slot': slots[5].pk}])
+        self.assertEqual(diff['added'], [{'course': courses[4].pk, 'room': rooms[2].pk, 'time_slot': slots[4].pk}])
+        self.assertEqual(diff['removed'], [{'course': courses[3].pk, 'room': rooms[0].pk, 'time_slot': slots[3].pk}])
+
+        self.assertEqual(other.diff(other), {'from_version': other.pk, 'to_version': other.pk, 'moved': [],
+                                             'room_changes': [], 'added': [], 'removed': []})
+
+    def test_single_active(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TimetableVersion.objects.create(is_active=True)
+        other = TimetableVersion.objects.create()
+        other.activate()
+        self.assertEqual(list(TimetableVersion.objects.filter(is_active=True)), [other])
+        self.version.activate()
+        self.assertEqual(TimetableVersion.active(), self.version)
+        self.assertEqual(TimetableVersion.objects.filter(is_active=True).count(), 1)
+
+    @override_settings(TIMETABLE_VERSIONS_KEPT=2)
+    def test_pruning(self):
+        def publish(**kwargs):
+            return publish_schedule([Schedule(course=self.course, room=self.rooms[0], time_slot=self.slots[0])],
+                                    **kwargs)
+
+        published = [publish() for _ in range(4)]
+        # The active version and the two newest inactive ones are kept, with their classes
+        self.assertEqual(TimetableVersion.active(), published[3])
+        self.assertEqual(list(TimetableVersion.objects.values_list('pk', flat=True)),
+                         [version.pk for version in reversed(published[1:])])
+        self.assertEqual(Schedule.objects.count(), 3)
+
+        # A candidate is kept inactive and pushes out the oldest inactive version
+        candidate = publish(activate=False)
+        self.assertEqual(TimetableVersion.active(), published[3])
+        self.assertEqual(set(TimetableVersion.objects.values_list('pk', flat=True)),
+                         {published[3].pk, candidate.pk, published[2].pk})
+
+
+class MergeDuplicateTimeSlotsMigrationTest(TransactionTestCase):
+    """Migration 0005 folds duplicate time slots into the oldest one before making them unique"""
+    before = [('timetable', '0004_timetableversion_updated_at')]
+    after = [('timetable', '0005_indexes_and_unique_time_slot')]
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('timetable'))
+
+    def test_merge(self):
+        apps = self.migrate(self.before)
+        TimeSlot = apps.get_model('timetable', 'TimeSlot')
+        Faculty = apps.get_model('timetable', 'Faculty')
+        Course = apps.get_model('timetable', 'Course')
+        Room = apps.get_model('timetable', 'Room')
+        FacultyAvailability = apps.get_model('timetable', 'FacultyAvailability')
+        TimetableVersion = apps.get_model('timetable', 'TimetableVersion')
+        Schedule = apps.get_model('timetable', 'Schedule')
+
+        kept = TimeSlot.objects.create(day='MON', start_time=time(9), end_time=time(9, 50))
+        duplicate = TimeSlot.objects.create(day='MON', start_time=time(9), end_time=time(9, 50))
+        other = TimeSlot.objects.create(day='TUE', start_time=time(9), end_time=time(9, 50))
+        first, second = (Faculty.objects.create(name=name, department='Test', email=f"{name}@example.com")
+                         for name in ('first', 'second'))
+        algebra = Course.objects.create(code='A1', name='Algebra', faculty=first)
+        biology = Course.objects.create(code='B1', name='Biology', faculty=second)
+        hall, lab = Room.objects.create(name='Hall', capacity=50), Room.objects.create(name='Lab', capacity=20)
+        FacultyAvailability.objects.create(faculty=first, time_slot=kept, is_available=True)
+        # Already set for the kept slot: dropped
+        FacultyAvailability.objects.create(faculty=first, time_slot=duplicate, is_available=False)
+        # Moved over
+        FacultyAvailability.objects.create(faculty=second, time_slot=duplicate, is_available=True)
+        FacultyAvailability.objects.create(faculty=second, time_slot=other, is_available=False)
+        current = TimetableVersion.objects.create(is_active=True)
+        older = TimetableVersion.objects.create()
+        Schedule.objects.create(version=current, course=algebra, room=hall, time_slot=kept)
+        # The hall is taken in the kept slot of this version: dropped
+        Schedule.objects.create(version=current, course=biology, room=hall, time_slot=duplicate)
+        Schedule.objects.create(version=current, course=biology, room=lab, time_slot=duplicate)
+        Schedule.objects.create(version=older, course=algebra, room=hall, time_slot=duplicate)
+
+        apps = self.migrate(self.after)
+        TimeSlot = apps.get_model('timetable', 'TimeSlot')
+        FacultyAvailability = apps.get_model('timetable', 'FacultyAvailability')
+        Schedule = apps.get_model('timetable', 'Schedule')
+        self.assertEqual(sorted(TimeSlot.objects.values_list('pk', flat=True)), [kept.pk, other.pk])
+        self.assertEqual(
+            set(FacultyAvailability.objects.values_list('faculty_id', 'time_slot_id', 'is_available')),
+            {(first.pk, kept.pk, True), (second.pk, kept.pk, True), (second.pk, other.pk, False)},
+        )
+        self.assertEqual(
+            set(Schedule.objects.values_list('version_id', 'course_id', 'room_id', 'time_slot_id')),
+            {(current.pk, algebra.pk, hall.pk, kept.pk), (current.pk, biology.pk, lab.pk, kept.pk),
+             (older.pk, algebra.pk, hall.pk, kept.pk)},
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TimeSlot.objects.create(day='MON', start_time=time(9), end_time=time(9, 50))
+
+
+class TraceCleanupTest(SimpleTestCase):
+    def test_old_traces_removed(self):
+        with tempfile.TemporaryDirectory() as path, override_settings(TIMETABLE_TRACE_DIR=path,
+                                                                      TIMETABLE_TRACE_MAX_AGE=3600):
+            old, recent, other = (os.path.join(path, name) for name in ('old.trace', 'recent.trace', 'notes.txt'))
+            for name in (old, recent, other):
+                open(name, 'wb').close()
+            stale = time_lib.time() - 7200
+            os.utime(old, (stale, stale))
+            os.utime(other, (stale, stale))
+            new = new_trace_path()
+            self.assertEqual(os.path.dirname(new), path)
+            self.assertEqual(sorted(os.listdir(path)), ['notes.txt', 'recent.trace'])
+
+
+class ImporterTest(TimetableTestCase):
+    """Rows are streamed in batches, with foreign keys resolved in memory and bad rows reported"""
+
+    def test_courses(self):
+        lines = ['{"code": "T100", "name": "Already there", "faculty": "faculty@example.com"}']
+        lines += [f'{{"code": "C{number}", "name": "Course {number}", "faculty": "{self.faculty.pk}"}}' for number in range(25)]
+        lines += ['{"code": "C99", "name": "Nobody", "faculty": "nobody@example.com"}', '{"code": "C98"}', 'not json']
+        batches = []
+        importer = Importer('courses', batch_size=10, progress=lambda importer: batches.append(importer.created))
+        # Existing course codes, faculty lookup, then one insert per batch
+        with self.assertNumQueries(2 + 3 * 3):
+            importer.run(read_rows(io.StringIO('\n'.join(lines)), 'json'))
+        self.assertEqual(batches, [10, 20, 25])
+        self.assertEqual((importer.created, importer.skipped, importer.error_count), (25, 1, 3))
+        self.assertEqual([line for line, _ in importer.errors], [27, 28, 29])
+        self.assertEqual(Course.objects.filter(faculty=self.faculty).count(), 26)
+
+    def test_rooms_csv(self):
+        stream = io.StringIO('name,capacity,has_projector\nRoom 0,10,no\nLab,25,yes\nHall,many,no\n')
+        importer = Importer('rooms').run(read_rows(stream))
+        self.assertEqual((importer.created, importer.skipped, importer.error_count), (1, 1, 1))
+        self.assertTrue(Room.objects.get(name='Lab').has_projector)
+
+
+class ExportTest(TimetableTestCase):
+    """Exports are streamed from one query, whole or for one slice of the timetable"""
+
+    def setUp(self):
+        super().setUp()
+        self.schedule(12)
+
+    def test_csv(self):
+        # Active version, classes
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('export-timetable', args=['csv']))
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 13)
+        self.assertEqual(lines[1], 'MON,08:00,08:50,T100,Test Course,Faculty,faculty@example.com,Room 0')
+
+        response = self.client.get(reverse('export-timetable', args=['json']), {'type': 'room', 'id': self.rooms[1].pk})
+        self.assertEqual(response['Content-Disposition'],
+                         f'attachment; filename="timetable-{self.version.pk}-room-{self.rooms[1].pk}.json"')
+        classes = json.loads(b''.join(response.streaming_content))['classes']
+        self.assertEqual([row['start_time'] for row in classes], ['08:00', '09:00', '10:00'])
+
+    def test_ics(self):
+        response = self.client.get(reverse('export-timetable', args=['ics']))
+        calendar = b''.join(response.streaming_content).decode()
+        self.assertEqual(calendar.count('BEGIN:VEVENT'), 12)
+        self.assertIn('RRULE:FREQ=WEEKLY\r\n', calendar)
+        folded = ics_lines(['DESCRIPTION:' + 'é' * 60]).split('\r\n')
+        self.assertTrue(all(len(line.encode()) <= 75 for line in folded))
+        self.assertEqual(''.join(line[1:] if number else line for number, line in enumerate(folded)),
+                         'DESCRIPTION:' + 'é' * 60)
+
+
+class ScheduleApiTest(TimetableTestCase):
+    """The schedules API pages with a cursor and answers 304 while the timetable is unchanged"""
+
+    def setUp(self):
+        super().setUp()
+        self.schedule(12)
+
+    def test_pages(self):
+        url = reverse('api-schedules')
+        ids = []
+        response = self.client.get(url, {'limit': 5})
+        while True:
+            data = response.json()
+            self.assertEqual(data['version'], self.version.pk)
+            ids += [row[0] for row in data['results']]
+            if not data['next']:
+                break
+            response = self.client.get(data['next'])
+        self.assertEqual(ids, sorted(Schedule.objects.values_list('id', flat=True)))
+
+        # Classes 0-4 are on Monday at 08:00, 5-9 at 09:00 and 10-11 at 10:00, five rooms apart
+        data = self.client.get(url, {'day': 'mon', 'start': '09:00', 'end': '09:50', 'room': f"{self.rooms[0].pk},{self.rooms[1].pk}"}).json()
+        self.assertEqual([(row[1], row[2], row[10]) for row in data['results']],
+                         [('MON', '09:00', 'Room 0'), ('MON', '09:00', 'Room 1')])
+        self.assertEqual(self.client.get(url, {'day': 'SUN'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': 'nonsense'}).status_code, 400)
+
+    def test_not_modified(self):
+        url = reverse('api-schedules')
+        etag = self.client.get(url, {'faculty': self.faculty.pk})['ETag']
+        # Only the version is read
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'faculty': self.faculty.pk}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.course.name = 'Renamed Course'
+        self.course.save()
+        response = self.client.get(url, {'faculty': self.faculty.pk}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0][6], 'Renamed Course')
+
+        hour_ago = timezone.now() - timedelta(hours=1)
+        older = TimetableVersion.objects.create()
+        TimetableVersion.objects.filter(pk=older.pk).update(updated_at=hour_ago - timedelta(hours=1))
+        TimetableVersion.objects.filter(pk=self.version.pk).update(updated_at=hour_ago)
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        # Switching back to an older version is a change for clients that only send If-Modified-Since
+        older.activate()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], older.pk)
@@ -0,0 +1,202 @@
+import mmap
+import os
+import struct
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+
+# Step types and fields of the animated visualizer, in record order
+STEP_TYPES = ('init', 'info', 'course', 'attempt', 'conflict', 'backtrack', 'success', 'failure', 'complete')
+STRING_FIELDS = ('message', 'course_code', 'course_name', 'faculty_name', 'room_name', 'time_slot', 'reason', 'result')
+INT_FIELDS = ('depth', 'session', 'total_sessions', 'available_slots', 'room_id', 'time_slot_id')
+
+MAGIC = b'TTRC'
+VERSION = 1
+# magic, version, record size, number of records, string table offset, number of strings
+HEADER = struct.Struct('<4sHHQQQ')
+# step type, then a string table index per string field and a value per integer field
+RECORD = struct.Struct(f'<B3x{len(STRING_FIELDS)}I{len(INT_FIELDS)}i')
+NO_STRING = 0xFFFFFFFF
+NO_INT = -2 ** 31
+OFFSET = struct.Struct('<Q')
+
+# Seconds a trace file is kept (TIMETABLE_TRACE_MAX_AGE); a session that comes back later runs again
+MAX_AGE = 24 * 60 * 60
+
+_TYPE_CODES = {name: code for code, name in enumerate(STEP_TYPES)}
+_FIELDS = set(STRING_FIELDS) | set(INT_FIELDS) | {'type'}
+
+
+def trace_dir():
+    """Directory of the trace files of the visualizer (TIMETABLE_TRACE_DIR)"""
+    path = getattr(settings, 'TIMETABLE_TRACE_DIR', None) or os.path.join(tempfile.gettempdir(), 'timetable-traces')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def new_trace_path():
+    """Path for a new trace file; traces older than TIMETABLE_TRACE_MAX_AGE are removed first"""
+    path = trace_dir()
+    remove_old_traces(path, getattr(settings, 'TIMETABLE_TRACE_MAX_AGE', MAX_AGE))
+    return os.path.join(path, f"{uuid.uuid4().hex}.trace")
+
+
+def remove_old_traces(path, max_age):
+    """Remove the trace files of sessions that never came back"""
+    cutoff = time.time() - max_age
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.trace'):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                # Removed by another request, or still open elsewhere
+                pass
+
+
+class TraceWriter:
+    """
+    Writes visualizer steps to a seekable binary stream as a step trace.
+
+    Every step becomes one fixed-width record; the strings it carries are
+    interned, so only one copy of each distinct string is kept, in a table
+    written after the records by close().
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+        self.strings = {}
+        self.start = stream.tell()
+        stream.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0, 0, 0))
+
+    def append(self, step):
+        unknown = step.keys() - _FIELDS
+        if unknown:
+            raise ValueError(f"Step fields {sorted(unknown)} can't be stored in a trace")
+        values = [_TYPE_CODES[step['type']]]
+        for name in STRING_FIELDS:
+            value = step.get(name)
+            values.append(NO_STRING if value is None else self._intern(value))
+        for name in INT_FIELDS:
+            value = step.get(name)
+            values.append(NO_INT if value is None else value)
+        self.stream.write(RECORD.pack(*values))
+        self.count += 1
+
+    def _intern(self, value):
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def close(self):
+        """Write the string table and the final header"""
+        stream = self.stream
+        table = stream.tell() - self.start
+        encoded = [value.encode() for value in self.strings]
+        offset = 0
+        for data in encoded:
+            stream.write(OFFSET.pack(offset))
+            offset += len(data)
+        stream.write(OFFSET.pack(offset))
+        for data in encoded:
+            stream.write(data)
+        end = stream.tell()
+        stream.seek(self.start)
+        stream.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.count, table, len(encoded)))
+        stream.seek(end)
+
+
+class StepTrace:
+    """
+    Random access to a step trace: trace[n] decodes step n in constant time
+    from a bytes-like buffer, such as a memory-mapped trace file (open()).
+    """
+    def __init__(self, buffer):
+        magic, version, record_size, count, table, strings = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError("Not a step trace of this version")
+        self.buffer = buffer
+        self.count = count
+        self.table = table
+        self.blob = table + (strings + 1) * OFFSET.size
+        self._file = None
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a trace file; close() (or a with block) releases it"""
+        with open(path, 'rb') as stream:
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        trace = cls(buffer)
+        trace._file = buffer
+        return trace
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, number):
+        if number < 0:
+            number += self.count
+        if not 0 <= number < self.count:
+            raise IndexError("step out of range")
+        values = RECORD.unpack_from(self.buffer, HEADER.size + number * RECORD.size)
+        step = {'type': STEP_TYPES[values[0]]}
+        for name, index in zip(STRING_FIELDS, values[1:]):
+            if index != NO_STRING:
+                step[name] = self._string(index)
+        for name, value in zip(INT_FIELDS, values[1 + len(STRING_FIELDS):]):
+            if value != NO_INT:
+                step[name] = value
+        return step
+
+    def _string(self, index):
+        start, = OFFSET.unpack_from(self.buffer, self.table + index * OFFSET.size)
+        end, = OFFSET.unpack_from(self.buffer, self.table + (index + 1) * OFFSET.size)
+        return bytes(self.buffer[self.blob + start:self.blob + end]).decode()
+
+    def __iter__(self):
+        for number in range(self.count):
+            yield self[number]
+
+    def sample(self, max_steps):
+        """A view of at most max_steps evenly spaced steps, always ending with the last one"""
+        return SampledTrace(self, max(-(-self.count // max(max_steps, 1)), 1))
+
+
+class SampledTrace:
+    """Every stride-th step of a trace, ending with its final step; indexing stays constant time"""
+    def __init__(self, trace, stride):
+        self.trace = trace
+        self.stride = stride
+        self.count = -(-len(trace) // stride)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, number):
+        if number < 0:
+            number += self.count
+        if not 0 <= number < self.count:
+            raise IndexError("step out of range")
+        if number == self.count - 1:
+            return self.trace[-1]
+        return self.trace[number * self.stride]
+
+    def __iter__(self):
+        for number in range(self.count):
+            yield self[number]
@@ -0,0 +1,104 @@
+from .matching import hopcroft_karp, hall_violator
+from .problem import iter_bits
+from .search import BacktrackingSearch
+
+
+class TwoPhaseSolver:
+    """
+    Decides time slots first and rooms second.
+
+    Rooms only interact within a time slot, so they do not need to be part
+    of the backtracking tree. Phase 1 colours every session with a time slot
+    using BacktrackingSearch in slot-only mode (faculty, course-day and the
+    number of rooms per slot). Phase 2 assigns rooms slot by slot with a
+    Hopcroft-Karp maximum matching between the sessions of the slot and the
+    rooms they may use.
+
+    When a slot cannot be matched, the group of its sessions that compete
+    for too few rooms (a Hall violator) is forbidden from sharing the slot
+    again and only the sessions of the failing slots are re-coloured; the
+    rest keep their slots unless that leaves no way out.
+    """
+    # Constraint checks timed by RunStats.profile (the slot search is profiled as well)
+    PROFILED = ('_match_rooms',)
+
+    def __init__(self, problem, rng=None, max_rounds=100, stop=None):
+        self.problem = problem
+        self.search = BacktrackingSearch(problem, rng=rng, assign_rooms=False, stop=stop)
+        self.max_rounds = max_rounds
+        self.schedule = []
+        self.rounds = 0
+        self.nodes = 0
+        self.backtracks = 0
+        self.max_depth = 0
+
+    def solve(self):
+        """Search for a complete assignment; returns True when one is found"""
+        search = self.search
+        fixed = None
+        self.schedule = []
+        self.rounds = 0
+        self.nodes = 0
+        self.backtracks = 0
+        self.max_depth = 0
+
+        while self.rounds < self.max_rounds:
+            self.rounds += 1
+            solved = search.solve(fixed)
+            self.nodes += search.nodes
+            self.backtracks += search.backtracks
+            self.max_depth = max(self.max_depth, search.max_depth)
+
+            if not solved:
+                if fixed is None or search.status == search.PAUSED:
+                    # Infeasible even before rooms are considered, or stopped from outside
+                    return False
+                # The slots we kept leave no way out: re-colour everything
+                fixed = None
+                continue
+
+            failed = self._match_rooms()
+            if not failed:
+                return True
+
+            # Re-colour only the sessions of the slots where matching failed
+            fixed = {
+                index: (slot, None)
+                for index, (slot, _) in enumerate(search.assignment)
+                if slot not in failed
+            }
+
+        return False
+
+    def assignments(self):
+        """(course, room, slot) triples of the solution"""
+        return list(self.schedule)
+
+    def _match_rooms(self):
+        """Match rooms slot by slot; returns the slots that could not be matched"""
+        problem = self.problem
+        by_slot = {}
+        for index, (slot, _) in enumerate(self.search.assignment):
+            by_slot.setdefault(slot, []).append(index)
+
+        schedule = []
+        failed = set()
+        for slot, members in by_slot.items():
+            adjacency = [list(iter_bits(problem.course_rooms[problem.sessions[index][0]])) for index in members]
+            match_left, match_right = hopcroft_karp(adjacency, problem.num_rooms)
+
+            violators = set()
+            for position, room in enumerate(match_left):
+                if room is None:
+                    violators.add(frozenset(hall_violator(adjacency, match_right, position)))
+                else:
+                    schedule.append((problem.sessions[members[position]][0], room, slot))
+
+            if violators:
+                failed.add(slot)
+                for violator in violators:
+                    self.search.add_nogood((members[position], slot) for position in violator)
+
+        if not failed:
+            self.schedule = schedule
+        return failed
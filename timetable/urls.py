@@ -8,6 +8,7 @@ urlpatterns = [
     path('faculty/', views.FacultyListView.as_view(), name='faculty-list'),
     path('faculty/add/', views.FacultyCreateView.as_view(), name='faculty-add'),
     path('faculty/<int:faculty_id>/availability/', views.faculty_availability, name='faculty-availability'),
+    path('faculty/availability/', views.bulk_availability, name='bulk-availability'),
     
     # Course URLs
     path('course/', views.CourseListView.as_view(), name='course-list'),
@@ -26,9 +27,20 @@ urlpatterns = [
     path('generate/', views.generate_timetable, name='generate-timetable'),
     path('generate/verbose/', views.verbose_generate_timetable, name='generate-timetable-verbose'),
     path('timetable/', views.view_timetable, name='view-timetable'),
+    path('versions/', views.timetable_versions, name='timetable-versions'),
+    path('versions/<int:version_id>/activate/', views.activate_version, name='activate-version'),
+    path('versions/<int:version_id>/diff/<int:other_id>/', views.version_diff, name='version-diff'),
+    path('timetable/export.<str:export_format>', views.export_timetable, name='export-timetable'),
+    path('cache/stats/', views.timetable_cache_stats, name='timetable-cache-stats'),
+    path('api/schedules/', views.api_schedules, name='api-schedules'),
+    path('jobs/<int:job_id>/', views.job_detail, name='job-detail'),
+    path('jobs/<int:job_id>/status/', views.job_status, name='job-status'),
+    path('jobs/<int:job_id>/cancel/', views.job_cancel, name='job-cancel'),
 
     # Add these URL patterns
     path('sample-data/', views.create_sample_data, name='create-sample-data'),
+    path('import/', views.import_data, name='import-data'),
     path('generate/animated/', views.animated_generate_timetable, name='generate-timetable-animated'),
     path('generate/step/', views.timetable_step, name='timetable-step'),
+    path('generate/stream/', views.timetable_stream, name='timetable-stream'),
 ]
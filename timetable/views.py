@@ -1,18 +1,39 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib import messages
 from django.db import IntegrityError
-from django.http import JsonResponse
+from django.db.models import Count
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET
+from asgiref.sync import sync_to_async
 from datetime import time
+from itertools import islice
 import io
-from contextlib import redirect_stdout
+import json
+import os
 from django.core.management import call_command
 
-from .models import Faculty, Course, Room, TimeSlot, FacultyAvailability, Schedule
+from .models import Faculty, Course, Room, TimeSlot, Schedule, GenerationJob, TimetableVersion
 from .scheduler import TimetableScheduler
-from .forms import FacultyForm, CourseForm, RoomForm, TimeSlotForm, FacultyAvailabilityForm
+from .forms import FacultyForm, CourseForm, RoomForm, TimeSlotForm, FacultyAvailabilityForm, BulkAvailabilityForm, ImportForm
+from .availability import availability_of, read_availability_csv, set_availability
+from .importer import Importer, format_for, read_rows
+from .export import FORMATS as EXPORT_FORMATS, export, export_rows
+from .api import FIELDS as API_FIELDS, decode_cursor, encode_cursor, parse_limit, schedule_filters, schedule_page, version_etag
 from .algorithm_visualizer import AnimatedTimetableScheduler
+from .jobs import submit_job, submit_repair_job, cancel_job
+from .trace import StepTrace, new_trace_path
+from .cache import cached, stats as cache_stats
+
+def parse_int(value):
+    """Integer (a seed or an id) from a form or query value; None when blank or invalid"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
 # Create your views here.
 def home(request):
@@ -67,50 +88,167 @@ def faculty_availability(request, faculty_id):
     time_slots = TimeSlot.objects.all()
     
     if request.method == 'POST':
-        for time_slot in time_slots:
-            is_available = request.POST.get(f'timeslot_{time_slot.id}', False) == 'on'
-            FacultyAvailability.objects.update_or_create(
-                faculty=faculty,
-                time_slot=time_slot,
-                defaults={'is_available': is_available}
-            )
+        wanted = {
+            (faculty.id, time_slot.id): request.POST.get(f'timeslot_{time_slot.id}', False) == 'on'
+            for time_slot in time_slots
+        }
+        result = set_availability(wanted)
         messages.success(request, f"Availability for {faculty.name} updated successfully.")
+        repaired = repair_after_availability(result['faculty'])
+        if repaired:
+            messages.add_message(request, *repaired)
         return redirect('faculty-list')
     
-    # Get existing availabilities or create defaults
-    availabilities = {}
-    for time_slot in time_slots:
-        availability, created = FacultyAvailability.objects.get_or_create(
-            faculty=faculty,
-            time_slot=time_slot,
-            defaults={'is_available': True}
-        )
-        availabilities[time_slot.id] = availability.is_available
-        
+    # Slots without a stored row are unavailable, as they are to the scheduler
     context = {
         'faculty': faculty,
         'time_slots': time_slots,
-        'availabilities': availabilities,
+        'availabilities': availability_of(faculty),
     }
     return render(request, 'timetable/faculty_availability.html', context)
 
-def generate_timetable(request):
+def bulk_availability(request):
     if request.method == 'POST':
-        try:
-            scheduler = TimetableScheduler()
-            schedules = scheduler.generate_timetable()
+        form = BulkAvailabilityForm(request.POST, request.FILES)
+        if form.is_valid():
+            data = form.cleaned_data
+            errors = []
+            if data['csv_file']:
+                wanted, errors = read_availability_csv(io.TextIOWrapper(data['csv_file'], encoding='utf-8-sig'))
+            else:
+                faculty_ids = {faculty.pk for faculty in data['faculties']}
+                if data['department']:
+                    faculty_ids.update(Faculty.objects.filter(department=data['department']).values_list('id', flat=True))
+                available = {time_slot.pk for time_slot in data['time_slots']}
+                slot_ids = TimeSlot.objects.values_list('id', flat=True)
+                wanted = {(faculty_id, slot_id): slot_id in available for faculty_id in faculty_ids for slot_id in slot_ids}
             
-            if schedules:
-                messages.success(request, "Timetable generated successfully!")
+            # A file with bad rows is rejected as a whole
+            result = set_availability(wanted) if not errors else {'created': 0, 'updated': 0, 'faculty': set()}
+            repaired = repair_after_availability(result['faculty'])
+            if request.POST.get('format') == 'json':
+                return JsonResponse({
+                    'success': not errors,
+                    'created': result['created'],
+                    'updated': result['updated'],
+                    'faculty': len(result['faculty']),
+                    'errors': [{'line': line, 'error': error} for line, error in errors],
+                    'timetable': repaired[1] if repaired else None,
+                }, status=400 if errors else 200)
+            if errors:
+                for line, error in errors[:20]:
+                    messages.error(request, f"Line {line}: {error}")
+                if len(errors) > 20:
+                    messages.error(request, f"... and {len(errors) - 20} more errors; nothing was changed.")
+                return redirect('bulk-availability')
+            messages.success(request, f"Availability updated: {result['created']} slots added, "
+                                      f"{result['updated']} changed for {len({key[0] for key in wanted})} faculty members.")
+            if repaired:
+                messages.add_message(request, *repaired)
+            return redirect('faculty-list')
+        if request.POST.get('format') == 'json':
+            return JsonResponse({'success': False, 'errors': form.errors.get_json_data()}, status=400)
+    else:
+        form = BulkAvailabilityForm()
+    return render(request, 'timetable/bulk_availability.html', {'form': form})
+
+def repair_after_availability(faculty_ids):
+    """
+    Repair the active timetable when it has classes of faculty whose availability
+    changed; returns a (message level, text) pair describing the outcome, or None.
+    Only the bounded repair steps run in the request: when they run out of
+    budget, the full re-solve is left to a background job. When no timetable
+    can fit the new availability at all, that is reported instead.
+    """
+    if not faculty_ids or not Schedule.objects.active().filter(course__faculty__in=faculty_ids).exists():
+        return None
+    # Move only the classes the new availability rules out
+    try:
+        scheduler = TimetableScheduler()
+        scheduler.repair_timetable(full=False)
+        if scheduler.schedule:
+            return messages.INFO, f"Timetable updated: {scheduler.solver.moved} classes moved."
+        if scheduler.solver.infeasible:
+            return messages.ERROR, ("No conflict-free timetable fits the new availability; "
+                                    "the timetable was left as it is.")
+        job = submit_repair_job()
+        return messages.WARNING, (f"The timetable needs a larger repair to fit the new availability; "
+                                  f"it runs in the background as job {job.pk}.")
+    except Exception as e:
+        return messages.ERROR, f"Error updating timetable: {str(e)}"
+
+def import_data(request):
+    result = None
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            # Large uploads are spooled to a temporary file by Django and read back one line at a time
+            stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+            importer = Importer(form.cleaned_data['kind']).run(read_rows(stream, format_for(upload.name)))
+            result = importer.as_dict()
+            if request.POST.get('format') == 'json':
+                return JsonResponse(result)
+            if importer.error_count:
+                messages.warning(request, f"{importer.error_count} rows could not be imported.")
             else:
-                messages.error(request, "Couldn't generate a conflict-free timetable with current constraints.")
-                
+                messages.success(request, f"Imported {importer.rows} rows.")
+        elif request.POST.get('format') == 'json':
+            return JsonResponse({'errors': form.errors.get_json_data()}, status=400)
+    else:
+        form = ImportForm()
+    return render(request, 'timetable/import_data.html', {'form': form, 'result': result})
+
+def generate_timetable(request):
+    if request.method == 'POST':
+        try:
+            # Generation runs in the background; the job page follows its progress
+            job = submit_job(engine=request.POST.get('engine', 'backtracking'),
+                             seed=parse_int(request.POST.get('seed')),
+                             activate=not request.POST.get('candidate'))
         except Exception as e:
+            if request.POST.get('format') == 'json':
+                return JsonResponse({'success': False, 'error': str(e)}, status=400)
             messages.error(request, f"Error generating timetable: {str(e)}")
-            
-        return redirect('view-timetable')
+            return redirect('generate-timetable')
+
+        if request.POST.get('format') == 'json':
+            # Scripted callers poll the status URL until the job has finished
+            payload = job.as_dict()
+            payload['status_url'] = reverse('job-status', args=[job.pk])
+            return JsonResponse(payload, status=202)
+        return redirect('job-detail', job_id=job.pk)
         
-    return render(request, 'timetable/generate_timetable.html')
+    return render(request, 'timetable/generate_timetable.html', {'engines': sorted(TimetableScheduler.ENGINES)})
+
+def job_detail(request, job_id):
+    job = get_object_or_404(GenerationJob, pk=job_id)
+    if job.verbose and job.finished:
+        context = {
+            'algorithm_output': job.log,
+            'schedules': Schedule.objects.filter(version=job.version).select_related('course__faculty', 'room', 'time_slot')
+                         if job.version_id else [],
+            'stats_json': json.dumps(job.stats, indent=2) if job.stats else '',
+            'job': job,
+        }
+        return render(request, 'timetable/verbose_timetable_result.html', context)
+    return render(request, 'timetable/job_detail.html', {'job': job})
+
+def job_status(request, job_id):
+    job = get_object_or_404(GenerationJob, pk=job_id)
+    return JsonResponse(job.as_dict())
+
+def job_cancel(request, job_id):
+    job = get_object_or_404(GenerationJob, pk=job_id)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    if not job.finished:
+        cancel_job(job)
+        job.refresh_from_db()
+    if request.headers.get('Accept') == 'application/json':
+        return JsonResponse(job.as_dict())
+    messages.info(request, f"Cancellation of job {job.pk} requested.")
+    return redirect('job-detail', job_id=job.pk)
 
 def view_timetable(request):
     days = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT']
@@ -119,15 +257,47 @@ def view_timetable(request):
     # Get filter parameters
     filter_type = request.GET.get('type', 'all')
     selected_id = request.GET.get('id', '')
-    filter_title = None
     
-    # Get filter options for dropdowns
-    faculties = Faculty.objects.all().order_by('name')
-    rooms = Room.objects.all().order_by('name')
-    courses = Course.objects.all().order_by('code')
+    # The active version unless another one is asked for
+    version = None
+    version_id = request.GET.get('version')
+    if version_id:
+        version = TimetableVersion.objects.filter(pk=parse_int(version_id)).first()
+    if version is None:
+        version = TimetableVersion.active()
     
-    # Get base queryset depending on filter
-    schedules = Schedule.objects.all()
+    # The grid and the dropdown list are cached per version and filter until something they show changes
+    grid = cached('grid', lambda: timetable_grid(version, filter_type, selected_id, days),
+                  version.pk if version else None, filter_type, selected_id)
+    choices = {}
+    if filter_type in FILTER_CHOICES:
+        name, model, fields = FILTER_CHOICES[filter_type]
+        choices[name] = cached('choices', lambda: list(model.objects.order_by(fields[1]).values(*fields)), filter_type)
+    
+    context = {
+        'schedules': grid['schedules'],
+        'days': days,
+        'day_names': day_names,
+        'timetable': grid['timetable'],
+        'filter_type': filter_type,
+        'selected_id': selected_id,
+        'filter_title': grid['filter_title'],
+        'version': version,
+        **choices,
+    }
+    return render(request, 'timetable/view_timetable.html', context)
+
+# Dropdown list shown for each filter type: context name, model and the fields the template uses
+FILTER_CHOICES = {
+    'faculty': ('faculties', Faculty, ('id', 'name')),
+    'room': ('rooms', Room, ('id', 'name')),
+    'student': ('courses', Course, ('id', 'code', 'name')),
+}
+
+def timetable_grid(version, filter_type, selected_id, days):
+    """The classes of a version matching the filter, laid out as a grid of time rows by days"""
+    filter_title = None
+    schedules = Schedule.objects.filter(version=version)
     
     if filter_type == 'faculty' and selected_id:
         try:
@@ -153,54 +323,144 @@ def view_timetable(request):
         except Course.DoesNotExist:
             pass
     
-    # Order the schedules
-    schedules = schedules.order_by('time_slot__day', 'time_slot__start_time')
-    
-    # Get all distinct time slots ordered by start time
-    all_time_slots = TimeSlot.objects.values('start_time', 'end_time').distinct().order_by('start_time')
+    # One query for every class with its course, faculty, room and time slot
+    schedules = list(schedules.select_related('course__faculty', 'room', 'time_slot').order_by('room__name', 'id'))
     
-    # Create a nested dictionary to hold schedule data by time and day
-    timetable = {}
-    for ts in all_time_slots:
-        start_time = ts['start_time']
-        end_time = ts['end_time']
-        time_key = f"{start_time.strftime('%H:%M')}-{end_time.strftime('%H:%M')}"
-        
-        if time_key not in timetable:
-            timetable[time_key] = {
-                'start_time': start_time,
-                'end_time': end_time,
-                'days': {day: [] for day in days}  # Initialize empty list for each day
-            }
-    
-    # Populate the timetable with schedules
+    # Precompute the grid: one row per distinct (start, end) time, one list of classes per day
+    rows = {}
+    times = TimeSlot.objects.values_list('start_time', 'end_time').distinct().order_by('start_time', 'end_time')
+    for start_time, end_time in times:
+        rows[(start_time, end_time)] = {
+            'start_time': start_time,
+            'end_time': end_time,
+            'days': {day: [] for day in days},
+        }
     for schedule in schedules:
-        start_time = schedule.time_slot.start_time
-        end_time = schedule.time_slot.end_time
-        day = schedule.time_slot.day
-        time_key = f"{start_time.strftime('%H:%M')}-{end_time.strftime('%H:%M')}"
-        
-        if time_key in timetable:
-            timetable[time_key]['days'][day].append(schedule)
+        time_slot = schedule.time_slot
+        row = rows.get((time_slot.start_time, time_slot.end_time))
+        if row is not None and time_slot.day in row['days']:
+            row['days'][time_slot.day].append(schedule)
+    timetable_list = [
+        {'start_time': row['start_time'], 'end_time': row['end_time'],
+         'cells': [row['days'][day] for day in days]}
+        for row in rows.values()
+    ]
     
-    # Convert dictionary to sorted list for template
-    timetable_list = []
-    for time_key, data in sorted(timetable.items()):
-        timetable_list.append(data)
+    # The details table lists the classes by day, then time
+    day_order = {day: number for number, day in enumerate(days)}
+    schedules.sort(key=lambda schedule: (day_order.get(schedule.time_slot.day, len(days)),
+                                         schedule.time_slot.start_time))
+    return {'schedules': schedules, 'timetable': timetable_list, 'filter_title': filter_title}
+
+def export_timetable(request, export_format):
+    """
+    Download a timetable version (the active one by default), whole or
+    filtered like the timetable page, as CSV, iCalendar or JSON. The file
+    is streamed from one query while it is sent, whatever its size.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise Http404(f"Unknown export format '{export_format}'")
+    version_id = parse_int(request.GET.get('version'))
+    if version_id is not None:
+        version = get_object_or_404(TimetableVersion, pk=version_id)
+    else:
+        version = TimetableVersion.active()
+    filter_type = request.GET.get('type', 'all')
+    selected_id = parse_int(request.GET.get('id'))
     
-    context = {
-        'schedules': schedules,
-        'days': days,
-        'day_names': day_names,
-        'timetable': timetable_list,
-        'filter_type': filter_type,
-        'selected_id': selected_id,
-        'filter_title': filter_title,
-        'faculties': faculties,
-        'rooms': rooms,
-        'courses': courses,
-    }
-    return render(request, 'timetable/view_timetable.html', context)
+    rows = export_rows(version, filter_type, selected_id)
+    chunks = (chunk.encode() for chunk in export(export_format, rows, version))
+    if isinstance(request, ASGIRequest):
+        # An ASGI server needs an async iterator, or Django would buffer the whole file
+        chunks = async_chunks(chunks, batch=500)
+    content_type, extension = EXPORT_FORMATS[export_format]
+    name = 'timetable' if version is None else f"timetable-{version.pk}"
+    if filter_type in ('faculty', 'room', 'student') and selected_id is not None:
+        name += f"-{filter_type}-{selected_id}"
+    response = StreamingHttpResponse(chunks, content_type=f"{content_type}; charset=utf-8")
+    response['Content-Disposition'] = f'attachment; filename="{name}.{extension}"'
+    return response
+
+def api_version(request):
+    """Timetable version an API request reads, looked up once per request: ?version=, a cursor's, or the active one"""
+    if not hasattr(request, '_timetable_version'):
+        version_id = parse_int(request.GET.get('version'))
+        if request.GET.get('cursor'):
+            try:
+                version_id = decode_cursor(request.GET['cursor'])[0]
+            except ValueError:
+                pass
+        if version_id is not None:
+            request._timetable_version = TimetableVersion.objects.filter(pk=version_id).first()
+        else:
+            request._timetable_version = TimetableVersion.active()
+    return request._timetable_version
+
+def api_etag(request):
+    return version_etag(api_version(request), request.GET.urlencode())
+
+def api_last_modified(request):
+    version = api_version(request)
+    return version.updated_at if version else None
+
+@require_GET
+@condition(etag_func=api_etag, last_modified_func=api_last_modified)
+def api_schedules(request):
+    """
+    Read-only JSON list of scheduled classes, filtered by faculty, room,
+    course, day and time range, one page at a time. Each row is a list in
+    the order of "fields"; "next" is the URL of the following page. The
+    ETag and Last-Modified headers follow the timetable version, so a
+    client polling with If-None-Match gets 304 until the timetable changes.
+    """
+    version = api_version(request)
+    if version is None and (request.GET.get('version') or request.GET.get('cursor')):
+        return JsonResponse({'error': 'Unknown timetable version'}, status=404)
+    try:
+        filters = schedule_filters(request.GET)
+        limit = parse_limit(request.GET.get('limit'))
+        after = decode_cursor(request.GET['cursor'])[1] if request.GET.get('cursor') else 0
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    rows, more = schedule_page(version, filters, after, limit) if version else ([], False)
+    next_url = None
+    if more:
+        query = request.GET.copy()
+        query.pop('version', None)
+        query['cursor'] = encode_cursor(version.pk, rows[-1][0])
+        next_url = f"{request.path}?{query.urlencode()}"
+    response = JsonResponse({
+        'version': version.pk if version else None,
+        'updated_at': version.updated_at.isoformat() if version else None,
+        'fields': API_FIELDS,
+        'results': rows,
+        'next': next_url,
+    }, json_dumps_params={'separators': (',', ':')})
+    # Clients may keep the response but must check it is still current before using it again
+    patch_cache_control(response, no_cache=True)
+    return response
+
+def timetable_cache_stats(request):
+    """Hit and miss counts of the cached timetable pages"""
+    return JsonResponse(cache_stats())
+
+def timetable_versions(request):
+    versions = TimetableVersion.objects.annotate(classes=Count('schedules'))
+    return render(request, 'timetable/versions.html', {'versions': versions, 'active': TimetableVersion.active()})
+
+def activate_version(request, version_id):
+    version = get_object_or_404(TimetableVersion, pk=version_id)
+    if request.method == 'POST':
+        version.activate()
+        messages.success(request, f"{version} is now the published timetable.")
+    return redirect('timetable-versions')
+
+def version_diff(request, version_id, other_id):
+    """JSON changes from one timetable version to another"""
+    version = get_object_or_404(TimetableVersion, pk=version_id)
+    other = get_object_or_404(TimetableVersion, pk=other_id)
+    return JsonResponse(version.diff(other))
 
 def init_default_timeslots(request):
     if request.method == 'POST':
@@ -250,29 +510,12 @@ def init_default_timeslots(request):
 def verbose_generate_timetable(request):
     if request.method == 'POST':
         try:
-            # Capture output from algorithm
-            buffer = io.StringIO()
-            with redirect_stdout(buffer):
-                from timetable.management.commands.run_scheduler import VerboseTimetableScheduler
-                scheduler = VerboseTimetableScheduler(buffer)
-                schedules = scheduler.generate_timetable()
-            
-            algorithm_output = buffer.getvalue()
-            
-            if schedules:
-                messages.success(request, "Timetable generated successfully!")
-            else:
-                messages.error(request, "Couldn't generate a conflict-free timetable with current constraints.")
-                
-            context = {
-                'algorithm_output': algorithm_output,
-                'schedules': schedules
-            }
-            return render(request, 'timetable/verbose_timetable_result.html', context)
-                
+            # The execution log is captured by the job and shown once it has finished
+            job = submit_job(seed=parse_int(request.POST.get('seed')), verbose=True)
         except Exception as e:
             messages.error(request, f"Error generating timetable: {str(e)}")
             return redirect('view-timetable')
+        return redirect('job-detail', job_id=job.pk)
         
     return render(request, 'timetable/generate_timetable.html', {'verbose': True})
 
@@ -295,52 +538,112 @@ def create_sample_data(request):
 def animated_generate_timetable(request):
     """Generate timetable with animation steps"""
     # Reset any existing session data
-    if 'algorithm_steps' in request.session:
-        del request.session['algorithm_steps']
+    run = request.session.pop('algorithm_run', None)
+    if run is not None and os.path.exists(run['trace']):
+        os.remove(run['trace'])
         
     return render(request, 'timetable/animated_timetable.html')
 
+def timetable_stream(request):
+    """
+    Stream the steps of a fresh run as Server-Sent Events.
+    
+    The steps are produced lazily while the response is sent, so neither
+    the server nor the session holds the whole run. A final 'done' event
+    carries the run statistics and the candidate version the timetable
+    was stored as; the active timetable is left alone.
+    """
+    scheduler = AnimatedTimetableScheduler(seed=parse_int(request.GET.get('seed')))
+    events = sse_events(scheduler)
+    if isinstance(request, ASGIRequest):
+        # An ASGI server needs an async iterator, or Django would buffer the whole stream
+        events = async_chunks(events)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def sse_events(scheduler):
+    """The steps of an animated run encoded as Server-Sent Events"""
+    yield sse_message('start', {'seed': scheduler.seed, 'sessions': len(scheduler.problem.sessions)})
+    for number, step in enumerate(scheduler.iter_steps(activate=False)):
+        yield sse_message('step', step, event_id=number)
+    yield sse_message('done', {
+        'seed': scheduler.seed,
+        'success': bool(scheduler.schedule),
+        'version': scheduler.version.pk if scheduler.version else None,
+        'assignments_tried': scheduler.assignments_tried,
+        'backtracks': scheduler.backtracks,
+        'total_steps': scheduler.total_steps,
+        'profile': scheduler.stats.as_dict(),
+    })
+
+def sse_message(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return ('\n'.join(lines) + '\n\n').encode()
+
+async def async_chunks(iterator, batch=64):
+    """Consume a synchronous iterator from async code a batch at a time"""
+    next_batch = sync_to_async(lambda: list(islice(iterator, batch)))
+    while True:
+        chunks = await next_batch()
+        if not chunks:
+            return
+        yield b''.join(chunks)
+
 def timetable_step(request):
-    """AJAX endpoint to get the next step in the timetable generation algorithm"""
+    """AJAX endpoint to get one step of the timetable generation algorithm"""
     # Get step number from request
     step_number = request.GET.get('step', 0)
     try:
-        step_number = int(step_number)
+        step_number = max(int(step_number), 0)
     except ValueError:
         step_number = 0
+    # Optionally play a very long run as at most max_steps evenly spaced steps
+    try:
+        max_steps = max(int(request.GET.get('max_steps', 0)), 0)
+    except ValueError:
+        max_steps = 0
         
-    # Initialize algorithm in session if needed
-    if 'algorithm_steps' not in request.session:
-        # Create scheduler and initialize steps
-        scheduler = AnimatedTimetableScheduler()
-        steps = scheduler.initialize()
-        
-        # Store all steps in session
-        request.session['algorithm_steps'] = [step for step in scheduler.steps]
-        request.session['stats'] = {
+    # The first request runs the algorithm into a trace file, keeping any timetable found as a candidate;
+    # the session keeps its path and statistics
+    run = request.session.get('algorithm_run')
+    if run is None or not os.path.exists(run['trace']):
+        scheduler = AnimatedTimetableScheduler(seed=parse_int(request.GET.get('seed')))
+        path = new_trace_path()
+        with open(path, 'wb') as stream:
+            total_steps = scheduler.write_trace(stream, activate=False)
+        run = request.session['algorithm_run'] = {
+            'trace': path,
+            'seed': scheduler.seed,
+            'version': scheduler.version.pk if scheduler.version else None,
             'assignments_tried': scheduler.assignments_tried,
             'backtracks': scheduler.backtracks,
-            'total_steps': len(scheduler.steps)
+            'total_steps': total_steps,
+            'profile': scheduler.stats.as_dict()
         }
-        
-    # Get the requested step
-    steps = request.session.get('algorithm_steps', [])
-    stats = request.session.get('stats', {})
+    stats = {name: value for name, value in run.items() if name != 'trace'}
     
-    if step_number < len(steps):
-        step = steps[step_number]
-        is_complete = step_number >= len(steps) - 1
-        next_step = step_number + 1
-    else:
-        step = {'type': 'complete', 'message': 'Algorithm completed'}
-        is_complete = True
-        next_step = step_number
+    with StepTrace.open(run['trace']) as trace:
+        steps = trace.sample(max_steps) if max_steps else trace
+        total_steps = len(steps)
+        if step_number < total_steps:
+            step = steps[step_number]
+            is_complete = step_number >= total_steps - 1
+            next_step = step_number + 1
+        else:
+            step = {'type': 'complete', 'message': 'Algorithm completed'}
+            is_complete = True
+            next_step = step_number
         
     return JsonResponse({
         'step': step,
         'completed': is_complete,
         'next_step': next_step,
-        'total_steps': len(steps),
-        'progress': round((step_number / max(len(steps)-1, 1)) * 100) if len(steps) > 1 else 100,
+        'total_steps': total_steps,
+        'progress': round((step_number / max(total_steps-1, 1)) * 100) if total_steps > 1 else 100,
         'stats': stats
     })